@@ -0,0 +1,427 @@
+"""
+Shared traffic alert engine
+采集脚本和 Web 服务共用的告警判断。每个 (主机, 规则) 的状态保存在内存中，由采样流（采集脚本的每次采样、
+Web 服务的 SampleHub）驱动，判断是否为新告警不需要读写文件；状态由后台线程定期写入 JSON 文件，
+重启后恢复，避免重复告警。
+
+- 滞回：超过阈值时进入告警状态，降到阈值 × clear_ratio 以下才解除，在阈值附近波动不会反复告警
+- 冷却：持续处于告警状态时，每 cooldown 秒最多再提醒一次（None 表示不再提醒）
+
+除 ALERT_* 的三个固定阈值（只看最近一次采样）外，还可以在 config.py 的 ALERT_RULES 中配置滑动窗口规则，
+例如 15 分钟平均下载速度、每天上传流量。每个 (主机, 网卡, 窗口长度) 维护一个滑动窗口，保存窗口内的
+采样增量和累计值，每个新采样追加一项并移出过期的项（均摊 O(1)），规则直接读取累计值，不重新查询历史数据。
+进程启动后第一次遇到某台主机时，从 1 分钟预聚合表补齐窗口。
+
+每个主机的状态只由一个线程更新（本机：采集线程或 SampleHub 轮询线程；远程主机：上报写入线程），
+状态记录是不可变的元组，整体替换，读取方无需加锁。
+"""
+
+import json
+import os
+import threading
+from collections import deque, namedtuple
+
+import storage
+
+# 默认阈值和参数（可在 config.py 中覆盖）
+DOWNLOAD_THRESHOLD_MB = 100
+UPLOAD_THRESHOLD_MB = 50
+SPEED_THRESHOLD_MBPS = 10
+COOLDOWN_SECONDS = 3600
+CLEAR_RATIO = 0.8
+# 状态有变化时写入文件的最长延迟（秒）
+SAVE_INTERVAL = 5
+
+MB = 1024 * 1024
+GB = 1024 * MB
+DAY_SECONDS = 86400
+# 窗口长度为 'day' 时按本地自然日累计（0 点清零），否则为秒数；0 表示只看最近一次采样
+WINDOW_DAY = 'day'
+
+# 指标：名称 -> (方向：0 下载 / 1 上传, 是否为速度, 单位, 换算系数)
+METRICS = {
+    'download_mb': (0, False, 'MB', 1 / MB),
+    'upload_mb': (1, False, 'MB', 1 / MB),
+    'download_gb': (0, False, 'GB', 1 / GB),
+    'upload_gb': (1, False, 'GB', 1 / GB),
+    'download_mbps': (0, True, 'Mbps', 8 / 1000000),
+    'upload_mbps': (1, True, 'Mbps', 8 / 1000000),
+}
+# 流量指标可用 sum（窗口内合计）/ max（单次采样最大值），速度指标可用 avg（按时间加权的平均速度）/ max
+AGGREGATIONS = {False: ('sum', 'max'), True: ('avg', 'max')}
+
+# 编译后的规则；window 为秒数或 WINDOW_DAY，scale 把字节数（速度为字节/秒）换算为 unit
+Rule = namedtuple('Rule', 'name iface window agg direction speed unit scale threshold template')
+
+# 固定阈值对应的规则（窗口为 0，只看最近一次采样）；名称和消息与旧版 check_traffic_alert() 相同
+THRESHOLD_RULES = (
+    ('download_volume', 'download_threshold_mb', 'download_mb', '下载流量告警：{value:.2f} MB (阈值：{threshold} MB)'),
+    ('upload_volume', 'upload_threshold_mb', 'upload_mb', '上传流量告警：{value:.2f} MB (阈值：{threshold} MB)'),
+    ('download_speed', 'speed_threshold_mbps', 'download_mbps', '下载速度告警：{value:.2f} Mbps (阈值：{threshold} Mbps)'),
+    ('upload_speed', 'speed_threshold_mbps', 'upload_mbps', '上传速度告警：{value:.2f} Mbps (阈值：{threshold} Mbps)'),
+)
+
+
+def threshold_rules(thresholds):
+    """ALERT_* 固定阈值对应的规则"""
+    rules = []
+    for name, key, metric, template in THRESHOLD_RULES:
+        direction, speed, unit, scale = METRICS[metric]
+        rules.append(Rule(name, '', 0, 'avg' if speed else 'sum', direction, speed, unit, scale,
+                          thresholds[key], template))
+    return rules
+
+
+def parse_rules(configs):
+    """把 ALERT_RULES 配置编译为规则，配置有误时抛出 ValueError
+
+    每条规则是一个字典，例如：
+        {'name': '15 分钟平均下载速度', 'metric': 'download_mbps', 'agg': 'avg', 'window': 900, 'threshold': 50}
+        {'name': '每日上传流量', 'metric': 'upload_gb', 'window': 'day', 'threshold': 10}
+    可选 'iface' 指定网卡（默认所有网卡合计）；'agg' 默认流量指标为 sum、速度指标为 avg。
+    """
+    rules = []
+    for config in configs or ():
+        name = config.get('name')
+        if not name or not isinstance(name, str):
+            raise ValueError(f'告警规则缺少 name：{config!r}')
+        metric = config.get('metric')
+        if metric not in METRICS:
+            raise ValueError(f'告警规则 {name} 的 metric 必须是 {", ".join(METRICS)} 之一')
+        direction, speed, unit, scale = METRICS[metric]
+        agg = config.get('agg', AGGREGATIONS[speed][0])
+        if agg not in AGGREGATIONS[speed]:
+            raise ValueError(f'告警规则 {name} 的 agg 必须是 {" / ".join(AGGREGATIONS[speed])} 之一')
+        window = config.get('window', 0)
+        if window != WINDOW_DAY and (not isinstance(window, (int, float)) or window < 0):
+            raise ValueError(f'告警规则 {name} 的 window 必须是非负秒数或 {WINDOW_DAY!r}')
+        threshold = config.get('threshold')
+        if not isinstance(threshold, (int, float)):
+            raise ValueError(f'告警规则 {name} 缺少数值 threshold')
+        template = f'{name}：{{value:.2f}} {unit} (阈值：{{threshold}} {unit})'
+        rules.append(Rule(name, config.get('iface', ''), window, agg, direction, speed, unit, scale,
+                          threshold, template))
+    return rules
+
+
+class SlidingWindow:
+    """一个 (主机, 网卡) 最近 length 秒内的采样增量
+
+    entries 按时间顺序保存 (timestamp, 接收增量, 发送增量, 间隔秒数)，同时维护三者的累计值；
+    需要最大值的字段用单调递减队列跟踪。每次 push 均摊 O(1)，读取累计值 O(1)。
+    """
+
+    __slots__ = ('length', 'entries', 'totals', 'maxima', 'day')
+
+    def __init__(self, length, max_fields=()):
+        self.length = length
+        self.entries = deque()
+        self.totals = [0, 0, 0]
+        # 字段编号 -> deque[(timestamp, value)]；0/1 为接收/发送增量，2/3 为接收/发送速度
+        self.maxima = {field: deque() for field in max_fields}
+        self.day = None
+
+    def clear(self):
+        self.entries.clear()
+        self.totals = [0, 0, 0]
+        for maxima in self.maxima.values():
+            maxima.clear()
+
+    def push(self, timestamp, received, sent, seconds):
+        if self.length == WINDOW_DAY:
+            day = storage.bucket_start(timestamp, DAY_SECONDS)
+            if day != self.day:
+                self.clear()
+                self.day = day
+
+        self.entries.append((timestamp, received, sent, seconds))
+        totals = self.totals
+        totals[0] += received
+        totals[1] += sent
+        totals[2] += seconds
+        if self.maxima:
+            values = (received, sent, received / seconds, sent / seconds)
+            for field, maxima in self.maxima.items():
+                value = values[field]
+                while maxima and maxima[-1][1] <= value:
+                    maxima.pop()
+                maxima.append((timestamp, value))
+
+        if self.length == WINDOW_DAY:
+            return
+        # 移出窗口之外的采样（至少保留最新一项，窗口为 0 时即只看最近一次采样）
+        cutoff = timestamp - self.length
+        entries = self.entries
+        while len(entries) > 1 and entries[0][0] <= cutoff:
+            _, old_received, old_sent, old_seconds = entries.popleft()
+            totals[0] -= old_received
+            totals[1] -= old_sent
+            totals[2] -= old_seconds
+        for maxima in self.maxima.values():
+            while len(maxima) > 1 and maxima[0][0] <= cutoff:
+                maxima.popleft()
+
+    def value(self, rule):
+        """规则在当前窗口上的值（已换算为规则的单位）"""
+        if rule.agg == 'max':
+            return self.maxima[rule.direction + (2 if rule.speed else 0)][0][1] * rule.scale
+        if rule.agg == 'avg':
+            seconds = self.totals[2]
+            return self.totals[rule.direction] / seconds * rule.scale if seconds > 0 else 0
+        return self.totals[rule.direction] * rule.scale
+
+
+def load_history(db_path, host, ifaces, since, until):
+    """从 1 分钟预聚合表读取 [since, until) 内的增量，用于补齐滑动窗口
+
+    返回 {iface: [(bucket, 接收增量, 发送增量, 间隔秒数)]}，间隔取与上一个桶的距离。
+    """
+    resolution = min(storage.ROLLUP_RESOLUTIONS)
+    placeholders = ', '.join('?' * len(ifaces))
+    conn = storage.connect(db_path)
+    try:
+        rows = conn.execute(f'''
+            SELECT iface, bucket, bytes_received, bytes_sent
+            FROM traffic_rollup
+            WHERE resolution = ? AND host = ? AND iface IN ({placeholders}) AND bucket >= ? AND bucket < ?
+            ORDER BY iface, bucket
+        ''', [resolution, host, *ifaces, since, until]).fetchall()
+    finally:
+        conn.close()
+
+    history = {}
+    previous = {}
+    for iface, bucket, received, sent in rows:
+        seconds = bucket - previous.get(iface, bucket - resolution)
+        previous[iface] = bucket
+        history.setdefault(iface, []).append((bucket, received, sent, seconds))
+    return history
+
+
+class AlertEngine:
+    """按采样判断告警，状态保存在内存中并异步持久化"""
+
+    def __init__(self, thresholds, rules=(), enabled=True, cooldown=COOLDOWN_SECONDS, clear_ratio=CLEAR_RATIO,
+                 state_file=None, save_interval=SAVE_INTERVAL, db_path=None, logger=None):
+        # thresholds: {'download_threshold_mb': ..., 'upload_threshold_mb': ..., 'speed_threshold_mbps': ...}
+        # rules: ALERT_RULES 配置（见 parse_rules）
+        self.thresholds = dict(thresholds)
+        self.rules = threshold_rules(self.thresholds) + parse_rules(rules)
+        names = [rule.name for rule in self.rules]
+        if len(set(names)) != len(names):
+            raise ValueError('告警规则名称不能重复')
+        self.enabled = enabled
+        self.cooldown = cooldown
+        self.clear_ratio = clear_ratio
+        self.state_file = state_file
+        self.save_interval = save_interval
+        # 设置后，第一次遇到某台主机时从该数据库的预聚合表补齐滑动窗口
+        self.db_path = db_path
+        self.logger = logger
+
+        # 需要的窗口：(iface, length) -> 需要跟踪最大值的字段
+        self._window_specs = {}
+        for rule in self.rules:
+            fields = self._window_specs.setdefault((rule.iface, rule.window), set())
+            if rule.agg == 'max':
+                fields.add(rule.direction + (2 if rule.speed else 0))
+        self._ifaces = {iface for iface, _ in self._window_specs if iface}
+        self._rule_order = {name: index for index, name in enumerate(names)}
+        # host -> {(iface, length): SlidingWindow}
+        self._windows = {}
+
+        # (host, rule) -> (active, since, last_notified, value, message)
+        self._state = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._wakeup = threading.Event()
+        self.load()
+
+    # 告警判断
+
+    def evaluate(self, host, timestamp, received, sent, prev_received, prev_sent, interval_seconds,
+                 interfaces=None, prev_interfaces=None):
+        """用一次采样更新告警状态，返回本次需要通知的告警消息（多条以换行分隔），没有则返回 None
+
+        timestamp 为采样时间（Unix 时间戳），冷却时间按采样时间计算。有按网卡配置的规则时，
+        interfaces / prev_interfaces 传入各网卡本次和上一次的累计值 {iface: (received, sent)}。
+        """
+        if not self.enabled or interval_seconds <= 0:
+            return None
+        windows = self._windows.get(host)
+        if windows is None:
+            windows = self._create_windows(host, timestamp)
+
+        counters = {'': (received, sent, prev_received, prev_sent)}
+        if self._ifaces and interfaces:
+            prev_interfaces = prev_interfaces or {}
+            for iface in self._ifaces:
+                if iface in interfaces:
+                    counters[iface] = interfaces[iface] + prev_interfaces.get(iface, (None, None))
+        for (iface, _), window in windows.items():
+            current = counters.get(iface)
+            # 没有上一次采样时无法计算增量
+            if current is None or current[2] is None:
+                continue
+            window.push(
+                timestamp,
+                storage.calculate_increment(current[0], current[2]),
+                storage.calculate_increment(current[1], current[3]),
+                interval_seconds
+            )
+
+        notify = []
+        for rule in self.rules:
+            window = windows[(rule.iface, rule.window)]
+            if window.entries:
+                self._update(host, rule, window.value(rule), timestamp, notify)
+
+        if notify:
+            self._wakeup.set()
+            return '\n'.join(notify)
+        return None
+
+    def _create_windows(self, host, timestamp):
+        windows = {
+            key: SlidingWindow(key[1], max_fields) for key, max_fields in self._window_specs.items()
+        }
+        lookback = max((DAY_SECONDS if length == WINDOW_DAY else length for _, length in windows), default=0)
+        if self.db_path and lookback > 0:
+            # 只补齐当前采样所在的桶之前的数据（当前采样可能已写入预聚合表）
+            until = storage.bucket_start(timestamp, min(storage.ROLLUP_RESOLUTIONS))
+            try:
+                history = load_history(self.db_path, host, sorted({iface for iface, _ in windows}),
+                                       timestamp - lookback, until)
+            except Exception as e:
+                history = {}
+                if self.logger:
+                    self.logger.warning(f'Could not load alert history for {host or "local host"}: {e}')
+            for (iface, length), window in windows.items():
+                if length:
+                    for bucket, received, sent, seconds in history.get(iface, ()):
+                        window.push(bucket, received, sent, seconds)
+        self._windows[host] = windows
+        return windows
+
+    def _update(self, host, rule, value, timestamp, notify):
+        """滞回和冷却：更新一条规则的状态，需要通知时把消息加入 notify"""
+        key = (host, rule.name)
+        active, since, last_notified, _, _ = self._state.get(key, (False, None, None, None, None))
+
+        if value > rule.threshold:
+            message = rule.template.format(value=value, threshold=rule.threshold)
+            if not active:
+                since = timestamp
+                last_notified = timestamp
+                notify.append(message)
+            elif self.cooldown is not None and timestamp - last_notified >= self.cooldown:
+                last_notified = timestamp
+                notify.append(message)
+            self._state[key] = (True, since, last_notified, value, message)
+            self._dirty = True
+        elif active:
+            if value < rule.threshold * self.clear_ratio:
+                # 保留 last_notified，重启后仍可判断冷却
+                self._state[key] = (False, None, last_notified, value, None)
+                if self.logger:
+                    self.logger.info(f'Alert cleared: {rule.name}' + (f' ({host})' if host else ''))
+            else:
+                message = rule.template.format(value=value, threshold=rule.threshold)
+                self._state[key] = (True, since, last_notified, value, message)
+            self._dirty = True
+
+    def describe_rules(self):
+        """规则配置（供 /api/alerts 展示）"""
+        return [
+            {'name': rule.name, 'iface': rule.iface, 'window': rule.window, 'agg': rule.agg,
+             'unit': rule.unit, 'threshold': rule.threshold}
+            for rule in self.rules
+        ]
+
+    def active(self, host=None):
+        """当前处于告警状态的规则，host 为 None 时返回所有主机"""
+        items = sorted(list(self._state.items()), key=lambda item: (item[0][0], self._rule_order.get(item[0][1], 0)))
+        return [
+            {'host': key[0], 'rule': key[1], 'since': since, 'last_notified': last_notified,
+             'value': value, 'message': message}
+            for key, (active, since, last_notified, value, message) in items
+            if active and (host is None or key[0] == host)
+        ]
+
+    def active_message(self, host=''):
+        """某主机当前的告警消息（多条以换行分隔），没有则返回 None"""
+        messages = [alert['message'] for alert in self.active(host)]
+        return '\n'.join(messages) if messages else None
+
+    # 持久化
+
+    def load(self):
+        """从状态文件恢复（文件不存在或损坏时从空状态开始）"""
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, 'r') as f:
+                records = json.load(f)
+            for record in records:
+                # 已从配置中删除的规则不再恢复
+                if record['rule'] in self._rule_order:
+                    self._state[(record['host'], record['rule'])] = (
+                        record['active'], record['since'], record['last_notified'], record['value'], record['message']
+                    )
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if self.logger:
+                self.logger.warning(f'Ignoring unreadable alert state {self.state_file}: {e}')
+
+    def save(self):
+        """把状态写入文件（先写临时文件再替换，读取方不会看到写了一半的文件）"""
+        if not self.state_file or not self._dirty:
+            return
+        with self._lock:
+            self._dirty = False
+            records = [
+                {'host': host, 'rule': rule, 'active': active, 'since': since,
+                 'last_notified': last_notified, 'value': value, 'message': message}
+                for (host, rule), (active, since, last_notified, value, message) in list(self._state.items())
+            ]
+            tmp_path = f'{self.state_file}.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(records, f, ensure_ascii=False)
+                os.replace(tmp_path, self.state_file)
+            except OSError:
+                self._dirty = True
+                raise
+
+    def start(self):
+        """启动后台保存线程（重复调用无副作用）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='alert-state', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止后台线程并保存最后的状态"""
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._save_logged()
+
+    def _save_logged(self):
+        try:
+            self.save()
+        except OSError as e:
+            if self.logger:
+                self.logger.error(f'Error saving alert state: {e}')
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wakeup.wait(self.save_interval)
+            self._wakeup.clear()
+            self._save_logged()
+            # 新告警会立即唤醒线程；合并短时间内的多次变化
+            self._stop_event.wait(0.5)
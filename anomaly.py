@@ -0,0 +1,207 @@
+"""
+Online anomaly detection on speed series
+按 (主机, 网卡, 一周中的小时, 方向) 维护下载 / 上传速度的基线（在线均值和方差），每个新采样与所在时段的
+基线比较，偏离超过 sigma 倍标准差时标记为异常。基线默认使用 Welford 算法累计全部历史，设置 alpha 时
+改用 EWMA（指数加权，较快适应流量模式的变化）；两者每个时段都只保存 (count, mean, m2) 三个数，内存占用固定。
+
+基线定期写入数据库的 anomaly_baseline 表（只写有变化的时段），重启后按主机读回，不必重新学习。
+与 alerts.AlertEngine 相同，每个主机只由一个线程更新，记录为不可变元组，整体替换。
+"""
+
+import math
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import storage
+
+# 默认参数（可在 config.py 中覆盖）
+SIGMA = 4
+# 时段内至少有这么多个采样后才开始判断（每周每个小时一个时段，5 分钟采样时每周 12 个）
+MIN_SAMPLES = 24
+# 偏离小于该值（Mbps）时不标记，避免空闲网卡上的微小波动
+MIN_DEVIATION_MBPS = 1
+# 写入数据库的间隔（秒）
+CHECKPOINT_INTERVAL = 60
+# 保留最近的异常标记数
+RECENT_SIZE = 200
+
+DIRECTIONS = ('download', 'upload')
+MBPS = 8 / 1000000  # bytes/s -> Mbps
+
+BASELINE_UPSERT_SQL = '''
+    INSERT INTO anomaly_baseline (host, iface, slot, direction, count, mean, m2)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(host, iface, slot, direction) DO UPDATE SET
+        count = excluded.count,
+        mean = excluded.mean,
+        m2 = excluded.m2
+'''
+
+
+def hour_of_week(timestamp):
+    """本地时间的一周中的小时（周一 0 点为 0，共 168 个时段）"""
+    local = time.localtime(timestamp)
+    return local.tm_wday * 24 + local.tm_hour
+
+
+class AnomalyDetector:
+    """按时段基线检测速度异常，基线保存在内存中并定期写入数据库"""
+
+    def __init__(self, db_path, sigma=SIGMA, min_samples=MIN_SAMPLES, alpha=None,
+                 min_deviation_mbps=MIN_DEVIATION_MBPS, checkpoint_interval=CHECKPOINT_INTERVAL, logger=None):
+        # Welford 的样本方差为 m2 / (count - 1)，至少需要 2 个采样
+        if not isinstance(min_samples, int) or min_samples < 2:
+            raise ValueError(f'ANOMALY_MIN_SAMPLES 必须是不小于 2 的整数：{min_samples!r}')
+        if alpha is not None and not 0 < alpha <= 1:
+            raise ValueError(f'ANOMALY_ALPHA 必须是 None 或 0~1 之间的数：{alpha!r}')
+        self.db_path = db_path
+        self.sigma = sigma
+        self.min_samples = min_samples
+        # None 为 Welford（m2 为离差平方和），否则为 EWMA 的平滑系数（m2 为加权方差）
+        self.alpha = alpha
+        self.min_deviation = min_deviation_mbps / MBPS
+        self.checkpoint_interval = checkpoint_interval
+        self.logger = logger
+
+        self.flagged = 0  # 累计标记的异常数
+        self.recent = deque(maxlen=RECENT_SIZE)
+
+        # host -> {(iface, slot, direction): (count, mean, m2)}
+        self._baselines = {}
+        # 有变化、尚未写入数据库的 (host, iface, slot, direction)
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    @property
+    def method(self):
+        return 'welford' if self.alpha is None else 'ewma'
+
+    def observe(self, host, timestamp, speeds):
+        """用一次采样更新基线，返回异常标记列表
+
+        speeds: {iface: (download_speed, upload_speed)}，单位 bytes/s，'' 为所有网卡合计。
+        先与更新前的基线比较，再把该采样计入基线（持续的变化会逐渐成为新的基线）。
+        """
+        baselines = self._baselines.get(host)
+        if baselines is None:
+            baselines = self._baselines[host] = self._load(host)
+        slot = hour_of_week(timestamp)
+
+        flags = []
+        changed = []
+        for iface, values in speeds.items():
+            for direction, value in zip(DIRECTIONS, values):
+                if value is None:
+                    continue
+                key = (iface, slot, direction)
+                count, mean, m2 = baselines.get(key, (0, 0.0, 0.0))
+
+                if count >= self.min_samples:
+                    stddev = math.sqrt(m2 if self.alpha is not None else m2 / (count - 1))
+                    deviation = value - mean
+                    if abs(deviation) > max(self.sigma * stddev, self.min_deviation):
+                        flags.append({
+                            'host': host,
+                            'iface': iface,
+                            'direction': direction,
+                            'timestamp': timestamp,
+                            'speed_mbps': round(value * MBPS, 3),
+                            'mean_mbps': round(mean * MBPS, 3),
+                            'stddev_mbps': round(stddev * MBPS, 3),
+                            'sigma': round(deviation / stddev, 1) if stddev else None
+                        })
+
+                count += 1
+                if self.alpha is None or count == 1:
+                    delta = value - mean
+                    mean += delta / count
+                    m2 = m2 + delta * (value - mean) if self.alpha is None else 0.0
+                else:
+                    delta = value - mean
+                    mean += self.alpha * delta
+                    m2 = (1 - self.alpha) * (m2 + self.alpha * delta * delta)
+                baselines[key] = (count, mean, m2)
+                changed.append((host,) + key)
+
+        with self._lock:
+            self._dirty.update(changed)
+        if flags:
+            self.flagged += len(flags)
+            self.recent.extend(flags)
+        return flags
+
+    def recent_flags(self, host=None, limit=50):
+        """最近的异常标记（新的在前），host 为 None 时返回所有主机"""
+        flags = [flag for flag in reversed(list(self.recent)) if host is None or flag['host'] == host]
+        return flags[:limit]
+
+    # 持久化
+
+    def _load(self, host):
+        """读取某主机已保存的基线（表不存在时从空基线开始）"""
+        conn = storage.connect(self.db_path)
+        try:
+            rows = conn.execute('''
+                SELECT iface, slot, direction, count, mean, m2 FROM anomaly_baseline WHERE host = ?
+            ''', (host,)).fetchall()
+        except sqlite3.OperationalError as e:
+            if self.logger:
+                self.logger.warning(f'Could not load anomaly baselines for {host or "local host"}: {e}')
+            rows = []
+        finally:
+            conn.close()
+        return {(iface, slot, direction): (count, mean, m2) for iface, slot, direction, count, mean, m2 in rows}
+
+    def checkpoint(self):
+        """把有变化的基线写入数据库，返回写入的行数"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return 0
+        rows = [
+            (host, iface, slot, direction) + self._baselines[host][(iface, slot, direction)]
+            for host, iface, slot, direction in dirty
+        ]
+        conn = storage.connect(self.db_path)
+        try:
+            conn.executemany(BASELINE_UPSERT_SQL, rows)
+            conn.commit()
+        except Exception:
+            # 下次重试
+            with self._lock:
+                self._dirty.update(dirty)
+            raise
+        finally:
+            conn.close()
+        return len(rows)
+
+    def start(self):
+        """启动后台写入线程（重复调用无副作用）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='anomaly-checkpoint', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止后台线程并写入最后的基线"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._checkpoint_logged()
+
+    def _checkpoint_logged(self):
+        try:
+            self.checkpoint()
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f'Error saving anomaly baselines: {e}')
+
+    def _run(self):
+        while not self._stop_event.wait(self.checkpoint_interval):
+            self._checkpoint_logged()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-sample cost of alerts.AlertEngine with many sliding-window rules
+
+生成 --rules 条规则（窗口 5 分钟到 1 天、各种指标和聚合方式，阈值足够高，不触发告警），
+按 --step 秒的间隔逐个送入 --samples 个采样，统计每个采样评估所有规则的耗时，并与时间预算比较：
+- incremental: alerts.AlertEngine，滑动窗口维护累计值，每个采样均摊 O(1)
+- rescan:      每个采样对每条规则重新扫描窗口内的历史采样（相当于每次重新查询历史数据），
+               只运行前 --rescan-samples 个采样
+
+用法：
+    python3 benchmarks/bench_alert_rules.py --rules 500 --samples 20000 --budget-ms 2
+"""
+
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import alerts   # noqa: E402
+import storage  # noqa: E402
+
+WINDOWS = (300, 900, 3600, 6 * 3600, 'day')
+METRIC_AGGS = [
+    (metric, agg)
+    for metric, (_, speed, _, _) in alerts.METRICS.items()
+    for agg in alerts.AGGREGATIONS[speed]
+]
+# 永不触发的阈值
+NEVER = 1e12
+
+
+def build_rules(count):
+    combos = itertools.cycle(itertools.product(WINDOWS, METRIC_AGGS))
+    return [
+        {'name': f'rule-{i}', 'metric': metric, 'agg': agg, 'window': window, 'threshold': NEVER}
+        for i, (window, (metric, agg)) in zip(range(count), combos)
+    ]
+
+
+def build_samples(count, step):
+    """(timestamp, 累计接收, 累计发送)，每步随机增量"""
+    random.seed(42)
+    ts = int(time.time()) - count * step
+    received = sent = 0
+    samples = []
+    for _ in range(count):
+        ts += step
+        received += random.randint(0, 50 * alerts.MB)
+        sent += random.randint(0, 5 * alerts.MB)
+        samples.append((ts, received, sent))
+    return samples
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run_incremental(rules, samples, step):
+    engine = alerts.AlertEngine(
+        {'download_threshold_mb': NEVER, 'upload_threshold_mb': NEVER, 'speed_threshold_mbps': NEVER},
+        rules=rules
+    )
+    timings = []
+    prev = None
+    for ts, received, sent in samples:
+        start = time.perf_counter()
+        engine.evaluate('', ts, received, sent, prev and prev[1], prev and prev[2], step)
+        timings.append(time.perf_counter() - start)
+        prev = (ts, received, sent)
+    return timings
+
+
+def run_rescan(rules, samples, step):
+    """对照组：每条规则每次都扫描历史采样计算窗口值"""
+    compiled = alerts.parse_rules(rules)
+    history = []
+    timings = []
+    prev = None
+    for ts, received, sent in samples:
+        start = time.perf_counter()
+        if prev is not None:
+            history.append((ts, received - prev[1], sent - prev[2], step))
+            day = storage.bucket_start(ts, alerts.DAY_SECONDS)
+            for rule in compiled:
+                if rule.window == alerts.WINDOW_DAY:
+                    entries = [h for h in history if storage.bucket_start(h[0], alerts.DAY_SECONDS) == day]
+                else:
+                    entries = [h for h in history if h[0] > ts - rule.window] or history[-1:]
+                values = [h[1 + rule.direction] for h in entries]
+                if rule.agg == 'max':
+                    value = max(v / h[3] if rule.speed else v for v, h in zip(values, entries)) * rule.scale
+                elif rule.agg == 'avg':
+                    value = sum(values) / sum(h[3] for h in entries) * rule.scale
+                else:
+                    value = sum(values) * rule.scale
+                assert value < rule.threshold
+        timings.append(time.perf_counter() - start)
+        prev = (ts, received, sent)
+    return timings
+
+
+def report(name, timings, budget):
+    over = sum(1 for t in timings if t > budget)
+    print(f'{name:<12}{len(timings):>9,}{percentile(timings, 0.5) * 1000:>10.3f}'
+          f'{percentile(timings, 0.99) * 1000:>10.3f}{max(timings) * 1000:>10.3f}'
+          f'{over / len(timings) * 100:>13.2f}%')
+    return over
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rules', type=int, default=500, help='number of rules (default 500)')
+    parser.add_argument('--samples', type=int, default=20000, help='samples to evaluate (default 20000)')
+    parser.add_argument('--step', type=int, default=5, help='seconds between samples (default 5)')
+    parser.add_argument('--budget-ms', type=float, default=2.0, help='per-sample time budget in ms (default 2)')
+    parser.add_argument('--rescan-samples', type=int, default=200,
+                        help='samples for the rescan baseline (default 200, 0 to skip)')
+    args = parser.parse_args()
+
+    rules = build_rules(args.rules)
+    samples = build_samples(args.samples, args.step)
+    budget = args.budget_ms / 1000
+    print(f'{args.rules} rules over windows {", ".join(str(w) for w in WINDOWS)}, '
+          f'sample every {args.step}s, budget {args.budget_ms} ms per sample')
+    print(f'{"mode":<12}{"samples":>9}{"p50 (ms)":>10}{"p99 (ms)":>10}{"max (ms)":>10}{"over budget":>14}')
+    over = report('incremental', run_incremental(rules, samples, args.step), budget)
+    if args.rescan_samples:
+        report('rescan', run_rescan(rules, samples[:args.rescan_samples], args.step), budget)
+    # 增量模式超出预算的采样超过 1% 时以非零状态退出，便于在 CI 中使用
+    sys.exit(1 if over > len(samples) * 0.01 else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Benchmark: dashboard reads while the collector writes (rollback journal vs WAL)
+
+一个写进程持续写入采样（每个事务写入 --batch 行，模拟采集脚本和清理任务），
+同时多个读线程反复执行 /api/traffic 的范围查询（默认最近 1 小时），统计读延迟和写入被拒绝的次数：
+- delete: 旧配置，默认回滚日志模式（journal_mode=DELETE）
+- wal:    storage.connect() 的配置（WAL + synchronous=NORMAL + 页缓存 / mmap）
+
+用法：
+    python3 benchmarks/bench_concurrent_rw.py --rows 200000 --seconds 5
+"""
+
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import storage  # noqa: E402
+
+READ_SQL = '''
+    SELECT timestamp, bytes_received, bytes_sent, download_speed, upload_speed
+    FROM traffic_data
+    WHERE timestamp BETWEEN ? AND ?
+    ORDER BY timestamp
+'''
+
+INSERT_SQL = '''
+    INSERT INTO traffic_data (timestamp, bytes_received, bytes_sent, download_speed, upload_speed)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+
+def open_connection(path, mode):
+    if mode == 'wal':
+        return storage.connect(path, check_same_thread=False)
+    conn = sqlite3.connect(path, timeout=storage.BUSY_TIMEOUT, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode = DELETE')
+    return conn
+
+
+def build_database(path, mode, count, step):
+    storage.init_database(path)
+    conn = open_connection(path, mode)
+    end_ts = int(time.time())
+    start_ts = end_ts - count * step
+    conn.executemany(INSERT_SQL, (
+        (start_ts + i * step, i * 150_000, i * 30_000, 500.0, 100.0) for i in range(count)
+    ))
+    conn.commit()
+    conn.close()
+    return end_ts
+
+
+def writer(path, mode, batch, start_ts, stop, commits, locked):
+    conn = open_connection(path, mode)
+    ts = start_ts
+    while not stop.is_set():
+        rows = [(ts + i, (ts + i) * 150_000, (ts + i) * 30_000, 500.0, 100.0) for i in range(batch)]
+        try:
+            conn.executemany(INSERT_SQL, rows)
+            conn.commit()
+        except sqlite3.OperationalError:
+            # 回滚日志模式下读者持有共享锁时，提交可能等到超时仍拿不到排他锁
+            conn.rollback()
+            locked.value += 1
+            continue
+        commits.value += 1
+        ts += batch
+    conn.close()
+
+
+def reader(path, mode, window, deadline, timings, errors):
+    conn = open_connection(path, mode)
+    while time.perf_counter() < deadline:
+        end_ts = int(time.time())
+        start = time.perf_counter()
+        try:
+            conn.execute(READ_SQL, (end_ts - window, end_ts)).fetchall()
+        except sqlite3.OperationalError:
+            errors.append(1)
+            continue
+        timings.append((time.perf_counter() - start) * 1000)
+    conn.close()
+
+
+def run(mode, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'traffic.db')
+        end_ts = build_database(path, mode, args.rows, args.step)
+        if mode == 'delete':
+            conn = sqlite3.connect(path)
+            conn.execute('PRAGMA journal_mode = DELETE')
+            conn.close()
+
+        stop = multiprocessing.Event()
+        commits = multiprocessing.Value('i', 0)
+        locked = multiprocessing.Value('i', 0)
+        process = multiprocessing.Process(
+            target=writer, args=(path, mode, args.batch, end_ts + 1, stop, commits, locked)
+        )
+        process.start()
+        time.sleep(0.2)
+
+        timings, errors = [], []
+        deadline = time.perf_counter() + args.seconds
+        threads = [
+            threading.Thread(target=reader, args=(path, mode, args.window, deadline, timings, errors))
+            for _ in range(args.readers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stop.set()
+        process.join()
+
+    timings.sort()
+    return {
+        'queries': len(timings),
+        'p50': statistics.median(timings) if timings else 0.0,
+        'p99': timings[int(len(timings) * 0.99)] if timings else 0.0,
+        'max': timings[-1] if timings else 0.0,
+        'errors': len(errors),
+        'commits': commits.value,
+        'locked': locked.value
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200_000, help='rows before the benchmark starts (default 200,000)')
+    parser.add_argument('--step', type=int, default=1, help='seconds between generated samples (default 1)')
+    parser.add_argument('--batch', type=int, default=1_000, help='rows per write transaction (default 1,000)')
+    parser.add_argument('--readers', type=int, default=4, help='concurrent reader threads (default 4)')
+    parser.add_argument('--window', type=int, default=3600, help='query window in seconds (default 3600)')
+    parser.add_argument('--seconds', type=float, default=5.0, help='duration per mode (default 5)')
+    args = parser.parse_args()
+
+    print(f'{"mode":<10}{"reads":>10}{"p50 (ms)":>12}{"p99 (ms)":>12}{"max (ms)":>12}'
+          f'{"read errors":>13}{"commits":>10}{"locked":>8}')
+    for mode in ('delete', 'wal'):
+        result = run(mode, args)
+        print(f'{mode:<10}{result["queries"]:>10,}{result["p50"]:>12.1f}{result["p99"]:>12.1f}'
+              f'{result["max"]:>12.1f}{result["errors"]:>13}{result["commits"]:>10}{result["locked"]:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /api/ingest write throughput on a single SQLite writer
+
+模拟多台主机并发上报（每个请求 --samples 个采样，每个采样 --ifaces 个网卡），统计写入吞吐：
+- per-request: 每个请求单独一个事务（batch_samples=1，相当于收到即写）
+- coalesced:   ingest.IngestWriter 的默认配置，合并队列中的请求，每次刷新一个事务，
+               预聚合和汇总表先在内存中按桶合并再 upsert
+
+用法：
+    python3 benchmarks/bench_ingest.py --hosts 50 --requests 20 --samples 60
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ingest   # noqa: E402
+import storage  # noqa: E402
+
+
+def build_requests(hosts, requests, samples, ifaces, step):
+    """每台主机 requests 个请求，按时间顺序；请求交错排列，模拟多台主机同时上报"""
+    start_ts = int(time.time()) - hosts * requests * samples * step
+    batches = []
+    for r in range(requests):
+        for h in range(hosts):
+            batch = []
+            for s in range(samples):
+                i = r * samples + s
+                interfaces = {
+                    f'eth{n}': (i * 150_000 + n, i * 30_000 + n, 500.0, 100.0) for n in range(ifaces)
+                }
+                batch.append((start_ts + i * step, i * 150_000 * ifaces, i * 30_000 * ifaces,
+                              500.0 * ifaces, 100.0 * ifaces, interfaces))
+            batches.append((f'host-{h:03d}', batch))
+    return batches
+
+
+def run(mode, batches, total):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'traffic.db')
+        storage.init_database(path)
+        if mode == 'per-request':
+            writer = ingest.IngestWriter(path, queue_size=len(batches), batch_samples=1, flush_interval=0)
+        else:
+            writer = ingest.IngestWriter(path, queue_size=len(batches))
+
+        start = time.perf_counter()
+        for host, samples in batches:
+            writer.submit(host, samples)
+        while writer.written + writer.duplicates < total:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        writer.stop()
+        return {'seconds': elapsed, 'rate': total / elapsed, 'flushes': writer.flushes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hosts', type=int, default=50, help='reporting hosts (default 50)')
+    parser.add_argument('--requests', type=int, default=20, help='requests per host (default 20)')
+    parser.add_argument('--samples', type=int, default=60, help='samples per request (default 60)')
+    parser.add_argument('--ifaces', type=int, default=2, help='interfaces per sample (default 2)')
+    parser.add_argument('--step', type=int, default=5, help='seconds between samples of one host (default 5)')
+    args = parser.parse_args()
+
+    batches = build_requests(args.hosts, args.requests, args.samples, args.ifaces, args.step)
+    total = args.hosts * args.requests * args.samples
+    print(f'{total:,} samples from {args.hosts} hosts, {len(batches):,} requests, {args.ifaces} interfaces each')
+    print(f'{"mode":<14}{"seconds":>10}{"samples/s":>12}{"transactions":>14}')
+    for mode in ('per-request', 'coalesced'):
+        result = run(mode, batches, total)
+        print(f'{mode:<14}{result["seconds"]:>10.2f}{result["rate"]:>12,.0f}{result["flushes"]:>14,}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite: web_server.py endpoints and traffic_collector.py on a synthetic database
+
+用 synthetic_db.py 生成（或用 --db 复制一个已生成的）数据库，在临时工作目录中导入 web_server 和
+traffic_collector（相对路径 data/traffic.db 指向该数据库），测量：
+- /api/traffic（1 小时到 31 天、指定网卡、降采样）、/api/stats、/api/export/csv：Flask 测试客户端，
+  每次请求前清空响应缓存（测量实际查询的开销），完整读取响应体
+- save_traffic_data()：守护模式的调用方式（持久连接、上一次采样在内存中），fixture 计数器数据源
+- cleanup_old_data(force=True)：原始数据保留 --retention-days 天（默认数据集的一半），
+  运行 --cleanup-repeat 次，每次运行后从副本恢复数据目录
+每项报告延迟（中位数、p95、最小、最大）和 tracemalloc 记录的 Python 内存峰值（单独运行一次，不计入延迟；
+不包括 SQLite 自身的页缓存）。
+
+结果以 JSON 写入 --json（含数据集参数、git 提交和运行环境），--compare 与之前的结果比较，
+中位数变慢超过 --threshold（且超过 0.5 毫秒）时以非零状态退出。
+
+用法：
+    python3 benchmarks/bench_suite.py --days 30 --step 60 --json results.json
+    python3 benchmarks/synthetic_db.py --days 365 --step 300 --output /tmp/year.db
+    python3 benchmarks/bench_suite.py --db /tmp/year.db --json year.json --compare baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from flask.logging import default_handler
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import storage        # noqa: E402
+import synthetic_db   # noqa: E402
+
+RESULTS_VERSION = 1
+# 中位数的变化小于该值（毫秒）时不视为变慢（亚毫秒级的项受调度噪声影响较大）
+MIN_REGRESSION_MS = 0.5
+# 比较结果时这些数据集参数应相同
+DATASET_KEYS = ('days', 'step', 'ifaces', 'hosts', 'partitioning')
+FIXTURE = os.path.join(REPO_DIR, 'fixtures', 'proc_net_dev.txt')
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def prepare_database(args, db_path):
+    """在工作目录中生成数据库，或复制 --db 指定的数据库（及其分区目录），返回数据集描述"""
+    if not args.db:
+        return synthetic_db.generate(
+            db_path, days=args.days, step=args.step, ifaces=args.ifaces, mbps=args.mbps, resets=args.resets,
+            remote_hosts=args.remote_hosts, partitioning=args.partitioning, seed=args.seed,
+            progress=lambda message: print(f'  {message}', file=sys.stderr)
+        )
+    # 复制前合并 WAL，只需复制主库文件
+    conn = storage.connect(args.db)
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+    shutil.copy(args.db, db_path)
+    partitions = storage.partitions_dir(args.db)
+    if os.path.isdir(partitions):
+        shutil.copytree(partitions, storage.partitions_dir(db_path))
+
+    conn = sqlite3.connect(db_path)
+    start_ts, end_ts = conn.execute(
+        "SELECT min_time, max_time FROM traffic_summary WHERE host = '' AND iface = ''"
+    ).fetchone()
+    hosts, count = conn.execute(
+        "SELECT COUNT(*), SUM(record_count) FROM traffic_summary WHERE iface = ''"
+    ).fetchone()
+    ifaces = [row[0] for row in conn.execute(
+        "SELECT iface FROM traffic_summary WHERE host = '' AND iface != '' ORDER BY iface"
+    )]
+    conn.close()
+    return {
+        'source': os.path.abspath(args.db),
+        'days': round((end_ts - start_ts) / 86400, 2),
+        'ifaces': ifaces,
+        'hosts': hosts,
+        'start_ts': start_ts,
+        'end_ts': end_ts,
+        'samples': count
+    }
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'runs': len(timings),
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 3),
+        'min_ms': round(timings[0] * 1000, 3),
+        'max_ms': round(timings[-1] * 1000, 3)
+    }
+
+
+def traced_peak(func):
+    """单独运行一次，返回 (结果, Python 内存峰值 KB)"""
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, round(peak / 1024, 1)
+
+
+def endpoint_cases(dataset):
+    """(名称, 路径, 参数)，时间范围相对于数据集的最后一个采样"""
+    end_ts = dataset['end_ts']
+    iface = dataset['ifaces'][0] if dataset['ifaces'] else None
+
+    def window(seconds):
+        start = max(dataset['start_ts'], end_ts - seconds)
+        return {'start': datetime.fromtimestamp(start).strftime(TIME_FORMAT),
+                'end': datetime.fromtimestamp(end_ts).strftime(TIME_FORMAT)}
+
+    cases = [
+        ('traffic_1h', '/api/traffic', window(3600)),
+        ('traffic_24h', '/api/traffic', window(86400)),
+        ('traffic_24h_raw_points500', '/api/traffic', {**window(86400), 'resolution': 'raw', 'points': 500}),
+        ('traffic_7d', '/api/traffic', window(7 * 86400)),
+        ('traffic_31d', '/api/traffic', window(31 * 86400)),
+        ('stats', '/api/stats', {}),
+        ('export_csv_24h', '/api/export/csv', window(86400)),
+    ]
+    if iface:
+        cases.insert(3, ('traffic_24h_iface', '/api/traffic', {**window(86400), 'iface': iface}))
+        cases.insert(-1, ('stats_iface', '/api/stats', {'iface': iface}))
+    return cases
+
+
+def run_endpoints(web_server, dataset, repeat):
+    client = web_server.app.test_client()
+    results = {}
+    for name, path, params in endpoint_cases(dataset):
+        def request():
+            # 测量实际查询，不使用响应缓存
+            with web_server.response_cache_lock:
+                web_server.response_cache.clear()
+            response = client.get(path, query_string=params)
+            body = response.get_data()
+            return response.status_code, len(body)
+
+        request()  # 预热（连接池、语句缓存）
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            status, size = request()
+            timings.append(time.perf_counter() - start)
+        (status, size), peak_kb = traced_peak(request)
+        results[name] = {**summarize(timings), 'peak_kb': peak_kb, 'status': status, 'bytes': size}
+        report(name, results[name])
+    return results
+
+
+def run_save(traffic_collector, repeat):
+    """守护模式的采集：持久连接，上一次采样保存在内存中"""
+    traffic_collector.COUNTER_SOURCE = 'fixture'
+    traffic_collector.COUNTER_FIXTURE = FIXTURE
+    conn = storage.connect(traffic_collector.DB_PATH)
+    try:
+        state = {'prev': traffic_collector.get_previous_data(conn)}
+
+        def save():
+            state['prev'] = traffic_collector.save_traffic_data(conn, state['prev']) or state['prev']
+
+        save()  # 预热（首次读取计数器、写入分区）
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            save()
+            timings.append(time.perf_counter() - start)
+        _, peak_kb = traced_peak(save)
+    finally:
+        conn.close()
+    result = {**summarize(timings), 'peak_kb': peak_kb}
+    report('save_traffic_data', result)
+    return result
+
+
+def run_cleanup(traffic_collector, retention_days, workdir, repeat):
+    """清理会删除数据：先保存数据目录的副本，每次运行后恢复"""
+    traffic_collector.RAW_RETENTION_DAYS = retention_days
+    data_dir = os.path.join(workdir, 'data')
+    snapshot = os.path.join(workdir, 'data.snapshot')
+    conn = storage.connect(traffic_collector.DB_PATH)
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+    shutil.copytree(data_dir, snapshot)
+
+    def restore():
+        shutil.rmtree(data_dir)
+        shutil.copytree(snapshot, data_dir)
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outcome = traffic_collector.cleanup_old_data(force=True)
+        timings.append(time.perf_counter() - start)
+        restore()
+    _, peak_kb = traced_peak(lambda: traffic_collector.cleanup_old_data(force=True))
+    shutil.rmtree(snapshot)
+
+    result = {
+        **summarize(timings), 'peak_kb': peak_kb, 'retention_days': retention_days,
+        'deleted_samples': outcome['traffic_data'], 'deleted_interface_rows': outcome['interface_traffic'],
+        'deleted_rollup_rows': outcome['traffic_rollup'], 'dropped_partitions': outcome['partitions'],
+        'complete': outcome['complete']
+    }
+    report('cleanup_old_data', result)
+    return result
+
+
+def report(name, result):
+    print(f'{name:<28}{result["runs"]:>6}{result["median_ms"]:>12.2f}{result["p95_ms"]:>12.2f}'
+          f'{result["max_ms"]:>12.2f}{result["peak_kb"]:>14,.0f}')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, dataset, baseline_path, threshold):
+    """与之前的结果比较中位数，返回变慢超过 threshold 的项数"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f'\ncompared with {baseline_path} (commit {baseline["meta"].get("commit")})')
+    differences = [key for key in DATASET_KEYS if baseline['dataset'].get(key) != dataset.get(key)]
+    if differences:
+        print(f'warning: dataset differs from the baseline ({", ".join(differences)}), results are not comparable')
+    print(f'{"benchmark":<28}{"before (ms)":>12}{"after (ms)":>12}{"change":>10}')
+    regressions = 0
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if not before:
+            continue
+        change = result['median_ms'] / before['median_ms'] - 1 if before['median_ms'] else 0
+        regressed = change > threshold and result['median_ms'] - before['median_ms'] > MIN_REGRESSION_MS
+        regressions += regressed
+        print(f'{name:<28}{before["median_ms"]:>12.2f}{result["median_ms"]:>12.2f}{change * 100:>+9.1f}%'
+              + ('  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    synthetic_db.add_dataset_args(parser)
+    parser.add_argument('--db', help='copy an existing (generated) database instead of generating one')
+    parser.add_argument('--repeat', type=int, default=20, help='timed runs per benchmark (default 20)')
+    parser.add_argument('--cleanup-repeat', type=int, default=3,
+                        help='timed cleanup_old_data runs, each on a restored copy (default 3)')
+    parser.add_argument('--retention-days', type=float,
+                        help='raw retention for cleanup_old_data (default half of the dataset)')
+    parser.add_argument('--json', help='write results to this file (- for stdout)')
+    parser.add_argument('--compare', help='previous results file to compare medians against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative median slowdown counted as a regression (default 0.2)')
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='ntm-bench-')
+    try:
+        db_path = os.path.join(workdir, 'data', 'traffic.db')
+        os.makedirs(os.path.dirname(db_path))
+        print(f'preparing database in {workdir}', file=sys.stderr)
+        dataset = prepare_database(args, db_path)
+
+        # 在工作目录中导入，相对路径的数据库和日志目录都指向临时目录
+        os.chdir(workdir)
+        import web_server
+        import traffic_collector
+        # 日志仍写入工作目录中的文件（由日志线程写入），只去掉 Flask 默认的控制台输出
+        web_server.log_listener.handlers = tuple(
+            handler for handler in web_server.log_listener.handlers if handler is not default_handler
+        )
+        for module in (web_server, traffic_collector):
+            if os.path.abspath(module.DB_PATH) != db_path:
+                sys.exit(f'{module.__name__}.DB_PATH is {module.DB_PATH} (config.py?), expected the benchmark database')
+
+        print(f'{dataset["samples"]:,} samples over {dataset["days"]} days, '
+              f'{len(dataset["ifaces"])} interfaces, {dataset["hosts"]} hosts')
+        print(f'{"benchmark":<28}{"runs":>6}{"median (ms)":>12}{"p95 (ms)":>12}{"max (ms)":>12}{"peak (KB)":>14}')
+        results = run_endpoints(web_server, dataset, args.repeat)
+        web_server.sample_hub.stop()
+        results['save_traffic_data'] = run_save(traffic_collector, args.repeat)
+        retention_days = args.retention_days or max(1, dataset['days'] / 2)
+        results['cleanup_old_data'] = run_cleanup(traffic_collector, retention_days, workdir, args.cleanup_repeat)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = {
+        'version': RESULTS_VERSION,
+        'meta': {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeat': args.repeat,
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        },
+        'dataset': dataset,
+        'results': results
+    }
+    if args.json == '-':
+        json.dump(output, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2)
+
+    if args.compare:
+        sys.exit(1 if compare(results, dataset, args.compare, args.threshold) else 0)
+
+
+if __name__ == '__main__':
+    main()
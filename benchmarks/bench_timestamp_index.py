@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Benchmark: TEXT timestamps without index vs INTEGER epoch timestamps with index
+
+对比 traffic_data 两种结构在大数据量下的查询延迟：
+- legacy: timestamp 为 TEXT 本地时间，无索引（schema 版本 0）
+- epoch:  timestamp 为 INTEGER Unix 时间戳，带索引（schema 版本 1）
+
+用法：
+    python3 benchmarks/bench_timestamp_index.py --rows 1000000
+"""
+
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+LEGACY_SCHEMA = '''
+    CREATE TABLE traffic_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME,
+        bytes_received INTEGER,
+        bytes_sent INTEGER,
+        download_speed REAL,
+        upload_speed REAL
+    )
+'''
+
+EPOCH_SCHEMA = '''
+    CREATE TABLE traffic_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp INTEGER NOT NULL,
+        bytes_received INTEGER,
+        bytes_sent INTEGER,
+        download_speed REAL,
+        upload_speed REAL
+    );
+    CREATE INDEX idx_traffic_data_timestamp ON traffic_data (timestamp);
+'''
+
+
+def generate_rows(count, step, end_ts):
+    start_ts = end_ts - count * step
+    received = sent = 0
+    for i in range(count):
+        received += 150_000 + (i * 7919) % 90_000
+        sent += 30_000 + (i * 104_729) % 20_000
+        yield start_ts + i * step, received, sent
+
+
+def build_database(path, epoch, count, step, end_ts):
+    conn = sqlite3.connect(path)
+    conn.executescript(EPOCH_SCHEMA if epoch else LEGACY_SCHEMA)
+    if epoch:
+        rows = ((ts, rx, tx, 0.0, 0.0) for ts, rx, tx in generate_rows(count, step, end_ts))
+    else:
+        rows = (
+            (datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S'), rx, tx, 0.0, 0.0)
+            for ts, rx, tx in generate_rows(count, step, end_ts)
+        )
+    conn.executemany('''
+        INSERT INTO traffic_data (timestamp, bytes_received, bytes_sent, download_speed, upload_speed)
+        VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    return conn
+
+
+def measure(conn, sql, params, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def queries(epoch, end_ts):
+    day_start = end_ts - 86400
+    if epoch:
+        start, end = day_start, end_ts
+        # MIN/MAX 拆成两个子查询才能走索引
+        range_sql = 'SELECT (SELECT MIN(timestamp) FROM traffic_data), (SELECT MAX(timestamp) FROM traffic_data)'
+    else:
+        start = datetime.fromtimestamp(day_start).strftime('%Y-%m-%d %H:%M:%S')
+        end = datetime.fromtimestamp(end_ts).strftime('%Y-%m-%d %H:%M:%S')
+        range_sql = 'SELECT MIN(timestamp), MAX(timestamp) FROM traffic_data'
+    return [
+        ('range 24h (/api/traffic)',
+         'SELECT timestamp, bytes_received, bytes_sent FROM traffic_data '
+         'WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp', (start, end)),
+        ('MIN/MAX (/api/data-range)', range_sql, ()),
+        ('latest row (get_previous_data)',
+         'SELECT timestamp, bytes_received, bytes_sent FROM traffic_data '
+         'ORDER BY timestamp DESC LIMIT 1', ()),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000, help='rows per database (default 1,000,000)')
+    parser.add_argument('--step', type=int, default=30, help='seconds between samples (default 30)')
+    parser.add_argument('--repeat', type=int, default=5, help='repetitions per query (median reported)')
+    args = parser.parse_args()
+
+    end_ts = int(time.time())
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for label, epoch in (('legacy', False), ('epoch', True)):
+            start = time.perf_counter()
+            conn = build_database(os.path.join(tmp, f'{label}.db'), epoch, args.rows, args.step, end_ts)
+            print(f'built {label} database with {args.rows:,} rows in {time.perf_counter() - start:.1f}s')
+            results[label] = [
+                (name, measure(conn, sql, params, args.repeat))
+                for name, sql, params in queries(epoch, end_ts)
+            ]
+            conn.close()
+
+    print()
+    print(f'{"query":<34}{"legacy (ms)":>14}{"epoch (ms)":>14}{"speedup":>10}')
+    for (name, legacy_ms), (_, epoch_ms) in zip(results['legacy'], results['epoch']):
+        print(f'{name:<34}{legacy_ms:>14.2f}{epoch_ms:>14.2f}{legacy_ms / epoch_ms:>9.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Benchmark: Python per-row delta loop vs SQL window functions for /api/traffic
+
+对比 get_traffic_data() 原始数据路径的两种实现：
+- loop: 逐行读取 sqlite3.Row，在 Python 中计算增量和速度（旧实现）
+- columnar: web_server.query_raw_series()，一次取出元组并按列计算增量，速度使用已保存的值
+
+用法：
+    python3 benchmarks/bench_traffic_series.py --rows 100000
+"""
+
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import web_server  # noqa: E402
+
+
+def build_database(path, count, step):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE traffic_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp INTEGER NOT NULL,
+            bytes_received INTEGER,
+            bytes_sent INTEGER,
+            download_speed REAL,
+            upload_speed REAL
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_traffic_data_timestamp ON traffic_data (timestamp)')
+    start_ts = int(time.time()) - count * step
+    received = sent = 0
+    rows = []
+    for i in range(count):
+        inc_received = 150_000 + (i * 7919) % 90_000
+        inc_sent = 30_000 + (i * 104_729) % 20_000
+        received += inc_received
+        sent += inc_sent
+        rows.append((start_ts + i * step, received, sent, inc_received / step, inc_sent / step))
+    conn.executemany('''
+        INSERT INTO traffic_data (timestamp, bytes_received, bytes_sent, download_speed, upload_speed)
+        VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    conn.close()
+    return start_ts, start_ts + count * step
+
+
+def loop_series(cursor, start_ts, end_ts):
+    """旧实现：逐行计算"""
+    cursor.execute('''
+        SELECT timestamp, bytes_received, bytes_sent
+        FROM traffic_data
+        WHERE timestamp BETWEEN ? AND ?
+        ORDER BY timestamp
+    ''', (start_ts, end_ts))
+    rows = cursor.fetchall()
+
+    timestamps, received, sent = [], [], []
+    incremental_received, incremental_sent = [], []
+    download_speeds, upload_speeds = [], []
+    prev_received = prev_sent = prev_timestamp = None
+    for row in rows:
+        timestamps.append(row['timestamp'])
+        received.append(row['bytes_received'])
+        sent.append(row['bytes_sent'])
+        if prev_received is not None:
+            incremental_received.append(max(0, row['bytes_received'] - prev_received))
+            incremental_sent.append(max(0, row['bytes_sent'] - prev_sent))
+        else:
+            incremental_received.append(0)
+            incremental_sent.append(0)
+        if prev_received is not None and prev_timestamp:
+            time_diff = row['timestamp'] - prev_timestamp
+            if time_diff > 0:
+                download_speeds.append(max(0, (row['bytes_received'] - prev_received) / time_diff))
+                upload_speeds.append(max(0, (row['bytes_sent'] - prev_sent) / time_diff))
+            else:
+                download_speeds.append(0)
+                upload_speeds.append(0)
+        else:
+            download_speeds.append(0)
+            upload_speeds.append(0)
+        prev_received = row['bytes_received']
+        prev_sent = row['bytes_sent']
+        prev_timestamp = row['timestamp']
+    return timestamps
+
+
+def columnar_series(cursor, start_ts, end_ts):
+    return web_server.query_raw_series(
+        cursor.connection, 'traffic_data', ['timestamp BETWEEN ? AND ?'], [start_ts, end_ts]
+    )['timestamps']
+
+
+def measure(func, conn, start_ts, end_ts, repeat):
+    timings = []
+    for _ in range(repeat):
+        cursor = conn.cursor()
+        start = time.perf_counter()
+        points = len(func(cursor, start_ts, end_ts))
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), points
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000, help='rows in the query window (default 100,000)')
+    parser.add_argument('--step', type=int, default=1, help='seconds between samples (default 1)')
+    parser.add_argument('--repeat', type=int, default=5, help='repetitions per implementation (median reported)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'traffic.db')
+        start_ts, end_ts = build_database(path, args.rows, args.step)
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+
+        loop_ms, loop_points = measure(loop_series, conn, start_ts, end_ts, args.repeat)
+        columnar_ms, columnar_points = measure(columnar_series, conn, start_ts, end_ts, args.repeat)
+        conn.close()
+
+    print(f'{"implementation":<20}{"points":>10}{"median (ms)":>14}')
+    print(f'{"python loop":<20}{loop_points:>10,}{loop_ms:>14.1f}')
+    print(f'{"columnar":<20}{columnar_points:>10,}{columnar_ms:>14.1f}')
+    print(f'speedup: {loop_ms / columnar_ms:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
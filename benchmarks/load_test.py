@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Load test: concurrent dashboard clients against the web server
+
+每个模拟客户端循环执行仪表盘打开时的请求序列（与 templates/index.html 相同，HTTP/1.1 长连接）：
+    GET /、/api/hosts、/api/data-range 与 /api/interfaces（两个连接并发）、/api/traffic?points=1000
+其中 --custom-range-ratio 比例的 /api/traffic 使用随机的开始 / 结束时间（不命中响应缓存）。
+--stream 时每个客户端另外保持一个 /api/stream 推送连接，超出服务端推送连接上限被拒绝（503）的单独计数。
+--think 为两轮之间的平均停顿（秒，指数分布），默认 0 即每个客户端连续发送，测量吞吐上限。
+
+默认在临时目录中生成数据库（synthetic_db.py）并启动 serve.py（--server dev 时启动开发服务器
+python3 web_server.py 作为对照），--url 时压测已运行的服务。每个 --clients 级别先预热 --warmup 秒，
+再统计 --duration 秒内完成的请求：每秒请求数、延迟中位数 / p95 / p99 和错误数。
+压测客户端与服务端在同一台机器上时共享 CPU，结果用于比较不同配置，不代表服务端单独的上限。
+
+用法：
+    python3 benchmarks/load_test.py --clients 50,100,200,500
+    python3 benchmarks/load_test.py --server dev --clients 50,100
+    python3 benchmarks/load_test.py --url http://monitor:5003 --clients 100 --stream --think 5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic_db  # noqa: E402
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# 自定义时间范围的跨度（秒）：1 小时、6 小时、1 天、7 天
+CUSTOM_SPANS = (3600, 6 * 3600, 86400, 7 * 86400)
+TRAFFIC_POINTS = 1000
+SERVER_START_TIMEOUT = 60
+# 服务端写入心跳（每 STREAM_KEEPALIVE 秒）失败时才发现推送连接已断开，通常需要两次心跳；两个级别之间最多等待的秒数
+STREAM_DRAIN_TIMEOUT = 60
+
+
+class Stats:
+    """统计窗口内完成的请求"""
+
+    def __init__(self):
+        self.measuring = False
+        self.latencies = []
+        self.errors = 0
+        self.streams_open = 0
+        self.streams_rejected = 0
+
+    def record(self, seconds, ok):
+        if not self.measuring:
+            return
+        if ok:
+            self.latencies.append(seconds)
+        else:
+            self.errors += 1
+
+
+class Connection:
+    """最简单的 HTTP/1.1 长连接客户端（Content-Length 或 chunked 响应体）"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def send(self, path):
+        if self.writer is None:
+            await self.open()
+        self.writer.write(f'GET {path} HTTP/1.1\r\nHost: {self.host}\r\n\r\n'.encode('ascii'))
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed')
+        version, status = status_line.split()[:2]
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = version == b'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        return int(status), headers, keep_alive
+
+    async def request(self, path):
+        """发送请求并读完响应体，返回状态码"""
+        try:
+            status, headers, keep_alive = await self.send(path)
+            if headers.get('transfer-encoding', '').lower() == 'chunked':
+                while True:
+                    size = int((await self.reader.readline()).split(b';')[0], 16)
+                    await self.reader.readexactly(size + 2)
+                    if size == 0:
+                        break
+            elif 'content-length' in headers:
+                await self.reader.readexactly(int(headers['content-length']))
+            else:
+                await self.reader.read()
+                keep_alive = False
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            self.close()
+            raise
+        if not keep_alive:
+            self.close()
+        return status
+
+
+async def timed_request(conn, path, stats):
+    started = time.perf_counter()
+    try:
+        ok = await conn.request(path) == 200
+    except (OSError, asyncio.IncompleteReadError, ValueError):
+        ok = False
+    stats.record(time.perf_counter() - started, ok)
+
+
+def traffic_path(rng, data_range, custom_range_ratio):
+    if data_range is None or rng.random() >= custom_range_ratio:
+        return f'/api/traffic?points={TRAFFIC_POINTS}'
+    min_ts, max_ts = data_range
+    span = min(rng.choice(CUSTOM_SPANS), max_ts - min_ts)
+    start = rng.uniform(min_ts, max_ts - span)
+    fmt = '%Y-%m-%dT%H:%M'
+    return (f'/api/traffic?start={datetime.fromtimestamp(start).strftime(fmt)}'
+            f'&end={datetime.fromtimestamp(start + span).strftime(fmt)}&points={TRAFFIC_POINTS}')
+
+
+async def hold_stream(host, port, stats, stop):
+    """保持一个推送连接并读取事件，直到 stop"""
+    conn = Connection(host, port)
+    try:
+        status, _, _ = await conn.send('/api/stream')
+        if status != 200:
+            stats.streams_rejected += 1
+            return
+        stats.streams_open += 1
+        while not stop.is_set():
+            try:
+                if not await asyncio.wait_for(conn.reader.readline(), timeout=1):
+                    break
+            except asyncio.TimeoutError:
+                continue
+    except (OSError, asyncio.IncompleteReadError, ValueError):
+        stats.streams_rejected += 1
+    finally:
+        conn.close()
+
+
+async def dashboard_client(host, port, stats, stop, rng, data_range, args):
+    # 浏览器对同一主机并发多个连接，这里用两个
+    first, second = Connection(host, port), Connection(host, port)
+    stream = asyncio.create_task(hold_stream(host, port, stats, stop)) if args.stream else None
+    try:
+        while not stop.is_set():
+            await timed_request(first, '/', stats)
+            await timed_request(first, '/api/hosts', stats)
+            await asyncio.gather(timed_request(first, '/api/data-range', stats),
+                                 timed_request(second, '/api/interfaces', stats))
+            await timed_request(first, traffic_path(rng, data_range, args.custom_range_ratio), stats)
+            if args.think:
+                try:
+                    await asyncio.wait_for(stop.wait(), rng.expovariate(1 / args.think))
+                except asyncio.TimeoutError:
+                    pass
+    finally:
+        first.close()
+        second.close()
+        if stream is not None:
+            await stream
+
+
+async def run_level(host, port, clients, data_range, args):
+    stats = Stats()
+    stop = asyncio.Event()
+    rng = random.Random(clients)
+    tasks = [
+        asyncio.create_task(dashboard_client(host, port, stats, stop, random.Random(rng.random()), data_range, args))
+        for _ in range(clients)
+    ]
+    await asyncio.sleep(args.warmup)
+    stats.measuring = True
+    started = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    stats.measuring = False
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*tasks)
+    return summarize(clients, stats, elapsed)
+
+
+def summarize(clients, stats, elapsed):
+    latencies = sorted(stats.latencies)
+
+    def percentile(q):
+        return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 2) if latencies else None
+
+    return {
+        'clients': clients,
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1),
+        'median_ms': round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'errors': stats.errors,
+        'streams_open': stats.streams_open,
+        'streams_rejected': stats.streams_rejected
+    }
+
+
+def fetch_json(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def fetch_data_range(base_url):
+    """数据时间范围（Unix 时间戳），用于生成自定义范围的请求"""
+    try:
+        data = fetch_json(f'{base_url}/api/data-range')
+    except urllib.error.HTTPError:
+        return None
+    return (datetime.strptime(data['min_time'], TIME_FORMAT).timestamp(),
+            datetime.strptime(data['max_time'], TIME_FORMAT).timestamp())
+
+
+def wait_for_streams_closed(base_url):
+    """等待上一级别的推送连接在服务端释放（/metrics 中的订阅者数归零），否则下一级别的推送连接会被拒绝"""
+    deadline = time.monotonic() + STREAM_DRAIN_TIMEOUT
+    while time.monotonic() < deadline:
+        with urllib.request.urlopen(f'{base_url}/metrics', timeout=10) as response:
+            for line in response.read().decode('utf-8').splitlines():
+                if line.startswith('network_traffic_stream_subscribers '):
+                    if float(line.split()[1]) == 0:
+                        return
+        time.sleep(1)
+    print('warning: stream connections from the previous level are still open', file=sys.stderr)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, workdir):
+    """在工作目录中启动服务端（相对路径的数据库和日志目录指向临时目录），返回 (进程, 地址)"""
+    port = free_port()
+    if args.server == 'dev':
+        # 开发服务器的地址和端口来自配置，用 -c 覆盖
+        command = [sys.executable, '-c',
+                   f'import sys; sys.path.insert(0, {os.path.abspath(REPO_DIR)!r}); import web_server; '
+                   f'web_server.app.run(host="127.0.0.1", port={port}, debug=False)']
+    else:
+        command = [sys.executable, os.path.join(REPO_DIR, 'serve.py'), '--host', '127.0.0.1', '--port', str(port),
+                   '--threads', str(args.threads)]
+    process = subprocess.Popen(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f'server exited with status {process.returncode} (is waitress installed? pip3 install waitress)')
+        try:
+            fetch_json(f'{base_url}/api/hosts')
+            return process, base_url
+        except (OSError, ValueError):
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit('server did not start in time')
+
+
+def raise_open_files_limit():
+    """每个客户端最多三个连接，客户端和服务端在同一台机器上时需要更多的文件描述符"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', default='50,100,200,500',
+                        help='comma-separated concurrent client counts (default 50,100,200,500)')
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds per level (default 10)')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds before measuring (default 2)')
+    parser.add_argument('--think', type=float, default=0, help='mean pause between page loads in seconds (default 0)')
+    parser.add_argument('--custom-range-ratio', type=float, default=0.2,
+                        help='fraction of /api/traffic requests with a random range (default 0.2)')
+    parser.add_argument('--stream', action='store_true', help='each client also holds an /api/stream connection')
+    parser.add_argument('--url', help='test a running server instead of starting one')
+    parser.add_argument('--server', choices=['waitress', 'dev'], default='waitress',
+                        help='server to start: serve.py (waitress) or the Flask development server')
+    parser.add_argument('--threads', type=int, default=32, help='serve.py worker threads (default 32)')
+    parser.add_argument('--json', help='write results to this file')
+    synthetic_db.add_dataset_args(parser)
+    args = parser.parse_args()
+    levels = [int(value) for value in args.clients.split(',')]
+
+    open_files = raise_open_files_limit()
+    if open_files < max(levels) * 6 + 100:
+        print(f'warning: open files limit is {open_files}, some connections may fail', file=sys.stderr)
+
+    process = workdir = None
+    dataset = None
+    try:
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            workdir = tempfile.mkdtemp(prefix='ntm-load-')
+            os.makedirs(os.path.join(workdir, 'data'))
+            print(f'preparing database in {workdir}', file=sys.stderr)
+            dataset = synthetic_db.generate(
+                os.path.join(workdir, 'data', 'traffic.db'), days=args.days, step=args.step, ifaces=args.ifaces,
+                mbps=args.mbps, resets=args.resets, remote_hosts=args.remote_hosts,
+                partitioning=args.partitioning, seed=args.seed
+            )
+            process, base_url = start_server(args, workdir)
+
+        data_range = fetch_data_range(base_url)
+        if dataset and (data_range is None or int(data_range[1]) != dataset['end_ts']):
+            sys.exit('server is not using the generated database (config.py DB_PATH?)')
+
+        url = urlsplit(base_url)
+        server = args.url or (f'serve.py --threads {args.threads}' if args.server == 'waitress' else 'web_server.py (dev)')
+        print(f'{server}, {"streaming, " if args.stream else ""}think {args.think}s')
+        print(f'{"clients":>8}{"requests":>10}{"req/s":>10}{"median (ms)":>13}{"p95 (ms)":>11}{"p99 (ms)":>11}'
+              f'{"errors":>8}{"streams":>10}')
+        results = []
+        for i, clients in enumerate(levels):
+            if args.stream and i:
+                wait_for_streams_closed(base_url)
+            result = asyncio.run(run_level(url.hostname, url.port or 80, clients, data_range, args))
+            results.append(result)
+            streams = f'{result["streams_open"]}/{result["streams_rejected"]}' if args.stream else '-'
+            print(f'{clients:>8}{result["requests"]:>10}{result["rps"]:>10}{result["median_ms"]!s:>13}'
+                  f'{result["p95_ms"]!s:>11}{result["p99_ms"]!s:>11}{result["errors"]:>8}{streams:>10}', flush=True)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'server': server,
+                'options': {key: getattr(args, key) for key in ('duration', 'warmup', 'think', 'custom_range_ratio',
+                                                                 'stream', 'threads')},
+                'dataset': dataset,
+                'results': results
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Synthetic traffic database generator
+
+生成与采集脚本写入的结构相同的数据库（原始数据、各网卡数据、预聚合和汇总表），用于基准测试：
+- 速度按本地时间的日周期和周末系数变化，叠加对数正态噪声和偶发的短时突发
+- 各网卡按固定比例分摊流量，合计行为各网卡之和（与采集脚本相同）
+- --resets 次重启：停机若干个采样后所有计数器从 0 重新开始，重启后第一个采样速度为 0
+- 预聚合和汇总表与 /api/ingest 的写入路径相同（ingest.FlushGroup 每批在内存中按桶合并后 upsert）；
+  --partitioning day 时生成后再按天移入分区文件
+
+用法：
+    python3 benchmarks/synthetic_db.py --days 30 --step 60 --output /tmp/traffic.db
+    python3 benchmarks/synthetic_db.py --days 365 --step 300 --resets 12 --output /tmp/year.db
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ingest   # noqa: E402
+import storage  # noqa: E402
+
+IFACES = ('eth0', 'wlan0', 'eth1', 'docker0', 'tun0', 'eth2', 'eth3', 'eth4')
+# 各网卡分摊的流量比例（按 --ifaces 取前几个后归一化）
+IFACE_SHARES = (0.6, 0.2, 0.1, 0.05, 0.03, 0.01, 0.005, 0.005)
+UPLOAD_RATIO = 0.15
+# 每个采样出现突发的概率和倍数
+BURST_PROBABILITY = 0.002
+BURST_FACTOR = (5, 30)
+# 重启停机时长（秒）
+RESET_DOWNTIME = (120, 1800)
+# 每个事务写入的采样数
+CHUNK_SAMPLES = 20000
+
+
+def daily_factor(timestamp):
+    """本地时间的日周期（凌晨最低、傍晚最高）和周末系数"""
+    local = time.localtime(timestamp)
+    hour = local.tm_hour + local.tm_min / 60
+    factor = 0.55 - 0.45 * math.cos(2 * math.pi * (hour - 3) / 24)
+    return factor * (1.3 if local.tm_wday >= 5 else 1.0)
+
+
+def reset_times(start_ts, end_ts, count, rng):
+    return sorted(rng.uniform(start_ts, end_ts) for _ in range(count))
+
+
+def iter_samples(start_ts, end_ts, step, ifaces, mbps, resets, rng):
+    """按时间顺序生成一台主机的采样 (timestamp, received, sent, download, upload, [(iface, rx, tx, down, up)])"""
+    shares = IFACE_SHARES[:len(ifaces)]
+    shares = [share / sum(shares) for share in shares]
+    rate = mbps * 1000000 / 8
+    counters = {iface: [0, 0] for iface in ifaces}
+    pending_resets = reset_times(start_ts, end_ts, resets, rng)
+    previous_ts = None
+    ts = start_ts
+    while ts <= end_ts:
+        restarted = False
+        if pending_resets and ts >= pending_resets[0]:
+            # 重启：停机一段时间，计数器清零
+            pending_resets.pop(0)
+            ts += rng.randint(*RESET_DOWNTIME) // step * step
+            if ts > end_ts:
+                break
+            counters = {iface: [0, 0] for iface in ifaces}
+            restarted = True
+
+        elapsed = ts - previous_ts if previous_ts is not None else step
+        base = rate * daily_factor(ts)
+        if rng.random() < BURST_PROBABILITY:
+            base *= rng.uniform(*BURST_FACTOR)
+        interfaces = []
+        for iface, share in zip(ifaces, shares):
+            down = base * share * rng.lognormvariate(0, 0.5)
+            up = down * UPLOAD_RATIO * rng.lognormvariate(0, 0.3)
+            counter = counters[iface]
+            counter[0] += int(down * elapsed)
+            counter[1] += int(up * elapsed)
+            if previous_ts is None or restarted:
+                # 与采集脚本相同：没有上一次采样或计数器重置时速度为 0
+                down = up = 0.0
+            interfaces.append((iface, counter[0], counter[1], down, up))
+
+        received = sum(values[1] for values in interfaces)
+        sent = sum(values[2] for values in interfaces)
+        download = sum(values[3] for values in interfaces)
+        upload = sum(values[4] for values in interfaces)
+        yield ts, received, sent, download, upload, interfaces
+        previous_ts = ts
+        ts += step
+
+
+def generate(path, days=7, step=300, ifaces=2, mbps=20, resets=2, remote_hosts=0, partitioning=None,
+             end_ts=None, seed=42, progress=None):
+    """生成数据库，返回数据集描述（供结果文件记录）"""
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    rng = random.Random(seed)
+    end_ts = int(end_ts or time.time()) // step * step
+    start_ts = end_ts - int(days * 86400)
+    hosts = [''] + [f'host-{i:02d}' for i in range(1, remote_hosts + 1)]
+    iface_names = IFACES[:ifaces]
+
+    storage.init_database(path)
+    conn = storage.connect(path)
+    conn.execute('PRAGMA synchronous = OFF')
+    samples = 0
+    started = time.perf_counter()
+    finest = min(storage.ROLLUP_RESOLUTIONS)
+    try:
+        for host in hosts:
+            group = ingest.FlushGroup()
+            previous = {}  # iface -> (received, sent)，'' 为合计
+            for ts, received, sent, download, upload, interfaces in iter_samples(
+                start_ts, end_ts, step, iface_names, mbps, resets, rng
+            ):
+                bucket = storage.bucket_start(ts, finest)
+                group.raw.append((ts, host, received, sent, download, upload))
+                group.add(host, '', ts, bucket, received, sent, *previous.get('', (None, None)), download, upload)
+                previous[''] = (received, sent)
+                for iface, rx, tx, down, up in interfaces:
+                    group.interface_raw.append((ts, host, iface, rx, tx, down, up))
+                    group.add(host, iface, ts, bucket, rx, tx, *previous.get(iface, (None, None)), down, up)
+                    previous[iface] = (rx, tx)
+                if len(group.raw) >= CHUNK_SAMPLES:
+                    samples += write_group(conn, group)
+                    group = ingest.FlushGroup()
+                    if progress:
+                        progress(f'{samples:,} samples ({time.perf_counter() - started:.0f}s)')
+            samples += write_group(conn, group)
+    finally:
+        conn.close()
+
+    if partitioning:
+        storage.init_database(path, partitioning)
+
+    return {
+        'days': days,
+        'step': step,
+        'ifaces': list(iface_names),
+        'hosts': len(hosts),
+        'resets': resets,
+        'mbps': mbps,
+        'partitioning': partitioning,
+        'start_ts': start_ts,
+        'end_ts': end_ts,
+        'samples': samples,
+        'rows': samples * (1 + len(iface_names)),
+        'seed': seed,
+        'generate_seconds': round(time.perf_counter() - started, 2)
+    }
+
+
+def write_group(conn, group):
+    """一个事务写入一批采样及其预聚合、汇总（跨批次的桶由 upsert 累加）"""
+    conn.executemany('''
+        INSERT INTO traffic_data (timestamp, host, bytes_received, bytes_sent, download_speed, upload_speed)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', group.raw)
+    conn.executemany('''
+        INSERT INTO interface_traffic (timestamp, host, iface, bytes_received, bytes_sent, download_speed, upload_speed)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', group.interface_raw)
+    conn.executemany(storage.ROLLUP_UPSERT_SQL, group.rollup_rows())
+    conn.executemany(storage.SUMMARY_UPSERT_SQL, group.summary_rows())
+    conn.commit()
+    return len(group.raw)
+
+
+def add_dataset_args(parser):
+    """数据集参数（bench_suite.py 共用）"""
+    parser.add_argument('--days', type=float, default=7, help='days of history (default 7)')
+    parser.add_argument('--step', type=int, default=300, help='seconds between samples (default 300)')
+    parser.add_argument('--ifaces', type=int, default=2, choices=range(1, len(IFACES) + 1),
+                        help='interfaces per host (default 2)')
+    parser.add_argument('--mbps', type=float, default=20, help='average download speed in Mbps (default 20)')
+    parser.add_argument('--resets', type=int, default=2, help='counter resets (reboots) per host (default 2)')
+    parser.add_argument('--remote-hosts', type=int, default=0, help='additional ingested hosts (default 0)')
+    parser.add_argument('--partitioning', choices=['day'], help='store raw samples in daily partitions')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default 42)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_dataset_args(parser)
+    parser.add_argument('--output', required=True, help='database file to create')
+    args = parser.parse_args()
+
+    dataset = generate(
+        args.output, days=args.days, step=args.step, ifaces=args.ifaces, mbps=args.mbps, resets=args.resets,
+        remote_hosts=args.remote_hosts, partitioning=args.partitioning, seed=args.seed,
+        progress=lambda message: print(message, file=sys.stderr)
+    )
+    print(f'{dataset["samples"]:,} samples ({dataset["rows"]:,} rows) in {dataset["generate_seconds"]}s '
+          f'-> {args.output} ({os.path.getsize(args.output) / 1048576:.1f} MB)')
+
+
+if __name__ == '__main__':
+    main()
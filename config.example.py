@@ -4,6 +4,9 @@
 # Web 服务配置
 WEB_HOST = '0.0.0.0'
 WEB_PORT = 5003
+WEB_THREADS = 32  # serve.py 工作线程数
+WEB_CONNECTION_LIMIT = 1000  # serve.py 连接数上限
+STREAM_MAX_CLIENTS = None  # /api/stream 推送连接上限，None 为 WEB_THREADS - 8
 
 # 数据库配置
 DB_PATH = 'data/traffic.db'
@@ -15,9 +18,40 @@ LOG_BACKUP_COUNT = 5
 
 # 采集配置
 COLLECTION_INTERVAL = 300  # 5 分钟
+HIRES_SAMPLE_INTERVAL = None  # 守护模式下的高频采样间隔（秒），如 1
+HIRES_BUFFER_SECONDS = 900  # 高频采样缓冲区保留的秒数
+
+# 数据保留配置
+RAW_RETENTION_DAYS = 30  # 原始采样保留天数
+ROLLUP_RETENTION_DAYS = {60: 7, 300: 90, 3600: 730, 86400: None}  # 各粒度预聚合保留天数，None 为永久
+STORAGE_PARTITIONING = None  # 'day' 为原始数据按天分区（每天一个数据库文件）
+
+# 多主机上报配置
+INGEST_URL = None    # 上报到中心 Web 服务，如 'http://monitor:5003/api/ingest'
+INGEST_HOST = None   # 上报使用的主机名，None 为本机主机名
+INGEST_TOKEN = None  # 上报令牌（Web 服务和采集脚本使用同一个值），Web 服务设置后才接收上报
+INGEST_ENABLED = False  # 不设置令牌时是否接收上报（任何能访问 Web 服务的客户端都可以写入）
 
 # 告警配置
 ALERT_ENABLED = True
 ALERT_DOWNLOAD_THRESHOLD_MB = 100
 ALERT_UPLOAD_THRESHOLD_MB = 50
 ALERT_SPEED_THRESHOLD_MBPS = 10
+ALERT_COOLDOWN = 3600  # 持续告警时再次提醒的间隔（秒），None 为只提醒一次
+ALERT_CLEAR_RATIO = 0.8  # 降到阈值 × 该比例以下才解除告警
+# 滑动窗口告警规则（见 CONFIG.md）
+ALERT_RULES = [
+    # {'name': '15 分钟平均下载速度', 'metric': 'download_mbps', 'agg': 'avg', 'window': 900, 'threshold': 50},
+    # {'name': '每日上传流量', 'metric': 'upload_gb', 'window': 'day', 'threshold': 10},
+]
+
+# 速度异常检测（Web 服务，见 CONFIG.md）
+ANOMALY_ENABLED = False
+ANOMALY_SIGMA = 4  # 偏离多少倍标准差视为异常
+ANOMALY_MIN_SAMPLES = 24  # 每个时段（一周中的小时）累计多少个采样后开始判断
+ANOMALY_ALPHA = None  # None 为 Welford 累计全部历史，0~1 为 EWMA 平滑系数
+ANOMALY_MIN_DEVIATION_MBPS = 1
+
+# 耗时统计（Web 服务，见 CONFIG.md）
+PERF_ENABLED = True  # Server-Timing 响应头和 /api/debug/perf
+PERF_PROFILER_ENABLED = False  # /api/debug/perf/profile 采样分析器
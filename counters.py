@@ -0,0 +1,187 @@
+"""
+Network counter sources
+读取各网卡的累计收发字节数，供 traffic_collector.py 使用。
+
+- ProcNetDevSource: Linux，直接读取 /proc/net/dev，复用同一个文件描述符
+- NetstatSource:    macOS，调用 /usr/sbin/netstat -ib（兼容旧实现）
+- FixtureSource:    从抓取的 /proc/net/dev 或 netstat -ib 输出文件读取，用于测试和回放
+"""
+
+import os
+import sys
+import subprocess
+
+PROC_NET_DEV = '/proc/net/dev'
+NETSTAT_CMD = ['/usr/sbin/netstat', '-ib']
+
+# Linux 下默认忽略的回环和虚拟接口前缀
+LINUX_EXCLUDE_PREFIXES = ('lo', 'ifb', 'veth', 'docker', 'br-', 'virbr', 'tun', 'tap')
+# macOS 下只统计 en* 接口（与旧实现一致）
+DARWIN_INCLUDE_PREFIXES = ('en',)
+
+
+def parse_proc_net_dev(text):
+    """解析 /proc/net/dev 内容，返回 {iface: (bytes_received, bytes_sent)}"""
+    counters = {}
+    for line in text.splitlines()[2:]:
+        name, sep, data = line.partition(':')
+        if not sep:
+            continue
+        fields = data.split()
+        if len(fields) < 9:
+            continue
+        try:
+            # 接收字节数是第 1 列，发送字节数是第 9 列
+            counters[name.strip()] = (int(fields[0]), int(fields[8]))
+        except ValueError:
+            continue
+    return counters
+
+
+def parse_netstat_ib(text):
+    """解析 netstat -ib 输出，返回 {iface: (bytes_received, bytes_sent)}
+
+    netstat 会为每个地址重复输出一行相同的计数，这里每个接口只取第一行。
+    """
+    counters = {}
+    for line in text.strip().split('\n'):
+        parts = line.split()
+        if len(parts) < 10 or parts[0] == 'Name' or parts[0] in counters:
+            continue
+        # Ibytes is column 6, Obytes is column 9（没有 Address 列时各前移一列）
+        shift = 0 if len(parts) >= 11 else 1
+        try:
+            counters[parts[0]] = (int(parts[6 - shift]), int(parts[9 - shift]))
+        except ValueError:
+            continue
+    return counters
+
+
+def is_proc_net_dev(text):
+    return text.lstrip().startswith('Inter-|')
+
+
+class CounterSource:
+    """计数器数据源基类"""
+
+    name = 'base'
+
+    def __init__(self, include_prefixes=None, exclude_prefixes=None):
+        self.include_prefixes = tuple(include_prefixes) if include_prefixes else None
+        self.exclude_prefixes = tuple(exclude_prefixes) if exclude_prefixes else ()
+
+    def read_all(self):
+        """返回所有接口的原始计数 {iface: (bytes_received, bytes_sent)}"""
+        raise NotImplementedError
+
+    def read(self):
+        """返回过滤后的接口计数 {iface: (bytes_received, bytes_sent)}"""
+        return {
+            iface: values for iface, values in self.read_all().items()
+            if self.accepts(iface)
+        }
+
+    def accepts(self, iface):
+        if self.include_prefixes is not None and not iface.startswith(self.include_prefixes):
+            return False
+        return not iface.startswith(self.exclude_prefixes)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ProcNetDevSource(CounterSource):
+    """Linux: 通过 pread 读取 /proc/net/dev，不需要 fork/exec，也不重复打开文件"""
+
+    name = 'proc'
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, path=PROC_NET_DEV, include_prefixes=None,
+                 exclude_prefixes=LINUX_EXCLUDE_PREFIXES):
+        super().__init__(include_prefixes, exclude_prefixes)
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY)
+
+    def read_all(self):
+        chunks = []
+        offset = 0
+        while True:
+            chunk = os.pread(self._fd, self.READ_SIZE, offset)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+        return parse_proc_net_dev(b''.join(chunks).decode('ascii', 'replace'))
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class NetstatSource(CounterSource):
+    """macOS: 调用 netstat -ib（no popup window），作为后备数据源"""
+
+    name = 'netstat'
+
+    def __init__(self, include_prefixes=DARWIN_INCLUDE_PREFIXES, exclude_prefixes=None):
+        super().__init__(include_prefixes, exclude_prefixes)
+
+    def read_all(self):
+        result = subprocess.run(NETSTAT_CMD, capture_output=True, text=True, timeout=10)
+        if result.returncode != 0:
+            raise RuntimeError(f"netstat failed: {result.stderr.strip()}")
+        return parse_netstat_ib(result.stdout)
+
+
+class FixtureSource(CounterSource):
+    """从抓取的文件读取计数，每次调用都重新读取（可在运行中替换文件内容模拟流量变化）
+
+    根据文件表头识别是 /proc/net/dev 还是 netstat -ib 格式，并使用对应平台的默认接口过滤。
+    """
+
+    name = 'fixture'
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def read_all(self):
+        with open(self.path, 'r') as f:
+            text = f.read()
+        if is_proc_net_dev(text):
+            self.include_prefixes, self.exclude_prefixes = None, LINUX_EXCLUDE_PREFIXES
+            return parse_proc_net_dev(text)
+        self.include_prefixes, self.exclude_prefixes = DARWIN_INCLUDE_PREFIXES, ()
+        return parse_netstat_ib(text)
+
+
+def create_source(kind='auto', fixture=None):
+    """创建计数器数据源
+
+    kind: 'auto' | 'proc' | 'netstat' | 'fixture'
+    auto 时优先使用 fixture，其次 /proc/net/dev，最后回退到 netstat。
+    """
+    if kind == 'fixture' or (kind == 'auto' and fixture):
+        if not fixture:
+            raise ValueError("fixture source requires a fixture path")
+        return FixtureSource(fixture)
+    if kind == 'proc':
+        return ProcNetDevSource()
+    if kind == 'netstat':
+        return NetstatSource()
+    if kind != 'auto':
+        raise ValueError(f"unknown counter source: {kind}")
+
+    if sys.platform.startswith('linux') and os.path.exists(PROC_NET_DEV):
+        try:
+            return ProcNetDevSource()
+        except OSError:
+            pass
+    return NetstatSource()
@@ -0,0 +1,103 @@
+"""
+Series downsampling for /api/traffic
+在服务端把流量序列压缩到指定点数，返回给前端的数据量与查询范围无关。
+
+- lttb:   Largest-Triangle-Three-Buckets，选出最能保持曲线形状的点
+- minmax: 每个桶保留速度最低和最高的点，保证尖峰不会被平滑掉
+
+两种方法都只是“选点”：被选中的点保留原始的速度和累计值，增量值则把相邻两个
+选中点之间被丢弃的增量累加进来，因此选定时间段内的增量总和保持不变。
+"""
+
+METHODS = ('minmax', 'lttb')
+
+
+def bucket_bounds(count, buckets):
+    """把 [0, count) 均分为 buckets 个连续区间，返回 [(start, end), ...]"""
+    return [(count * i // buckets, count * (i + 1) // buckets) for i in range(buckets)]
+
+
+def lttb_indices(xs, ys, threshold):
+    """Largest-Triangle-Three-Buckets，返回选中点的下标（包含首尾两点）"""
+    count = len(xs)
+    if threshold >= count or threshold < 3:
+        return list(range(count))
+
+    indices = [0]
+    # 首尾两点固定保留，中间的点分成 threshold - 2 个桶
+    bounds = bucket_bounds(count - 2, threshold - 2)
+    selected = 0
+    for i, (start, end) in enumerate(bounds):
+        start += 1
+        end += 1
+        # 下一个桶的平均点（最后一个桶使用末尾点）
+        if i + 1 < len(bounds):
+            next_start, next_end = bounds[i + 1][0] + 1, bounds[i + 1][1] + 1
+        else:
+            next_start, next_end = count - 1, count
+        span = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / span
+        avg_y = sum(ys[next_start:next_end]) / span
+
+        ax, ay = xs[selected], ys[selected]
+        best_area = -1.0
+        best_index = start
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best_index = j
+        indices.append(best_index)
+        selected = best_index
+    indices.append(count - 1)
+    return indices
+
+
+def minmax_indices(ys, threshold):
+    """每个桶保留最小值和最大值所在的点（按时间顺序），并始终保留首尾两点"""
+    count = len(ys)
+    if threshold >= count or threshold < 3:
+        return list(range(count))
+
+    selected = {0, count - 1}
+    for start, end in bucket_bounds(count, max(1, (threshold - 2) // 2)):
+        if start >= end:
+            continue
+        bucket = range(start, end)
+        selected.add(min(bucket, key=ys.__getitem__))
+        selected.add(max(bucket, key=ys.__getitem__))
+    return sorted(selected)
+
+
+def downsample_series(series, max_points, method='minmax'):
+    """按 max_points 压缩 /api/traffic 的序列
+
+    series 中 timestamps 为 Unix 时间戳，incremental_* 为增量，其余为逐点取值的序列。
+    点数不超过 max_points 时原样返回。
+    """
+    timestamps = series['timestamps']
+    if len(timestamps) <= max_points:
+        return series
+    if method not in METHODS:
+        raise ValueError(f'unknown downsample method: {method}')
+
+    # 下载和上传速度之和：任一方向的尖峰都会体现出来
+    combined = [down + up for down, up in zip(series['download_speeds'], series['upload_speeds'])]
+    if method == 'lttb':
+        indices = lttb_indices(timestamps, combined, max_points)
+    else:
+        indices = minmax_indices(combined, max_points)
+
+    result = dict(series)
+    for key in ('timestamps', 'received', 'sent', 'download_speeds', 'upload_speeds'):
+        values = series[key]
+        result[key] = [values[i] for i in indices]
+    for key in ('incremental_received', 'incremental_sent'):
+        values = series[key]
+        sums = []
+        prev = -1
+        for i in indices:
+            sums.append(sum(values[prev + 1:i + 1]))
+            prev = i
+        result[key] = sums
+    return result
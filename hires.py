@@ -0,0 +1,117 @@
+"""
+High-resolution sample ring buffer
+高频采样模式下，采集脚本每秒（或更快）读取一次计数器，把 (时间, 累计接收, 累计发送) 写入一个固定大小的
+环形缓冲区，数据库仍然每个采集间隔只写一次。缓冲区是 data/ 下的一个 mmap 文件，按列存放
+（时间为 float64 数组，计数为 int64 数组），每个采样只占 24 字节，不为每个采样创建对象；
+Web 服务以只读方式映射同一个文件，直接读取最近几分钟的数据用于实时图表，不经过 SQLite。
+
+文件结构：32 字节头（魔数、版本、容量、采样间隔、已写入总数），之后是三列各 capacity 个元素。
+写入方先写数据再增加头中的已写入总数；读取方在复制前后各读一次总数，丢弃复制期间可能被覆盖的采样。
+"""
+
+import mmap
+import os
+import struct
+
+MAGIC = b'NTMR'
+VERSION = 1
+HEADER = struct.Struct('<4sIIdQ4x')
+COUNT_OFFSET = 20  # 头中已写入总数的偏移
+BUFFER_FILE = 'hires.ring'
+
+
+def buffer_path(db_path):
+    """与数据库在同一目录下的缓冲区文件"""
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), BUFFER_FILE)
+
+
+def file_size(capacity):
+    return HEADER.size + 3 * 8 * capacity
+
+
+class RingBuffer:
+    """按列存放的固定容量环形缓冲区（mmap 文件），create() 用于写入，open() 用于只读"""
+
+    __slots__ = ('path', 'capacity', 'interval', 'inode', '_mm', 'times', 'received', 'sent')
+
+    def __init__(self, path, mm):
+        magic, version, capacity, interval, _ = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION or len(mm) < file_size(capacity):
+            mm.close()
+            raise ValueError(f'{path} is not a sample ring buffer')
+        self.path = path
+        self.capacity = capacity
+        self.interval = interval
+        self.inode = os.stat(path).st_ino
+        self._mm = mm
+        view = memoryview(mm)
+        start = HEADER.size
+        self.times = view[start:start + 8 * capacity].cast('d')
+        self.received = view[start + 8 * capacity:start + 16 * capacity].cast('q')
+        self.sent = view[start + 16 * capacity:start + 24 * capacity].cast('q')
+
+    @classmethod
+    def create(cls, path, capacity, interval):
+        """创建（替换）缓冲区文件。先写临时文件再改名，已打开旧文件的读取方不受影响"""
+        size = file_size(capacity)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w+b') as f:
+            f.truncate(size)
+            mm = mmap.mmap(f.fileno(), size)
+        HEADER.pack_into(mm, 0, MAGIC, VERSION, capacity, interval, 0)
+        os.replace(tmp_path, path)
+        return cls(path, mm)
+
+    @classmethod
+    def open(cls, path):
+        """只读打开，文件不存在时抛出 FileNotFoundError"""
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(path, mm)
+
+    @property
+    def count(self):
+        """已写入的采样总数（包括已被覆盖的）"""
+        return struct.unpack_from('<Q', self._mm, COUNT_OFFSET)[0]
+
+    def append(self, timestamp, received, sent):
+        count = self.count
+        index = count % self.capacity
+        self.times[index] = timestamp
+        self.received[index] = received
+        self.sent[index] = sent
+        struct.pack_into('<Q', self._mm, COUNT_OFFSET, count + 1)
+
+    def snapshot(self):
+        """按时间顺序返回缓冲区中的采样 (timestamps, received, sent)"""
+        end = self.count
+        start = max(0, end - self.capacity)
+        times = self._copy(self.times, start, end)
+        received = self._copy(self.received, start, end)
+        sent = self._copy(self.sent, start, end)
+        # 复制期间写入方可能已经覆盖了最早的几个位置
+        overwritten = max(0, self.count - self.capacity - start)
+        if overwritten:
+            times, received, sent = times[overwritten:], received[overwritten:], sent[overwritten:]
+        return times, received, sent
+
+    def _copy(self, column, start, end):
+        """复制第 start 到 end 个采样（环形，最多分两段）"""
+        first = start % self.capacity
+        length = end - start
+        if first + length <= self.capacity:
+            return column[first:first + length].tolist()
+        return column[first:].tolist() + column[:first + length - self.capacity].tolist()
+
+    def is_stale(self):
+        """文件已被采集脚本重新创建（重启或修改了容量），需要重新打开"""
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except FileNotFoundError:
+            return True
+
+    def close(self):
+        self.times.release()
+        self.received.release()
+        self.sent.release()
+        self._mm.close()
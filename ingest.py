@@ -0,0 +1,419 @@
+"""
+Write-behind ingestion for remote collectors
+/api/ingest 收到的采样先放入内存队列，由一个后台线程合并后批量写入：每次刷新把队列中的所有请求
+合并成一个事务，原始数据用 executemany 插入，预聚合和汇总表先在内存中按桶合并再 upsert，
+事务数和 upsert 行数与请求数无关。
+按天分区时每天的数据单独提交：目标分区已封存（只读）的采样无法写入，逐个拒绝并计数；
+其他原因写入失败的分区及其之后的数据放回重试队列，多个请求一起失败时拆开逐个重试（一个请求中的坏数据不会拖累其他请求），
+单独重试多次仍失败才放弃并计数，不会静默丢弃已确认（202）的采样。
+"""
+
+import math
+import queue
+import threading
+import time
+from collections import defaultdict
+
+import storage
+
+# 主机名最大长度
+MAX_HOST_LENGTH = 255
+# 允许的时间戳超前（秒），采集端时钟略快于服务端时仍可接收
+MAX_CLOCK_SKEW = 300
+# SQLite INTEGER 的最大值
+MAX_COUNTER = 2 ** 63 - 1
+# 写入失败的采样最多重试的次数，以及重试前等待的秒数（每次加倍）
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 1
+
+
+def _counter(value):
+    """累计字节数：0 到 MAX_COUNTER 之间的整数"""
+    value = int(value)
+    if not 0 <= value <= MAX_COUNTER:
+        raise ValueError(value)
+    return value
+
+
+def _speed(value):
+    """速度：有限的非负数"""
+    value = float(value or 0)
+    if not math.isfinite(value) or value < 0:
+        raise ValueError(value)
+    return value
+
+
+def parse_samples(payload, max_samples):
+    """校验上报的 JSON，返回 (host, samples)，samples 为按时间排序的
+    (timestamp, received, sent, download_speed, upload_speed, {iface: (received, sent, download, upload)})
+
+    格式不正确或数值超出范围（时间戳不在 0 到当前时间 + MAX_CLOCK_SKEW 之间、计数超出 SQLite INTEGER、
+    速度不是有限的非负数）时抛出 ValueError，坏数据在返回 202 之前被拒绝，不会进入写入线程。
+    """
+    if not isinstance(payload, dict):
+        raise ValueError('请求体必须是 JSON 对象')
+    host = payload.get('host')
+    if not isinstance(host, str) or not host.strip() or len(host) > MAX_HOST_LENGTH:
+        raise ValueError(f'host 必须是 1 到 {MAX_HOST_LENGTH} 个字符的字符串')
+    raw_samples = payload.get('samples')
+    if not isinstance(raw_samples, list):
+        raise ValueError('samples 必须是数组')
+    if len(raw_samples) > max_samples:
+        raise ValueError(f'每次最多上报 {max_samples} 个采样')
+
+    max_timestamp = time.time() + MAX_CLOCK_SKEW
+    samples = []
+    for item in raw_samples:
+        try:
+            timestamp = int(item['timestamp'])
+            if not 0 <= timestamp <= max_timestamp:
+                raise ValueError(timestamp)
+            interfaces = {
+                str(iface): (_counter(values[0]), _counter(values[1]), _speed(values[2]), _speed(values[3]))
+                for iface, values in item.get('interfaces', {}).items()
+            }
+            samples.append((
+                timestamp,
+                _counter(item['bytes_received']),
+                _counter(item['bytes_sent']),
+                _speed(item.get('download_speed')),
+                _speed(item.get('upload_speed')),
+                interfaces
+            ))
+        except (AttributeError, KeyError, IndexError, TypeError, ValueError, OverflowError):
+            raise ValueError(f'无效的采样：{item!r}'[:200])
+    samples.sort(key=lambda sample: sample[0])
+    return host.strip(), samples
+
+
+def split_sealed(path, samples):
+    """按目标分区是否已封存拆分采样，返回 (可写入的采样, 被拒绝的采样)
+
+    已封存的分区是只读文件，读取方以 immutable 方式打开，不能再写入。未按天分区时没有分区文件，全部可写入。
+    """
+    sealed = {}
+    writable, rejected = [], []
+    for sample in samples:
+        key = storage.partition_key(sample[0])
+        if key not in sealed:
+            sealed[key] = storage.is_partition_sealed(path, key)
+        (rejected if sealed[key] else writable).append(sample)
+    return writable, rejected
+
+
+class FlushGroup:
+    """一个事务要写入的数据：原始数据行，以及按最细粒度桶和 (host, iface) 在内存中合并的预聚合、汇总
+
+    采样按时间顺序加入。更粗的粒度由最细粒度的桶合并得到（桶都按本地时间对齐，细桶完整落在一个粗桶内），
+    每个采样只需更新一个桶。
+    """
+
+    def __init__(self):
+        self.raw = []
+        self.interface_raw = []
+        # (host, iface, bucket) -> [增量接收, 增量发送, 最大下载速度, 最大上传速度, 最后接收, 最后发送, 采样数]
+        self.buckets = {}
+        # (host, iface) -> [采样数, 最早时间, 最晚时间, 最后接收, 最后发送, 增量接收, 增量发送]
+        self.summaries = {}
+
+    def add(self, host, iface, timestamp, bucket, received, sent, prev_received, prev_sent, download_speed, upload_speed):
+        inc_received = storage.calculate_increment(received, prev_received)
+        inc_sent = storage.calculate_increment(sent, prev_sent)
+
+        current = self.buckets.get((host, iface, bucket))
+        if current is None:
+            self.buckets[(host, iface, bucket)] = [
+                inc_received, inc_sent, download_speed, upload_speed, received, sent, 1
+            ]
+        else:
+            current[0] += inc_received
+            current[1] += inc_sent
+            current[2] = max(current[2], download_speed)
+            current[3] = max(current[3], upload_speed)
+            current[4] = received
+            current[5] = sent
+            current[6] += 1
+
+        summary = self.summaries.get((host, iface))
+        if summary is None:
+            self.summaries[(host, iface)] = [1, timestamp, timestamp, received, sent, inc_received, inc_sent]
+        else:
+            summary[0] += 1
+            summary[2] = timestamp
+            summary[3] = received
+            summary[4] = sent
+            summary[5] += inc_received
+            summary[6] += inc_sent
+
+    def rollup_rows(self):
+        """ROLLUP_UPSERT_SQL 的参数（所有粒度）"""
+        rows = []
+        for resolution in storage.ROLLUP_RESOLUTIONS:
+            merged = {}
+            for (host, iface, bucket), values in self.buckets.items():
+                key = (host, iface, storage.bucket_start(bucket, resolution))
+                current = merged.get(key)
+                if current is None:
+                    merged[key] = list(values)
+                    continue
+                current[0] += values[0]
+                current[1] += values[1]
+                current[2] = max(current[2], values[2])
+                current[3] = max(current[3], values[3])
+                current[4] = values[4]
+                current[5] = values[5]
+                current[6] += values[6]
+            rows.extend((resolution,) + key + tuple(values) for key, values in merged.items())
+        return rows
+
+    def summary_rows(self):
+        """SUMMARY_UPSERT_SQL 的参数"""
+        return [
+            (host, iface, count, first, last, first, received, sent, inc_received, inc_sent)
+            for (host, iface), (count, first, last, received, sent, inc_received, inc_sent) in self.summaries.items()
+        ]
+
+
+class IngestWriter:
+    """合并上报请求并批量写入数据库的后台线程"""
+
+    def __init__(self, db_path, queue_size=1000, batch_samples=5000, flush_interval=0.2,
+                 on_commit=None, logger=None):
+        self.db_path = db_path
+        self.batch_samples = batch_samples
+        self.flush_interval = flush_interval
+        # on_commit(host, samples) 在每次事务提交后调用，samples 为实际写入的采样
+        self.on_commit = on_commit
+        self.logger = logger
+
+        self.written = 0      # 已写入的采样数
+        self.duplicates = 0   # 因时间戳不晚于已有数据而跳过的采样数（重试导致的重复上报）
+        self.rejected = 0     # 目标分区已封存、无法写入的采样数
+        self.failed = 0       # 重试 MAX_ATTEMPTS 次仍写入失败而放弃的采样数
+        self.flushes = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._conn = None
+        # (host, iface) -> (最新时间戳, 累计接收, 累计发送)，首次遇到时从汇总表读取
+        self._latest = {}
+        # 写入失败等待重试的批次，每批为 [(host, samples, 已尝试次数)]，只由写入线程访问
+        self._retry = []
+
+    def submit(self, host, samples):
+        """放入写入队列，队列已满时返回 False（调用方应让客户端稍后重试）"""
+        self.start()
+        try:
+            self._queue.put_nowait((host, samples, 0))
+        except queue.Full:
+            return False
+        return True
+
+    def reject(self, host, count, reason):
+        """记录无法写入的采样（请求线程和写入线程都会调用）"""
+        with self._lock:
+            self.rejected += count
+        if self.logger:
+            self.logger.warning(f'Rejected {count} samples from {host}: {reason}')
+
+    @property
+    def pending(self):
+        return self._queue.qsize() + sum(len(batch) for batch in self._retry)
+
+    def start(self):
+        """启动后台写入线程（重复调用无副作用）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止后台线程，队列中剩余的数据写入后返回"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        while not (self._stop_event.is_set() and self._queue.empty() and not self._retry):
+            batch = []
+            try:
+                batch = self._collect()
+                if batch:
+                    self.flush(batch)
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f'Error in ingest writer: {e}')
+                self._close()
+                # 写入前（连接、读取汇总表等）出错，整批重试；已提交的部分重试时作为重复跳过
+                self._requeue(batch)
+        self._close()
+
+    def _requeue(self, batch):
+        """写入失败的请求放回重试队列（先于新请求写入，保持时间顺序）
+
+        多个请求一起失败时拆成每个请求一批（不计入尝试次数），找出出错的请求，其他请求正常写入；
+        单独写入仍失败的请求超过 MAX_ATTEMPTS 次时放弃并计数。
+        """
+        if len(batch) > 1:
+            self._retry = [[item] for item in batch] + self._retry
+            return
+        retry = []
+        for host, samples, attempts in batch:
+            if attempts + 1 >= MAX_ATTEMPTS:
+                self.failed += len(samples)
+                if self.logger:
+                    self.logger.error(f'Ingest writer gave up on {len(samples)} samples from {host} '
+                                      f'after {MAX_ATTEMPTS} attempts')
+                continue
+            retry.append((host, samples, attempts + 1))
+        if retry:
+            self._retry = [retry] + self._retry
+            # 等待后再重试（停止时不再等待）
+            self._stop_event.wait(RETRY_DELAY * 2 ** (retry[0][2] - 1))
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _collect(self):
+        """等待第一个请求，然后在 flush_interval 内继续合并，直到达到 batch_samples；有待重试的批次时先取出一批"""
+        if self._retry:
+            return self._retry.pop(0)
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        count = len(batch[0][1])
+        deadline = time.monotonic() + self.flush_interval
+        while count < self.batch_samples:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            count += len(item[1])
+        return batch
+
+    def _previous(self, host, iface):
+        key = (host, iface)
+        if key not in self._latest:
+            row = self._conn.execute(
+                'SELECT max_time, latest_received, latest_sent FROM traffic_summary WHERE host = ? AND iface = ?',
+                key
+            ).fetchone()
+            self._latest[key] = tuple(row) if row and row[0] is not None else (None, None, None)
+        return self._latest[key]
+
+    def flush(self, batch):
+        """把一批请求 [(host, samples, 已尝试次数)] 写入数据库，返回写入的采样数
+
+        同一主机的采样按时间排序，时间戳不晚于该主机已有数据的采样视为重复上报并跳过。
+        按天分区时每个分区一个事务（从早到晚），否则整批一个事务。目标分区已封存的采样被拒绝；
+        某个分区写入失败时回滚该分区，它和之后的分区中各请求的采样放回重试队列（之前已提交的分区不受影响）。
+        """
+        if self._conn is None:
+            self._conn = storage.connect(self.db_path, check_same_thread=False)
+
+        # host -> [(采样, 所属请求在 batch 中的序号)]
+        by_host = defaultdict(list)
+        for index, (host, samples, _) in enumerate(batch):
+            by_host[host].extend((sample, index) for sample in samples)
+
+        latest = {}
+        groups = defaultdict(FlushGroup)
+        # 分区 -> host -> 该分区中的采样；分区 -> 请求序号 -> 该分区中的采样（失败时按请求重试）；
+        # 分区 -> 写入后的 {(host, iface): (时间戳, 累计接收, 累计发送)}
+        group_samples = defaultdict(lambda: defaultdict(list))
+        group_requests = defaultdict(lambda: defaultdict(list))
+        group_latest = defaultdict(dict)
+        partitioned = storage.is_partitioned(self._conn)
+        finest = min(storage.ROLLUP_RESOLUTIONS)
+
+        def previous(host, iface):
+            return latest.get((host, iface)) or self._previous(host, iface)
+
+        for host, samples in by_host.items():
+            samples.sort(key=lambda item: item[0][0])
+            for sample, index in samples:
+                timestamp, received, sent, download_speed, upload_speed, interfaces = sample
+                last_ts, prev_received, prev_sent = previous(host, '')
+                if last_ts is not None and timestamp <= last_ts:
+                    self.duplicates += 1
+                    continue
+                key = storage.partition_key(timestamp) if partitioned else None
+                group = groups[key]
+                bucket = storage.bucket_start(timestamp, finest)
+                group.raw.append((timestamp, host, received, sent, download_speed, upload_speed))
+                group.add(host, '', timestamp, bucket, received, sent, prev_received, prev_sent,
+                          download_speed, upload_speed)
+                latest[(host, '')] = group_latest[key][(host, '')] = (timestamp, received, sent)
+
+                for iface, (iface_received, iface_sent, iface_download, iface_upload) in interfaces.items():
+                    _, prev_iface_received, prev_iface_sent = previous(host, iface)
+                    group.interface_raw.append(
+                        (timestamp, host, iface, iface_received, iface_sent, iface_download, iface_upload)
+                    )
+                    group.add(host, iface, timestamp, bucket, iface_received, iface_sent,
+                              prev_iface_received, prev_iface_sent, iface_download, iface_upload)
+                    latest[(host, iface)] = group_latest[key][(host, iface)] = (timestamp, iface_received, iface_sent)
+                group_samples[key][host].append(sample)
+                group_requests[key][index].append(sample)
+
+        keys = sorted(groups, key=lambda key: key or '')
+        written = 0
+        for i, key in enumerate(keys):
+            if key is not None and storage.is_partition_sealed(self.db_path, key):
+                # 上报跨过了分区封存（如隔夜重试），只读分区不能写入（以 root 运行时写入会破坏 immutable 读取）
+                for host, samples in group_samples[key].items():
+                    self.reject(host, len(samples), f'partition {key} is sealed')
+                continue
+            try:
+                self._write_group(groups[key])
+            except Exception as e:
+                self._conn.rollback()
+                if self.logger:
+                    self.logger.error(f'Error writing ingest partition {key or "main"}: {e}')
+                self._close()
+                # 之后的分区依赖该分区的数据判断重复，一起重试
+                remaining = defaultdict(list)
+                for later in keys[i:]:
+                    for index, samples in group_requests[later].items():
+                        remaining[index].extend(samples)
+                self._requeue([
+                    (batch[index][0], samples, batch[index][2]) for index, samples in sorted(remaining.items())
+                ])
+                break
+            self._latest.update(group_latest[key])
+            count = sum(len(samples) for samples in group_samples[key].values())
+            written += count
+            self.written += count
+            if self.on_commit:
+                for host, samples in group_samples[key].items():
+                    self.on_commit(host, samples)
+        self.flushes += 1
+        return written
+
+    def _write_group(self, group):
+        """一个事务写入一个分区的原始数据及对应的预聚合、汇总"""
+        schema = storage.attach_write_partition(self._conn, self.db_path, group.raw[0][0])
+        cursor = self._conn.cursor()
+        cursor.executemany(f'''
+            INSERT INTO {schema}.traffic_data (timestamp, host, bytes_received, bytes_sent, download_speed, upload_speed)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', group.raw)
+        cursor.executemany(f'''
+            INSERT INTO {schema}.interface_traffic
+                (timestamp, host, iface, bytes_received, bytes_sent, download_speed, upload_speed)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', group.interface_raw)
+        cursor.executemany(storage.ROLLUP_UPSERT_SQL, group.rollup_rows())
+        cursor.executemany(storage.SUMMARY_UPSERT_SQL, group.summary_rows())
+        self._conn.commit()
@@ -0,0 +1,316 @@
+"""
+Live sample hub for the web server
+后台线程通过 PRAGMA data_version 感知采集脚本写入的新数据（只是一次轻量的页读取，
+不扫描表），发现变化后只查询一次新增的采样，计算增量、速度和告警，再推送给所有订阅者
+（例如 /api/stream 的 SSE 连接）。订阅者数量不影响数据库查询次数。
+远程主机通过 /api/ingest 上报的采样不经过轮询，由写入线程提交后调用 publish_samples() 推送。
+每台主机、每块网卡最新的计数和速度同时保存在内存中（latest_counters），供 /metrics 直接读取。
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import storage
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# 出错（例如数据库还不存在）后重试间隔从 poll_interval 开始翻倍，最长为该值（秒）
+MAX_RETRY_INTERVAL = 30
+
+
+class SampleHub:
+    """监听数据库中的新采样并广播给订阅者"""
+
+    def __init__(self, db_path, poll_interval=0.5, queue_size=100, alert_checker=None, anomaly_checker=None,
+                 tick_observer=None, logger=None):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        # alert_checker(host, timestamp, received, sent, prev_received, prev_sent, interval_seconds,
+        #               interfaces, prev_interfaces) -> 告警信息或 None，后两者为 {iface: (received, sent)}
+        self.alert_checker = alert_checker
+        # anomaly_checker(host, timestamp, speeds) -> 异常标记列表，speeds 为 {iface: (download, upload)}，'' 为合计
+        self.anomaly_checker = anomaly_checker
+        # tick_observer(timestamp, seconds, phases) 在读到本机采集脚本新的一次采集耗时时调用，phases 为 {阶段: 秒数}
+        self.tick_observer = tick_observer
+        self.logger = logger
+
+        self.latest = None        # 最近一次采样（事件内容）
+        self.data_version = None  # 最近一次观察到的 PRAGMA data_version
+        # 数据库每次变化（新采样、清理等）generation 加一，可用于让缓存失效
+        self.generation = 0
+        self.last_modified = None  # 最近一次观察到变化的时间（Unix 时间戳）
+        self.published = 0         # 已推送的事件数
+        # (host, iface) -> (timestamp, received, sent, download_speed, upload_speed)，iface '' 为合计；
+        # 连接时由汇总表初始化（此时速度为 None）。其他线程读取时使用 counters_snapshot()
+        self.latest_counters = {}
+        # 本机采集脚本最近一次采集的 (timestamp, 耗时秒数, {阶段: 秒数})，有新数据时从 meta 表读取
+        self.collector_tick = None
+
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._conn = None
+        self._last_ts = None
+        # 每台主机上一次采样：host -> (timestamp, received, sent)、host -> {iface: (received, sent)}
+        # 本机（host ''）只由轮询线程更新，远程主机只由 publish_samples() 的调用线程更新
+        self._prev_totals = {}
+        self._prev_interfaces = {}
+
+    # 订阅管理
+
+    def subscribe(self):
+        """注册一个订阅者，返回接收事件的队列"""
+        self.start()
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def counters_snapshot(self):
+        """latest_counters 的副本"""
+        with self._lock:
+            return dict(self.latest_counters)
+
+    def publish(self, event):
+        """把事件放入每个订阅者的队列；队列已满的慢客户端丢弃最旧的事件"""
+        self.latest = event
+        self.published += 1
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    subscriber.put_nowait(event)
+                except queue.Full:
+                    pass
+
+    def publish_samples(self, host, samples):
+        """推送远程主机上报并已写入数据库的采样
+        (timestamp, received, sent, download_speed, upload_speed, {iface: (received, sent, download, upload)})"""
+        for timestamp, received, sent, download_speed, upload_speed, interfaces in samples:
+            interface_rows = [(iface,) + tuple(values) for iface, values in sorted(interfaces.items())]
+            self.publish(self._build_event(
+                host, (timestamp, received, sent, download_speed, upload_speed), interface_rows
+            ))
+
+    # 后台线程
+
+    def start(self):
+        """启动后台监听线程（重复调用无副作用）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='sample-hub', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        delay = self.poll_interval
+        last_error = None
+        while not self._stop_event.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                # 同一个错误只记录一次，重试间隔逐渐加长，避免每 poll_interval 刷一条日志
+                if self.logger and str(e) != last_error:
+                    self.logger.error(f'Error in sample hub: {e} (retrying with backoff)')
+                last_error = str(e)
+                self._close()
+                self._stop_event.wait(delay)
+                delay = min(delay * 2, MAX_RETRY_INTERVAL)
+                continue
+            if last_error is not None:
+                if self.logger:
+                    self.logger.info('Sample hub recovered')
+                last_error = None
+                delay = self.poll_interval
+            self._stop_event.wait(self.poll_interval)
+        self._close()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _connect(self):
+        # sqlite3.connect 会创建不存在的文件，数据库由采集脚本创建，这里只等待
+        if not os.path.exists(self.db_path):
+            raise FileNotFoundError(f'database {self.db_path} does not exist yet')
+        conn = storage.connect(self.db_path, check_same_thread=False)
+        # 从当前最新的一条开始，之前的数据不推送
+        rows = storage.fetch_raw_rows(conn, self.db_path, '''
+            SELECT timestamp, bytes_received, bytes_sent
+            FROM traffic_data
+            WHERE host = ''
+            ORDER BY timestamp DESC LIMIT 1
+        ''', descending=True, limit=1)
+        if rows:
+            row = rows[0]
+            self._last_ts = row[0]
+            self._prev_totals[''] = (row[0], row[1], row[2])
+            self._prev_interfaces[''] = {
+                iface: (rx, tx) for iface, rx, tx in storage.fetch_raw_rows(conn, self.db_path, '''
+                    SELECT iface, bytes_received, bytes_sent
+                    FROM interface_traffic
+                    WHERE host = '' AND timestamp = ?
+                ''', (row[0],), start_ts=row[0], end_ts=row[0])
+            }
+        else:
+            self._last_ts = 0
+        self._load_counters(conn)
+        self._load_collector_tick(conn)
+        return conn
+
+    def _load_counters(self, conn):
+        """从汇总表读取每台主机、每块网卡最新的计数（已有更新的值时不覆盖）"""
+        if not storage.table_exists(conn, 'traffic_summary'):
+            return
+        rows = conn.execute('''
+            SELECT host, iface, max_time, latest_received, latest_sent
+            FROM traffic_summary
+            WHERE record_count > 0
+        ''').fetchall()
+        with self._lock:
+            for host, iface, ts, received, sent in rows:
+                self.latest_counters.setdefault((host, iface), (ts, received, sent, None, None))
+
+    def _load_collector_tick(self, conn):
+        if not storage.table_exists(conn, 'meta'):
+            return
+        value = storage.get_meta(conn, storage.COLLECTOR_TICK_KEY)
+        if not value:
+            return
+        tick = json.loads(value)
+        previous = self.collector_tick
+        self.collector_tick = (tick['timestamp'], tick['seconds'], tick.get('phases', {}))
+        if self.tick_observer and (previous is None or previous[0] != tick['timestamp']):
+            try:
+                self.tick_observer(*self.collector_tick)
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f'Collector tick observer failed: {e}')
+
+    def poll(self):
+        """检查一次是否有新数据，返回推送的事件数"""
+        if self._conn is None:
+            self._conn = self._connect()
+            self.data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+            # （重新）连接之前的变化无法得知，视为数据已变化
+            self._mark_changed()
+            return 0
+
+        version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        if version == self.data_version:
+            return 0
+        self.data_version = version
+        self._mark_changed()
+
+        # 只轮询本机采集的数据；按天分区时只查询 _last_ts 之后的分区
+        rows = storage.fetch_raw_rows(self._conn, self.db_path, '''
+            SELECT timestamp, bytes_received, bytes_sent, download_speed, upload_speed
+            FROM traffic_data
+            WHERE host = '' AND timestamp > ?
+            ORDER BY timestamp
+        ''', (self._last_ts,), start_ts=self._last_ts)
+        if not rows:
+            return 0
+
+        interfaces_by_ts = {}
+        for ts, iface, rx, tx, down, up in storage.fetch_raw_rows(self._conn, self.db_path, '''
+            SELECT timestamp, iface, bytes_received, bytes_sent, download_speed, upload_speed
+            FROM interface_traffic
+            WHERE host = '' AND timestamp > ?
+        ''', (self._last_ts,), start_ts=self._last_ts):
+            interfaces_by_ts.setdefault(ts, []).append((iface, rx, tx, down, up))
+
+        for row in rows:
+            self.publish(self._build_event('', row, interfaces_by_ts.get(row[0], [])))
+        self._last_ts = rows[-1][0]
+        self._load_collector_tick(self._conn)
+        return len(rows)
+
+    def _mark_changed(self):
+        self.last_modified = time.time()
+        self.generation += 1
+
+    def _build_event(self, host, row, interface_rows):
+        ts, received, sent, download_speed, upload_speed = row
+        prev_ts, prev_received, prev_sent = self._prev_totals.get(host, (None, None, None))
+        prev_interfaces = self._prev_interfaces.setdefault(host, {})
+
+        previous = dict(prev_interfaces) if self.alert_checker else None
+        interfaces = {}
+        for iface, rx, tx, down, up in interface_rows:
+            prev_rx, prev_tx = prev_interfaces.get(iface, (None, None))
+            interfaces[iface] = {
+                'received': rx,
+                'sent': tx,
+                'incremental_received': storage.calculate_increment(rx, prev_rx),
+                'incremental_sent': storage.calculate_increment(tx, prev_tx),
+                'download_speed': down or 0,
+                'upload_speed': up or 0
+            }
+            prev_interfaces[iface] = (rx, tx)
+
+        alerts = None
+        if self.alert_checker:
+            interval = ts - prev_ts if prev_ts and ts > prev_ts else 300
+            alerts = self.alert_checker(
+                host, ts, received, sent, prev_received, prev_sent, interval,
+                {iface: (values['received'], values['sent']) for iface, values in interfaces.items()}, previous
+            )
+        self._prev_totals[host] = (ts, received, sent)
+
+        with self._lock:
+            self.latest_counters[(host, '')] = (ts, received, sent, download_speed or 0, upload_speed or 0)
+            for iface, values in interfaces.items():
+                self.latest_counters[(host, iface)] = (
+                    ts, values['received'], values['sent'], values['download_speed'], values['upload_speed']
+                )
+
+        anomalies = None
+        if self.anomaly_checker:
+            speeds = {'': (download_speed or 0, upload_speed or 0)}
+            for iface, values in interfaces.items():
+                speeds[iface] = (values['download_speed'], values['upload_speed'])
+            anomalies = self.anomaly_checker(host, ts, speeds) or None
+
+        return {
+            'host': host,
+            'cursor': ts,
+            'timestamp': datetime.fromtimestamp(ts).strftime(TIME_FORMAT),
+            'received': received,
+            'sent': sent,
+            'incremental_received': storage.calculate_increment(received, prev_received),
+            'incremental_sent': storage.calculate_increment(sent, prev_sent),
+            'download_speed': download_speed or 0,
+            'upload_speed': upload_speed or 0,
+            'interfaces': interfaces,
+            'alerts': alerts,
+            'anomalies': anomalies
+        }
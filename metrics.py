@@ -0,0 +1,62 @@
+"""
+Prometheus / OpenMetrics text exposition for /metrics
+把内存中的指标渲染为 Prometheus 文本格式（text/plain; version=0.0.4），
+或在抓取方请求时渲染为 OpenMetrics 格式（application/openmetrics-text）。
+不依赖 prometheus_client；指标以 Family 列表传入，由调用方从内存状态生成。
+"""
+
+import math
+from collections import namedtuple
+
+CONTENT_TYPE_TEXT = 'text/plain; version=0.0.4; charset=utf-8'
+CONTENT_TYPE_OPENMETRICS = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# name 不含 _total 后缀（counter 渲染时自动加上），samples 为 [(labels dict, value), ...]
+Family = namedtuple('Family', ['name', 'type', 'help', 'samples'])
+
+
+def wants_openmetrics(accept):
+    """抓取方的 Accept 头是否接受 OpenMetrics 格式"""
+    return 'application/openmetrics-text' in (accept or '')
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + '}'
+
+
+def render(families, openmetrics=False):
+    """渲染指标文本；没有样本的指标只输出 HELP / TYPE"""
+    lines = []
+    for family in families:
+        sample_name = f'{family.name}_total' if family.type == 'counter' else family.name
+        # 文本格式 0.0.4 中 HELP / TYPE 使用样本名，OpenMetrics 中使用不带 _total 的指标名
+        header_name = family.name if openmetrics else sample_name
+        lines.append(f'# HELP {header_name} {escape_help(family.help)}')
+        lines.append(f'# TYPE {header_name} {family.type}')
+        for labels, value in family.samples:
+            lines.append(f'{sample_name}{format_labels(labels)} {format_value(value)}')
+    if openmetrics:
+        lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
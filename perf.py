@@ -0,0 +1,321 @@
+"""
+Hot-path instrumentation
+每个请求（或采集脚本的每次采集）一个 Timer，按阶段累计耗时：
+- sql:  TimedConnection / TimedCursor 自动记录 execute 和 fetch* 的耗时（storage.connect() 打开的连接）
+- 其他阶段由调用方用 phase('name') 标记（如 series、downsample、json）
+阶段可以嵌套，外层阶段只记录自身的耗时（不含内层），各阶段之和不超过总耗时。
+没有活动的 Timer 时各处只多一次 ContextVar 读取，开销可以忽略，适合在生产环境中常开。
+
+Registry 把每次的耗时按 (名称, 阶段) 累计到固定桶的直方图中（/api/debug/perf），
+SamplingProfiler 是可选的采样分析器：定期读取所有线程的调用栈，输出 flamegraph.pl / speedscope 可读的折叠格式。
+"""
+
+import bisect
+import contextvars
+import functools
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# 直方图桶的上界（毫秒），超过最后一个的计入溢出桶
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+TOTAL = 'total'
+
+_current = contextvars.ContextVar('perf_timer', default=None)
+
+
+class Timer:
+    """一次请求或采集的分阶段耗时"""
+
+    __slots__ = ('name', 'started', 'phases', '_children')
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.phases = {}
+        # 嵌套阶段的栈，每层记录内层阶段已用的时间
+        self._children = []
+
+    def begin(self):
+        self._children.append(0.0)
+        return time.perf_counter()
+
+    def end(self, phase, started):
+        elapsed = time.perf_counter() - started
+        self.phases[phase] = self.phases.get(phase, 0.0) + elapsed - self._children.pop()
+        if self._children:
+            self._children[-1] += elapsed
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        """Server-Timing 响应头（毫秒）"""
+        entries = [f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in self.phases.items()]
+        entries.append(f'{TOTAL};dur={total * 1000:.2f}')
+        return ', '.join(entries)
+
+
+def start(name):
+    """开始计时并设为当前 Timer，返回 (timer, token)，结束时传给 finish()"""
+    timer = Timer(name)
+    return timer, _current.set(timer)
+
+
+def finish(timer, token):
+    """结束计时，返回总耗时（秒）"""
+    try:
+        _current.reset(token)
+    except ValueError:
+        # token 属于另一个 Context（例如生成器在其他线程中被关闭），该 Context 中的值不需要恢复
+        pass
+    return timer.elapsed()
+
+
+def current():
+    return _current.get()
+
+
+def timed(name):
+    """装饰器：函数每次执行使用一个新的 Timer（函数内可用 current() 取得）"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            timer, token = start(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                finish(timer, token)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def phase(name):
+    """把代码块的耗时计入当前 Timer 的 name 阶段（没有 Timer 时不做任何事）"""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    started = timer.begin()
+    try:
+        yield
+    finally:
+        timer.end(name, started)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """execute / fetch* 的耗时计入当前 Timer 的 sql 阶段（直接迭代游标读取的行不计入）"""
+
+    def execute(self, sql, parameters=()):
+        timer = _current.get()
+        if timer is None:
+            return super().execute(sql, parameters)
+        started = timer.begin()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            timer.end('sql', started)
+
+    def executemany(self, sql, seq_of_parameters):
+        timer = _current.get()
+        if timer is None:
+            return super().executemany(sql, seq_of_parameters)
+        started = timer.begin()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            timer.end('sql', started)
+
+    def fetchone(self):
+        timer = _current.get()
+        if timer is None:
+            return super().fetchone()
+        started = timer.begin()
+        try:
+            return super().fetchone()
+        finally:
+            timer.end('sql', started)
+
+    def fetchmany(self, size=None):
+        timer = _current.get()
+        if timer is None:
+            return super().fetchmany(self.arraysize if size is None else size)
+        started = timer.begin()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            timer.end('sql', started)
+
+    def fetchall(self):
+        timer = _current.get()
+        if timer is None:
+            return super().fetchall()
+        started = timer.begin()
+        try:
+            return super().fetchall()
+        finally:
+            timer.end('sql', started)
+
+
+class TimedConnection(sqlite3.Connection):
+    """cursor() / execute() / executemany() 返回 TimedCursor（sqlite3.connect 的 factory）"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        timer = _current.get()
+        if timer is None:
+            return super().commit()
+        started = timer.begin()
+        try:
+            return super().commit()
+        finally:
+            timer.end('sql', started)
+
+
+class Histogram:
+    """固定桶的耗时直方图（毫秒）"""
+
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.sum += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, q):
+        """按桶内线性插值估计分位数"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = BUCKETS_MS[i - 1] if i > 0 else 0.0
+                upper = BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max
+                return round(min(lower + (upper - lower) * (rank - cumulative) / count, self.max), 3)
+            cumulative += count
+        return round(self.max, 3)
+
+    def describe(self, buckets=False):
+        result = {
+            'count': self.count,
+            'sum_ms': round(self.sum, 3),
+            'avg_ms': round(self.sum / self.count, 3) if self.count else None,
+            'p50_ms': self.percentile(0.5),
+            'p90_ms': self.percentile(0.9),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': round(self.max, 3)
+        }
+        if buckets:
+            result['buckets'] = {
+                str(bound): count for bound, count in zip(BUCKETS_MS + ('+Inf',), self.counts)
+            }
+        return result
+
+
+class Registry:
+    """按 (名称, 阶段) 累计的直方图"""
+
+    def __init__(self):
+        self.since = time.time()
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, total, phases):
+        """记录一次耗时（秒）"""
+        with self._lock:
+            by_phase = self._histograms.get(name)
+            if by_phase is None:
+                by_phase = self._histograms[name] = {}
+            for phase_name, seconds in ((TOTAL, total),) + tuple(phases.items()):
+                histogram = by_phase.get(phase_name)
+                if histogram is None:
+                    histogram = by_phase[phase_name] = Histogram()
+                histogram.observe(seconds * 1000)
+
+    def describe(self, buckets=False):
+        with self._lock:
+            return {
+                name: {phase_name: histogram.describe(buckets) for phase_name, histogram in by_phase.items()}
+                for name, by_phase in sorted(self._histograms.items())
+            }
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self.since = time.time()
+
+
+class SamplingProfiler:
+    """每 interval 秒读取一次所有线程（除自身外）的调用栈并计数
+
+    folded() 返回折叠格式（每行 "线程;外层函数;...;内层函数 次数"），可用 flamegraph.pl 或 speedscope 查看。
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self._stacks = Counter()
+        self._exclude = set()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def run_for(self, seconds):
+        """采样 seconds 秒（期间阻塞调用方，调用方线程不计入）后返回折叠格式结果"""
+        self._exclude.add(threading.get_ident())
+        self.start()
+        self._stop_event.wait(seconds)
+        self.stop()
+        return self.folded()
+
+    def _run(self):
+        self._exclude.add(threading.get_ident())
+        names = {}
+        while not self._stop_event.wait(self.interval):
+            if len(names) != threading.active_count():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident in self._exclude:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self._stacks.most_common())
@@ -0,0 +1,234 @@
+"""
+Retention engine
+按保留策略分批删除过期数据：原始数据保留 RAW_RETENTION_DAYS 天，预聚合按粒度分别保留更久。
+每批是一个独立的短事务（同时更新汇总表），单次运行有时间上限，剩余部分下次继续；
+删除后用 PRAGMA incremental_vacuum 回收空闲页。
+按天分区存储时原始数据不逐行删除：整天过期的分区直接删除文件，已结束的分区封存为只读。
+"""
+
+import time
+from collections import Counter
+
+import storage
+
+# 原始数据（traffic_data / interface_traffic）保留天数
+RAW_RETENTION_DAYS = 30
+# 各粒度预聚合保留天数，None 表示永久保留
+ROLLUP_RETENTION_DAYS = {60: 7, 300: 90, 3600: 730, 86400: None}
+# 每批删除的行数
+BATCH_SIZE = 5000
+# 单次运行的时间上限（秒），避免大量积压时长时间占用采集循环
+TIME_BUDGET = 5.0
+# 单次运行最多回收的空闲页数
+VACUUM_PAGES = 4096
+# meta 表中记录上次完整运行时间的键
+LAST_RUN_KEY = 'retention_last_run'
+
+# 原始数据表：按时间顺序选出一批过期行的 id，删除后更新汇总表（合计表对应 iface ''）
+RAW_TABLES = {
+    'traffic_data': {
+        'select': '''
+            SELECT id, host, '' FROM traffic_data
+            WHERE timestamp < ?
+            ORDER BY timestamp LIMIT ?
+        ''',
+        'summary': '''
+            UPDATE traffic_summary
+            SET record_count = MAX(record_count - :count, 0),
+                min_time = (SELECT MIN(timestamp) FROM traffic_data WHERE host = :host),
+                max_time = (SELECT MAX(timestamp) FROM traffic_data WHERE host = :host)
+            WHERE host = :host AND iface = :iface
+        ''',
+    },
+    'interface_traffic': {
+        'select': '''
+            SELECT id, host, iface FROM interface_traffic
+            WHERE timestamp < ?
+            ORDER BY timestamp LIMIT ?
+        ''',
+        'summary': '''
+            UPDATE traffic_summary
+            SET record_count = MAX(record_count - :count, 0),
+                min_time = (SELECT MIN(timestamp) FROM interface_traffic WHERE host = :host AND iface = :iface),
+                max_time = (SELECT MAX(timestamp) FROM interface_traffic WHERE host = :host AND iface = :iface)
+            WHERE host = :host AND iface = :iface
+        ''',
+    },
+}
+
+ROLLUP_DELETE_SQL = '''
+    DELETE FROM traffic_rollup
+    WHERE resolution = ? AND host = ? AND iface = ? AND bucket IN (
+        SELECT bucket FROM traffic_rollup
+        WHERE resolution = ? AND host = ? AND iface = ? AND bucket <= ?
+        ORDER BY bucket LIMIT ?
+    )
+'''
+
+
+def retention_cutoff(days, now=None):
+    """早于该时间戳的数据已过期；days 为 None 时返回 None（永久保留）"""
+    if days is None:
+        return None
+    return int((now if now is not None else time.time()) - days * 86400)
+
+
+def is_due(conn, interval, now=None):
+    """距离上次完整运行是否已超过 interval 秒（上次未完成时总是返回 True）"""
+    last_run = storage.get_meta(conn, LAST_RUN_KEY)
+    now = now if now is not None else time.time()
+    return last_run is None or now - float(last_run) >= interval
+
+
+def delete_raw_batch(conn, table, cutoff, batch_size):
+    """删除一批过期原始数据，并在同一事务中更新汇总表；返回删除的行数"""
+    sql = RAW_TABLES[table]
+    rows = conn.execute(sql['select'], (cutoff, batch_size)).fetchall()
+    if not rows:
+        return 0
+    conn.executemany(f'DELETE FROM {table} WHERE id = ?', [(row[0],) for row in rows])
+    counts = Counter((row[1], row[2]) for row in rows)
+    conn.executemany(sql['summary'], [
+        {'count': count, 'host': host, 'iface': iface} for (host, iface), count in counts.items()
+    ])
+    conn.commit()
+    return len(rows)
+
+
+# 分区中每台主机、每个网卡（'' 为合计表）的行数和最早时间戳
+PARTITION_SCOPES_SQL = '''
+    SELECT host, '', COUNT(*), MIN(timestamp) FROM traffic_data GROUP BY host
+    UNION ALL
+    SELECT host, iface, COUNT(*), MIN(timestamp) FROM interface_traffic GROUP BY host, iface
+'''
+
+
+def partition_scopes(path, key):
+    """{(host, iface): (行数, 最早时间戳)}"""
+    part = storage.open_partition(path, key)
+    try:
+        return {(host, iface): (count, earliest) for host, iface, count, earliest in part.execute(PARTITION_SCOPES_SQL)}
+    finally:
+        part.close()
+
+
+def earliest_timestamps(path, scopes):
+    """剩余分区中各 (host, iface) 最早的时间戳；从最旧的分区开始找，全部找到即停止"""
+    found = {}
+    for key in storage.list_partitions(path):
+        for scope, (_, earliest) in partition_scopes(path, key).items():
+            if scope in scopes and scope not in found:
+                found[scope] = earliest
+        if len(found) == len(scopes):
+            break
+    return found
+
+
+def drop_expired_partitions(conn, path, cutoff, now, result):
+    """封存已结束的分区，删除整天早于 cutoff 的分区并更新汇总表
+
+    跨过 cutoff 的分区整天保留，到第二天再删除。
+    """
+    today = storage.partition_key(now)
+    for key in storage.list_partitions(path):
+        if key < today and not storage.is_sealed(storage.partition_file(path, key)):
+            storage.seal_partition(path, key)
+
+    if cutoff is None:
+        return
+    removed = Counter()
+    for key in storage.list_partitions(path):
+        if storage.partition_bounds(key)[1] > cutoff:
+            break
+        scopes = partition_scopes(path, key)
+        storage.drop_partition(path, key)
+        for (host, iface), (count, _) in scopes.items():
+            removed[(host, iface)] += count
+            result['interface_traffic' if iface else 'traffic_data'] += count
+        result['partitions'] += 1
+    if not removed:
+        return
+
+    earliest = earliest_timestamps(path, set(removed))
+    conn.executemany('''
+        UPDATE traffic_summary
+        SET record_count = MAX(record_count - :count, 0),
+            min_time = :min_time,
+            max_time = CASE WHEN :min_time IS NULL THEN NULL ELSE max_time END
+        WHERE host = :host AND iface = :iface
+    ''', [
+        {'count': count, 'min_time': earliest.get((host, iface)), 'host': host, 'iface': iface}
+        for (host, iface), count in removed.items()
+    ])
+    conn.commit()
+
+
+def rollup_scopes(conn):
+    """预聚合中出现过的 (host, iface)（iface 为 '' 表示合计）"""
+    return conn.execute('''
+        SELECT host, iface FROM traffic_summary
+        UNION
+        SELECT DISTINCT host, iface FROM traffic_rollup WHERE resolution = ?
+    ''', (max(storage.ROLLUP_RESOLUTIONS),)).fetchall()
+
+
+def run_retention(conn, raw_days=RAW_RETENTION_DAYS, rollup_days=None, batch_size=BATCH_SIZE,
+                  time_budget=TIME_BUDGET, now=None):
+    """执行一次清理，返回各部分删除的行数和是否全部完成
+
+    达到 time_budget 时提前返回（complete 为 False），不记录完成时间，下次调度时继续。
+    """
+    if rollup_days is None:
+        rollup_days = ROLLUP_RETENTION_DAYS
+    now = now if now is not None else time.time()
+    started = time.monotonic()
+    result = {'traffic_data': 0, 'interface_traffic': 0, 'partitions': 0, 'traffic_rollup': 0,
+              'vacuum_pages': 0, 'complete': False}
+
+    def out_of_time():
+        return time.monotonic() - started >= time_budget
+
+    cutoff = retention_cutoff(raw_days, now)
+    if storage.is_partitioned(conn):
+        drop_expired_partitions(conn, storage.database_path(conn), cutoff, now, result)
+    elif cutoff is not None:
+        for table in RAW_TABLES:
+            while True:
+                deleted = delete_raw_batch(conn, table, cutoff, batch_size)
+                result[table] += deleted
+                if deleted < batch_size:
+                    break
+                if out_of_time():
+                    return result
+
+    scopes = rollup_scopes(conn)
+    for resolution in storage.ROLLUP_RESOLUTIONS:
+        cutoff = retention_cutoff(rollup_days.get(resolution), now)
+        if cutoff is None:
+            continue
+        # 只删除已经完全早于 cutoff 的桶
+        bucket_cutoff = cutoff - resolution
+        for host, iface in scopes:
+            while True:
+                deleted = conn.execute(ROLLUP_DELETE_SQL, (
+                    resolution, host, iface, resolution, host, iface, bucket_cutoff, batch_size
+                )).rowcount
+                conn.commit()
+                result['traffic_rollup'] += deleted
+                if deleted < batch_size:
+                    break
+                if out_of_time():
+                    return result
+
+    # 回收空闲页（auto_vacuum = INCREMENTAL 时有效）
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == storage.AUTO_VACUUM_INCREMENTAL:
+        free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if free_pages:
+            # execute() 对没有结果列的 PRAGMA 只执行一步（只回收一页），executescript() 会执行到结束
+            conn.executescript(f'PRAGMA incremental_vacuum({VACUUM_PAGES})')
+            result['vacuum_pages'] = free_pages - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+    storage.set_meta(conn, LAST_RUN_KEY, now)
+    conn.commit()
+    result['complete'] = True
+    return result
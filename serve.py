@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Production server for web_server.py
+用 waitress（pip3 install waitress）的线程池运行 Flask 应用，代替 `python3 web_server.py` 的开发服务器：
+- 网络读写由 waitress 的事件循环处理，慢客户端不占用工作线程；请求由 --threads 个工作线程执行
+- 单进程多线程：推送中心、告警引擎、上报写入线程和响应缓存在进程内只有一份，
+  多进程会重复告警、重复写入异常检测基线，因此不提供多进程模式（SQLite 查询释放 GIL，线程可以并行等待 I/O）
+- 每个 /api/stream 连接占用一个工作线程，推送连接数上限为 STREAM_MAX_CLIENTS
+  （未配置时为 --threads 减去 STREAM_RESERVED_THREADS），超出时返回 503，前端改为定时增量同步
+
+用法：
+    python3 serve.py
+    python3 serve.py --threads 64 --port 5003
+"""
+
+import argparse
+import sys
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+import web_server
+
+# 为普通请求保留的工作线程数（不被推送连接占用）
+STREAM_RESERVED_THREADS = 8
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Network Traffic Monitor production server (waitress)')
+    parser.add_argument('--host', default=web_server.WEB_HOST, help=f'监听地址，默认 {web_server.WEB_HOST}')
+    parser.add_argument('--port', type=int, default=web_server.WEB_PORT, help=f'监听端口，默认 {web_server.WEB_PORT}')
+    parser.add_argument('--threads', type=int, default=web_server.WEB_THREADS,
+                        help=f'工作线程数，默认 {web_server.WEB_THREADS}')
+    parser.add_argument('--connection-limit', type=int, default=web_server.WEB_CONNECTION_LIMIT,
+                        help=f'同时打开的连接数上限，默认 {web_server.WEB_CONNECTION_LIMIT}')
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if waitress is None:
+        sys.exit('serve.py 需要 waitress：pip3 install waitress（或使用开发服务器 python3 web_server.py）')
+    if args.threads <= STREAM_RESERVED_THREADS:
+        sys.exit(f'--threads must be greater than {STREAM_RESERVED_THREADS}')
+
+    if web_server.STREAM_MAX_CLIENTS is None:
+        web_server.STREAM_MAX_CLIENTS = args.threads - STREAM_RESERVED_THREADS
+    elif web_server.STREAM_MAX_CLIENTS > args.threads - STREAM_RESERVED_THREADS:
+        web_server.app.logger.warning(
+            f'STREAM_MAX_CLIENTS ({web_server.STREAM_MAX_CLIENTS}) leaves fewer than '
+            f'{STREAM_RESERVED_THREADS} of {args.threads} threads for other requests'
+        )
+
+    logger = web_server.app.logger
+    logger.info('Starting Network Traffic Web Server (waitress)...')
+    logger.info(f'Host: {args.host}, Port: {args.port}')
+    logger.info(f'Threads: {args.threads}, connection limit: {args.connection_limit}, '
+                f'stream limit: {web_server.STREAM_MAX_CLIENTS}')
+    logger.info(f'Alert config: {web_server.ALERT_CONFIG}')
+    waitress.serve(
+        web_server.app,
+        host=args.host,
+        port=args.port,
+        threads=args.threads,
+        connection_limit=args.connection_limit,
+        # poll() 没有 select() 的 1024 个文件描述符限制
+        asyncore_use_poll=True,
+        ident='network-traffic-monitor'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,740 @@
+"""
+Shared SQLite storage layer
+采集脚本和 Web 服务共用的数据库访问：连接参数调优（WAL 等）、连接池、表结构与迁移，
+以及可选的按天分区存储（原始数据每天一个数据库文件）。
+"""
+
+import logging
+import os
+import pathlib
+import queue
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import perf
+
+logger = logging.getLogger('network_monitor')
+
+ROLLUP_RESOLUTIONS = (60, 300, 3600, 86400)  # 预聚合粒度：1 分钟 / 5 分钟 / 1 小时 / 1 天
+
+# 等待写锁的最长时间（秒）
+BUSY_TIMEOUT = 5.0
+# 每个连接缓存的预编译语句数（相同 SQL 文本复用同一个 prepared statement）
+STATEMENT_CACHE_SIZE = 256
+# 连接池中最多保留的空闲连接数
+POOL_MAX_IDLE = 8
+# PRAGMA auto_vacuum 的取值：2 表示 INCREMENTAL（删除数据后由 PRAGMA incremental_vacuum 回收空间）
+AUTO_VACUUM_INCREMENTAL = 2
+
+# 每个连接打开时执行的 PRAGMA
+# WAL：读不阻塞写、写不阻塞读；WAL 模式下 synchronous=NORMAL 仍保证数据库一致，只可能丢失断电前最后的事务
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16384',      # 16 MiB 页缓存
+    'PRAGMA mmap_size = 268435456',    # 256 MiB 内存映射读取
+    'PRAGMA temp_store = MEMORY',
+)
+
+def connect(path, check_same_thread=True):
+    """打开一个按 CONNECTION_PRAGMAS 调优过的连接（SQL 耗时计入 perf 的当前 Timer）"""
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=check_same_thread,
+        factory=perf.TimedConnection
+    )
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+class ConnectionPool:
+    """线程安全的连接池：连接借出期间由一个线程独占，归还后由其他线程复用
+
+    Flask 开发服务器为每个请求新建线程，按线程保存连接无法复用，因此使用借出/归还的方式。
+    """
+
+    def __init__(self, path, max_idle=POOL_MAX_IDLE):
+        self.path = path
+        self.max_idle = max_idle
+        self._idle = queue.LifoQueue()
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect(self.path, check_same_thread=False)
+
+    def release(self, conn):
+        # 未提交的事务回滚，避免把锁或旧快照带给下一个使用者
+        if conn.in_transaction:
+            conn.rollback()
+        conn.row_factory = None
+        if self._idle.qsize() < self.max_idle:
+            self._idle.put(conn)
+        else:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(path):
+    """每个数据库文件一个共享连接池"""
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = ConnectionPool(path)
+        return pool
+
+# 数据库结构版本（PRAGMA user_version）
+# 0: timestamp 为 TEXT 格式的本地时间，无索引
+# 1: timestamp 为 INTEGER 的 Unix 时间戳（秒），带时间索引
+# 2: 新增预聚合表 traffic_rollup
+# 3: 新增汇总表 traffic_summary
+# 4: 新增键值表 meta，启用 auto_vacuum = INCREMENTAL
+# 5: 各表新增 host 列（'' 为本机采集，其他为通过 /api/ingest 上报的主机），新增上报缓冲表 ingest_outbox
+# 6: 新增异常检测基线表 anomaly_baseline
+SCHEMA_VERSION = 6
+
+# 原始数据表（按天分区时每个分区文件中各有一份）
+RAW_SCHEMA_STATEMENTS = [
+    # 汇总表：所有网卡的合计
+    '''
+    CREATE TABLE IF NOT EXISTS traffic_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp INTEGER NOT NULL,
+        bytes_received INTEGER,
+        bytes_sent INTEGER,
+        download_speed REAL,
+        upload_speed REAL,
+        host TEXT NOT NULL DEFAULT ''
+    )
+    ''',
+    # 按时间的索引用于清理过期数据，(host, timestamp) 用于查询
+    '''
+    CREATE INDEX IF NOT EXISTS idx_traffic_data_timestamp
+    ON traffic_data (timestamp)
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_traffic_data_host_timestamp
+    ON traffic_data (host, timestamp)
+    ''',
+    # 分网卡表：每次采样每个网卡一行
+    '''
+    CREATE TABLE IF NOT EXISTS interface_traffic (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp INTEGER NOT NULL,
+        iface TEXT NOT NULL,
+        bytes_received INTEGER,
+        bytes_sent INTEGER,
+        download_speed REAL,
+        upload_speed REAL,
+        host TEXT NOT NULL DEFAULT ''
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_interface_traffic_host_iface_timestamp
+    ON interface_traffic (host, iface, timestamp)
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_interface_traffic_timestamp
+    ON interface_traffic (timestamp)
+    ''',
+]
+
+SCHEMA_STATEMENTS = RAW_SCHEMA_STATEMENTS + [
+    # 预聚合表：每个粒度、每台主机、每个网卡（'' 表示合计）、每个时间桶一行
+    # bytes_* 为桶内增量，last_* 为桶内最后一次采样的累计计数
+    '''
+    CREATE TABLE IF NOT EXISTS traffic_rollup (
+        resolution INTEGER NOT NULL,
+        host TEXT NOT NULL DEFAULT '',
+        iface TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        bytes_received INTEGER NOT NULL DEFAULT 0,
+        bytes_sent INTEGER NOT NULL DEFAULT 0,
+        max_download_speed REAL NOT NULL DEFAULT 0,
+        max_upload_speed REAL NOT NULL DEFAULT 0,
+        last_received INTEGER,
+        last_sent INTEGER,
+        samples INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (resolution, host, iface, bucket)
+    ) WITHOUT ROWID
+    ''',
+    # 汇总表：每台主机的每个网卡（'' 表示合计）一行，随采样和清理在同一事务中更新，/api/stats 只需按主键读取
+    # total_* 为自 first_time 起真实传输的字节数（计数器重置已处理），不受数据清理影响
+    '''
+    CREATE TABLE IF NOT EXISTS traffic_summary (
+        host TEXT NOT NULL DEFAULT '',
+        iface TEXT NOT NULL,
+        record_count INTEGER NOT NULL DEFAULT 0,
+        min_time INTEGER,
+        max_time INTEGER,
+        first_time INTEGER,
+        latest_received INTEGER,
+        latest_sent INTEGER,
+        total_received INTEGER NOT NULL DEFAULT 0,
+        total_sent INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (host, iface)
+    ) WITHOUT ROWID
+    ''',
+    # 键值表：保存数据清理的运行状态等少量元数据
+    '''
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    ) WITHOUT ROWID
+    ''',
+    # 上报缓冲表：采集脚本配置了 INGEST_URL 时，待发送到中心服务器的采样（JSON），发送成功后删除
+    '''
+    CREATE TABLE IF NOT EXISTS ingest_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        payload TEXT NOT NULL
+    )
+    ''',
+    # 异常检测基线：每个 (主机, 网卡, 一周中的小时, 方向) 的速度均值和方差（见 anomaly.py）
+    '''
+    CREATE TABLE IF NOT EXISTS anomaly_baseline (
+        host TEXT NOT NULL,
+        iface TEXT NOT NULL,
+        slot INTEGER NOT NULL,
+        direction TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        mean REAL NOT NULL,
+        m2 REAL NOT NULL,
+        PRIMARY KEY (host, iface, slot, direction)
+    ) WITHOUT ROWID
+    ''',
+]
+
+# 参数为 rollup_rows() 生成的行；samples 为合并进该行的采样数（批量写入时可在内存中先合并同一个桶）
+ROLLUP_UPSERT_SQL = '''
+    INSERT INTO traffic_rollup (
+        resolution, host, iface, bucket, bytes_received, bytes_sent,
+        max_download_speed, max_upload_speed, last_received, last_sent, samples
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (resolution, host, iface, bucket) DO UPDATE SET
+        bytes_received = bytes_received + excluded.bytes_received,
+        bytes_sent = bytes_sent + excluded.bytes_sent,
+        max_download_speed = MAX(max_download_speed, excluded.max_download_speed),
+        max_upload_speed = MAX(max_upload_speed, excluded.max_upload_speed),
+        last_received = excluded.last_received,
+        last_sent = excluded.last_sent,
+        samples = samples + excluded.samples
+'''
+
+# 从原始数据重建预聚合（升级到版本 2 时使用）
+# 本地时间对齐的桶起点：timestamp - (本地时间秒数 % 粒度)
+ROLLUP_BACKFILL_SQL = '''
+    INSERT OR REPLACE INTO traffic_rollup (
+        resolution, host, iface, bucket, bytes_received, bytes_sent,
+        max_download_speed, max_upload_speed, last_received, last_sent, samples
+    )
+    SELECT :resolution, host, iface, bucket, SUM(inc_received), SUM(inc_sent),
+           COALESCE(MAX(download_speed), 0), COALESCE(MAX(upload_speed), 0),
+           MAX(last_received), MAX(last_sent), COUNT(*)
+    FROM (
+        SELECT host, iface, bucket, download_speed, upload_speed,
+               CASE WHEN prev_received IS NULL THEN 0
+                    WHEN bytes_received >= prev_received THEN bytes_received - prev_received
+                    ELSE bytes_received END AS inc_received,
+               CASE WHEN prev_sent IS NULL THEN 0
+                    WHEN bytes_sent >= prev_sent THEN bytes_sent - prev_sent
+                    ELSE bytes_sent END AS inc_sent,
+               FIRST_VALUE(bytes_received) OVER bucket_desc AS last_received,
+               FIRST_VALUE(bytes_sent) OVER bucket_desc AS last_sent
+        FROM (
+            SELECT host, {iface} AS iface, timestamp, bytes_received, bytes_sent, download_speed, upload_speed,
+                   timestamp - (CAST(strftime('%s', timestamp, 'unixepoch', 'localtime') AS INTEGER) % :resolution) AS bucket,
+                   LAG(bytes_received) OVER (PARTITION BY host, {iface} ORDER BY timestamp) AS prev_received,
+                   LAG(bytes_sent) OVER (PARTITION BY host, {iface} ORDER BY timestamp) AS prev_sent
+            FROM {table}
+        )
+        WINDOW bucket_desc AS (PARTITION BY host, iface, bucket ORDER BY timestamp DESC)
+    )
+    GROUP BY host, iface, bucket
+'''
+
+# 参数为 summary_row() 生成的行；record_count 为本次写入的采样数
+SUMMARY_UPSERT_SQL = '''
+    INSERT INTO traffic_summary (
+        host, iface, record_count, min_time, max_time, first_time,
+        latest_received, latest_sent, total_received, total_sent
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (host, iface) DO UPDATE SET
+        record_count = record_count + excluded.record_count,
+        min_time = COALESCE(MIN(min_time, excluded.min_time), excluded.min_time),
+        max_time = COALESCE(MAX(max_time, excluded.max_time), excluded.max_time),
+        first_time = COALESCE(MIN(first_time, excluded.first_time), excluded.first_time),
+        latest_received = excluded.latest_received,
+        latest_sent = excluded.latest_sent,
+        total_received = total_received + excluded.total_received,
+        total_sent = total_sent + excluded.total_sent
+'''
+
+# 从已有数据生成汇总（升级到版本 3 时使用），累计流量取自按天预聚合的增量
+SUMMARY_BACKFILL_SQL = '''
+    INSERT OR REPLACE INTO traffic_summary (
+        host, iface, record_count, min_time, max_time, first_time,
+        latest_received, latest_sent, total_received, total_sent
+    )
+    SELECT s.host, s.iface, s.record_count, s.min_time, s.max_time, s.min_time,
+           latest.bytes_received, latest.bytes_sent,
+           COALESCE((SELECT SUM(r.bytes_received) FROM traffic_rollup r
+                     WHERE r.resolution = :resolution AND r.host = s.host AND r.iface = s.iface), 0),
+           COALESCE((SELECT SUM(r.bytes_sent) FROM traffic_rollup r
+                     WHERE r.resolution = :resolution AND r.host = s.host AND r.iface = s.iface), 0)
+    FROM (
+        SELECT host, {iface} AS iface, COUNT(*) AS record_count,
+               MIN(timestamp) AS min_time, MAX(timestamp) AS max_time
+        FROM {table}
+        GROUP BY 1, 2
+    ) s
+    JOIN {table} latest
+        ON latest.timestamp = s.max_time AND latest.host = s.host AND {iface_column} = s.iface
+'''
+
+def calculate_increment(current, previous):
+    """计算两次采样之间的增量 (bytes)
+
+    计数器重置（差值为负）时增量为 current（从 0 开始重新计数）。预聚合、汇总表、上报写入、
+    原始数据查询、导出和推送事件都使用这一规则，同一时间段在不同粒度下的总量一致
+    （REBUILD_ROLLUP_SQL 中的 CASE 与之相同）。
+    """
+    if previous is None:
+        return 0
+    diff = current - previous
+    if diff < 0:
+        return current  # 计数器重置，从 0 开始重新计数
+    return diff
+
+def bucket_start(timestamp, resolution):
+    """按本地时间对齐的时间桶起点（例如按天聚合时以本地 0 点为界）"""
+    local_seconds = timestamp + time.localtime(timestamp).tm_gmtoff
+    return timestamp - local_seconds % resolution
+
+def rollup_rows(host, timestamp, iface, received, sent, prev_received, prev_sent, download_speed, upload_speed):
+    """生成一次采样对应的各粒度预聚合行（ROLLUP_UPSERT_SQL 的参数）"""
+    inc_received = calculate_increment(received, prev_received)
+    inc_sent = calculate_increment(sent, prev_sent)
+    return [
+        (resolution, host, iface, bucket_start(timestamp, resolution), inc_received, inc_sent,
+         download_speed, upload_speed, received, sent, 1)
+        for resolution in ROLLUP_RESOLUTIONS
+    ]
+
+def summary_row(host, timestamp, iface, received, sent, prev_received, prev_sent):
+    """生成一次采样对应的汇总表更新参数（SUMMARY_UPSERT_SQL 的参数）"""
+    return (host, iface, 1, timestamp, timestamp, timestamp, received, sent,
+            calculate_increment(received, prev_received), calculate_increment(sent, prev_sent))
+
+def table_exists(conn, name):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+    return row is not None
+
+def migrate_to_epoch_timestamps(conn):
+    """版本 0 -> 1：把 TEXT 本地时间转换为 INTEGER Unix 时间戳"""
+    conn.execute('DROP INDEX IF EXISTS idx_interface_traffic_iface_timestamp')
+    legacy_tables = [name for name in ('traffic_data', 'interface_traffic') if table_exists(conn, name)]
+    for name in legacy_tables:
+        conn.execute(f'ALTER TABLE {name} RENAME TO {name}_v0')
+
+    for statement in SCHEMA_STATEMENTS:
+        conn.execute(statement)
+
+    # strftime 的 'utc' 修饰符把本地时间转换为 UTC，'%s' 得到 Unix 时间戳
+    epoch = "CAST(strftime('%s', timestamp, 'utc') AS INTEGER)"
+    if 'traffic_data' in legacy_tables:
+        conn.execute(f'''
+            INSERT INTO traffic_data (id, timestamp, bytes_received, bytes_sent, download_speed, upload_speed)
+            SELECT id, {epoch}, bytes_received, bytes_sent, download_speed, upload_speed
+            FROM traffic_data_v0
+            WHERE strftime('%s', timestamp) IS NOT NULL
+        ''')
+    if 'interface_traffic' in legacy_tables:
+        conn.execute(f'''
+            INSERT INTO interface_traffic (id, timestamp, iface, bytes_received, bytes_sent, download_speed, upload_speed)
+            SELECT id, {epoch}, iface, bytes_received, bytes_sent, download_speed, upload_speed
+            FROM interface_traffic_v0
+            WHERE strftime('%s', timestamp) IS NOT NULL
+        ''')
+    for name in legacy_tables:
+        conn.execute(f'DROP TABLE {name}_v0')
+
+def column_exists(conn, table, column):
+    return any(row[1] == column for row in conn.execute(f'PRAGMA table_info({table})'))
+
+def add_raw_host_columns(conn):
+    """版本 4 -> 5：原始数据表增加 host 列（已有数据均为本机采集），网卡索引改为 (host, iface, timestamp)"""
+    for table in ('traffic_data', 'interface_traffic'):
+        if table_exists(conn, table) and not column_exists(conn, table, 'host'):
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN host TEXT NOT NULL DEFAULT ''")
+    conn.execute('DROP INDEX IF EXISTS idx_interface_traffic_iface_timestamp')
+
+def migrate_host_dimension(conn):
+    """版本 4 -> 5：各表增加 host 维度；预聚合表和汇总表的主键变化，需要重建"""
+    add_raw_host_columns(conn)
+    rebuilt = {
+        'traffic_rollup': 'resolution, iface, bucket, bytes_received, bytes_sent, '
+                          'max_download_speed, max_upload_speed, last_received, last_sent, samples',
+        'traffic_summary': 'iface, record_count, min_time, max_time, first_time, '
+                           'latest_received, latest_sent, total_received, total_sent',
+    }
+    for table, columns in rebuilt.items():
+        if table_exists(conn, table) and not column_exists(conn, table, 'host'):
+            conn.execute(f'ALTER TABLE {table} RENAME TO {table}_v4')
+            for statement in SCHEMA_STATEMENTS:
+                conn.execute(statement)
+            conn.execute(f"INSERT INTO {table} (host, {columns}) SELECT '', {columns} FROM {table}_v4")
+            conn.execute(f'DROP TABLE {table}_v4')
+
+def migrate_partition_hosts(path):
+    """版本 4 -> 5：已有的分区文件同样增加 host 列（封存的分区临时恢复写权限）"""
+    for key in list_partitions(path):
+        file = partition_file(path, key)
+        sealed = is_sealed(file)
+        if sealed:
+            os.chmod(file, 0o644)
+        conn = sqlite3.connect(file, timeout=BUSY_TIMEOUT)
+        try:
+            add_raw_host_columns(conn)
+            for statement in RAW_SCHEMA_STATEMENTS:
+                conn.execute(statement)
+            conn.commit()
+        finally:
+            conn.close()
+            if sealed:
+                os.chmod(file, 0o444)
+
+def backfill_rollups(conn):
+    """版本 1 -> 2：根据已有原始数据生成预聚合"""
+    for resolution in ROLLUP_RESOLUTIONS:
+        conn.execute(ROLLUP_BACKFILL_SQL.format(iface="''", table='traffic_data'), {'resolution': resolution})
+        conn.execute(ROLLUP_BACKFILL_SQL.format(iface='iface', table='interface_traffic'), {'resolution': resolution})
+
+def backfill_summary(conn):
+    """版本 2 -> 3：根据已有数据生成汇总表"""
+    resolution = max(ROLLUP_RESOLUTIONS)
+    conn.execute(SUMMARY_BACKFILL_SQL.format(iface="''", iface_column="''", table='traffic_data'),
+                 {'resolution': resolution})
+    conn.execute(SUMMARY_BACKFILL_SQL.format(iface='iface', iface_column='latest.iface', table='interface_traffic'),
+                 {'resolution': resolution})
+
+# 采集脚本最近一次采集的耗时 JSON {"timestamp", "seconds", "phases"}（与采样在同一个事务中写入，供 Web 服务的 /metrics 和 /api/debug/perf 读取）
+COLLECTOR_TICK_KEY = 'collector_tick'
+
+def get_meta(conn, key, default=None):
+    row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else default
+
+def set_meta(conn, key, value):
+    """写入元数据（不提交，由调用方控制事务）"""
+    conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+def upgrade_schema(path):
+    """Initialize the database if it doesn't exist, upgrading old schemas in place"""
+    is_new = not os.path.exists(path)
+    conn = connect(path)
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
+        # 迁移在一个事务中完成，失败时整体回滚
+        conn.execute('BEGIN')
+        if version < 1 and table_exists(conn, 'traffic_data'):
+            logger.info("Migrating timestamps to integer epoch seconds...")
+            migrate_to_epoch_timestamps(conn)
+        if version < 5:
+            migrate_host_dimension(conn)
+        for statement in SCHEMA_STATEMENTS:
+            conn.execute(statement)
+        if version < 2:
+            backfill_rollups(conn)
+        if version < 3:
+            backfill_summary(conn)
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
+        if version < 5 and is_partitioned(conn):
+            migrate_partition_hosts(path)
+
+        # 版本 3 -> 4：auto_vacuum 只有在 VACUUM 重建数据库后才生效（升级时执行一次）
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            logger.info("Enabling incremental auto-vacuum...")
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    if is_new:
+        logger.info("Database initialized successfully!")
+    else:
+        logger.info(f"Database schema upgraded to version {SCHEMA_VERSION}")
+
+# 按天分区存储
+# 原始数据（traffic_data / interface_traffic）按本地日期写入 data/partitions/traffic_YYYYMMDD.db，
+# 预聚合、汇总表和 meta 仍在主库中。过期数据整个文件删除；已结束的分区封存为只读文件，
+# 读取时使用 immutable URI（不加锁、不检测变更）。
+PARTITIONING_KEY = 'partitioning'
+PARTITION_DIR = 'partitions'
+PARTITION_FILE_RE = re.compile(r'traffic_(\d{8})\.db')
+PARTITION_KEY_FORMAT = '%Y%m%d'
+# 写入时把当天分区 ATTACH 到主库连接上使用的 schema 名
+PARTITION_SCHEMA = 'shard'
+# 只读分区的内存映射大小
+PARTITION_MMAP_SIZE = 268435456
+
+def partitions_dir(path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), PARTITION_DIR)
+
+def partition_key(timestamp):
+    """时间戳所在分区（本地日期）"""
+    return time.strftime(PARTITION_KEY_FORMAT, time.localtime(timestamp))
+
+def partition_file(path, key):
+    return os.path.join(partitions_dir(path), f'traffic_{key}.db')
+
+def partition_bounds(key):
+    """分区覆盖的时间范围 [start, end)，以本地时间 0 点为界"""
+    day = datetime.strptime(key, PARTITION_KEY_FORMAT)
+    return int(day.timestamp()), int((day + timedelta(days=1)).timestamp())
+
+def list_partitions(path):
+    """已有的分区，按日期从旧到新排序"""
+    directory = partitions_dir(path)
+    if not os.path.isdir(directory):
+        return []
+    keys = []
+    for name in os.listdir(directory):
+        match = PARTITION_FILE_RE.fullmatch(name)
+        if match:
+            keys.append(match.group(1))
+    return sorted(keys)
+
+def overlapping_partitions(path, start_ts=None, end_ts=None):
+    """与 [start_ts, end_ts] 重叠的分区（None 表示不限）"""
+    keys = list_partitions(path)
+    if start_ts is not None:
+        first = partition_key(start_ts)
+        keys = [key for key in keys if key >= first]
+    if end_ts is not None:
+        last = partition_key(end_ts)
+        keys = [key for key in keys if key <= last]
+    return keys
+
+def database_path(conn):
+    """连接的主库文件路径"""
+    for row in conn.execute('PRAGMA database_list'):
+        if row[1] == 'main':
+            return row[2]
+
+def is_partitioned(conn):
+    """是否按天分区存储（尚未升级、没有 meta 表的数据库视为未分区）"""
+    return table_exists(conn, 'meta') and get_meta(conn, PARTITIONING_KEY) == 'day'
+
+def is_sealed(file):
+    """封存的分区没有写权限"""
+    return not os.stat(file).st_mode & 0o222
+
+def is_partition_sealed(path, key):
+    """该日期的分区是否已封存（分区不存在时为 False）"""
+    file = partition_file(path, key)
+    return os.path.exists(file) and is_sealed(file)
+
+def create_partition(path, key):
+    os.makedirs(partitions_dir(path), exist_ok=True)
+    file = partition_file(path, key)
+    conn = connect(file)
+    try:
+        for statement in RAW_SCHEMA_STATEMENTS:
+            conn.execute(statement)
+        conn.commit()
+    finally:
+        conn.close()
+    return file
+
+def open_partition(path, key):
+    """打开一个分区用于读取；已封存的分区以只读 immutable URI 打开，并启用 mmap"""
+    file = partition_file(path, key)
+    if is_sealed(file):
+        conn = sqlite3.connect(
+            f'{pathlib.Path(file).resolve().as_uri()}?mode=ro&immutable=1',
+            uri=True,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            check_same_thread=False,
+            factory=perf.TimedConnection
+        )
+        conn.execute(f'PRAGMA mmap_size = {PARTITION_MMAP_SIZE}')
+        return conn
+    return connect(file, check_same_thread=False)
+
+def seal_partition(path, key):
+    """封存已结束的分区：合并 WAL 并切换为 DELETE 日志模式，使文件自包含，然后去掉写权限
+
+    分区正被其他连接使用时无法切换日志模式，返回 False，下次再试。
+    """
+    file = partition_file(path, key)
+    conn = sqlite3.connect(file, timeout=BUSY_TIMEOUT)
+    try:
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        mode = conn.execute('PRAGMA journal_mode = DELETE').fetchone()[0]
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+    if mode != 'delete':
+        return False
+    os.chmod(file, 0o444)
+    return True
+
+def drop_partition(path, key):
+    """删除整个分区文件（O(1)，不逐行删除）"""
+    file = partition_file(path, key)
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        try:
+            os.unlink(file + suffix)
+        except FileNotFoundError:
+            pass
+
+def attach_write_partition(conn, path, timestamp):
+    """返回写入该时间原始数据的 schema 名：未分区为 main；
+    按天分区时把对应分区 ATTACH 到 conn 上（已是该分区时不重复操作），必须在事务外调用"""
+    if not is_partitioned(conn):
+        return 'main'
+    key = partition_key(timestamp)
+    file = partition_file(path, key)
+    attached = {row[1]: row[2] for row in conn.execute('PRAGMA database_list')}
+    if attached.get(PARTITION_SCHEMA) != os.path.realpath(file):
+        if PARTITION_SCHEMA in attached:
+            conn.execute(f'DETACH DATABASE {PARTITION_SCHEMA}')
+        if not os.path.exists(file):
+            create_partition(path, key)
+        conn.execute(f'ATTACH DATABASE ? AS {PARTITION_SCHEMA}', (file,))
+        conn.execute(f'PRAGMA {PARTITION_SCHEMA}.synchronous = NORMAL')
+    return PARTITION_SCHEMA
+
+def iter_raw_batches(conn, path, sql, params=(), start_ts=None, end_ts=None, descending=False,
+                     batch_size=1000):
+    """在原始数据表上执行查询，按批返回元组列表
+
+    未分区时直接在 conn 上执行；按天分区时只在与 [start_ts, end_ts] 重叠的分区上依次执行
+    （descending 时从新到旧）。sql 自身按 timestamp 排序时，拼接后的结果整体有序。
+    """
+    if not is_partitioned(conn):
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+
+    keys = overlapping_partitions(path, start_ts, end_ts)
+    if descending:
+        keys.reverse()
+    for key in keys:
+        part = open_partition(path, key)
+        try:
+            cursor = part.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            part.close()
+
+def fetch_raw_rows(conn, path, sql, params=(), start_ts=None, end_ts=None, descending=False, limit=None):
+    """iter_raw_batches 的结果合并为一个列表；limit 用于跨分区的 ORDER BY ... LIMIT 查询"""
+    if not is_partitioned(conn):
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        return cursor.execute(sql, params).fetchall()
+    rows = []
+    for batch in iter_raw_batches(conn, path, sql, params, start_ts, end_ts, descending,
+                                  batch_size=limit or 100000):
+        rows.extend(batch)
+        if limit and len(rows) >= limit:
+            return rows[:limit]
+    return rows
+
+def enable_partitioning(path):
+    """切换为按天分区存储：把主库中已有的原始数据按天移动到分区文件（一次性）"""
+    conn = connect(path)
+    try:
+        if is_partitioned(conn):
+            return
+        bounds = conn.execute('''
+            SELECT MIN(min_ts), MAX(max_ts) FROM (
+                SELECT MIN(timestamp) AS min_ts, MAX(timestamp) AS max_ts FROM traffic_data
+                UNION ALL
+                SELECT MIN(timestamp), MAX(timestamp) FROM interface_traffic
+            )
+        ''').fetchone()
+        if bounds[0] is not None:
+            logger.info("Moving raw samples into daily partitions...")
+            key = partition_key(bounds[0])
+            last_key = partition_key(bounds[1])
+            while key <= last_key:
+                start, end = partition_bounds(key)
+                create_partition(path, key)
+                conn.execute(f'ATTACH DATABASE ? AS {PARTITION_SCHEMA}', (partition_file(path, key),))
+                # 分区可能是上次中断的迁移留下的，先清空再写入
+                for table, columns in (
+                    ('traffic_data', 'timestamp, host, bytes_received, bytes_sent, download_speed, upload_speed'),
+                    ('interface_traffic', 'timestamp, host, iface, bytes_received, bytes_sent, download_speed, upload_speed'),
+                ):
+                    conn.execute(f'DELETE FROM {PARTITION_SCHEMA}.{table}')
+                    conn.execute(f'''
+                        INSERT INTO {PARTITION_SCHEMA}.{table} ({columns})
+                        SELECT {columns} FROM main.{table}
+                        WHERE timestamp >= ? AND timestamp < ?
+                        ORDER BY timestamp
+                    ''', (start, end))
+                conn.commit()
+                conn.execute(f'DETACH DATABASE {PARTITION_SCHEMA}')
+                key = partition_key(end)
+        conn.execute('DELETE FROM main.traffic_data')
+        conn.execute('DELETE FROM main.interface_traffic')
+        set_meta(conn, PARTITIONING_KEY, 'day')
+        conn.commit()
+        logger.info("Daily partitioning enabled")
+    finally:
+        conn.close()
+
+def init_database(path, partitioning=None):
+    """初始化或升级数据库；partitioning='day' 时启用按天分区存储
+
+    分区一旦启用就保持启用（关闭需要手动把分区数据合并回主库）。
+    """
+    upgrade_schema(path)
+    if partitioning == 'day':
+        enable_partitioning(path)
+    elif partitioning:
+        raise ValueError(f'Unknown storage partitioning: {partitioning}')
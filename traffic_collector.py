@@ -4,19 +4,64 @@ Network Traffic Monitor - 5-minute interval version
 Collects network traffic data every 5 minutes and stores in SQLite database.
 """
 
-import sqlite3
 import time
-import subprocess
 import sys
 import os
+import json
+import signal
+import socket
+import sqlite3
+import argparse
 import logging
+import threading
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
 from logging.handlers import RotatingFileHandler
-from datetime import datetime, timedelta
+from datetime import datetime
+
+import alerts
+import counters
+import hires
+import perf
+import retention
+import storage
 
 # 配置
 DB_PATH = 'data/traffic.db'
 LOG_DIR = 'logs'
 COLLECTION_INTERVAL = 300  # 5 分钟
+CLEANUP_INTERVAL = 3600  # 清理过期数据的间隔（秒）
+CLEANUP_CHECK_INTERVAL = 60  # 守护模式下清理线程检查是否到期的间隔（秒）
+COUNTER_SOURCE = 'auto'  # auto | proc | netstat | fixture
+COUNTER_FIXTURE = None   # fixture 模式下读取的抓取文件
+
+# 数据保留策略（可在 config.py 中覆盖）
+try:
+    import config
+except ImportError:
+    config = None
+RAW_RETENTION_DAYS = getattr(config, 'RAW_RETENTION_DAYS', retention.RAW_RETENTION_DAYS)
+ROLLUP_RETENTION_DAYS = getattr(config, 'ROLLUP_RETENTION_DAYS', retention.ROLLUP_RETENTION_DAYS)
+# 高频采样：守护模式下每 HIRES_SAMPLE_INTERVAL 秒读取一次计数器写入内存映射的环形缓冲区（Web 服务读取用于实时图表），
+# 数据库仍按采集间隔写入，预聚合表的最大速度取间隔内高频采样的峰值。None 为关闭
+HIRES_SAMPLE_INTERVAL = getattr(config, 'HIRES_SAMPLE_INTERVAL', None)
+HIRES_BUFFER_SECONDS = getattr(config, 'HIRES_BUFFER_SECONDS', 900)  # 环形缓冲区保留的时长（秒）
+# 原始数据存储方式：None 为单个数据库文件，'day' 为按天分区
+STORAGE_PARTITIONING = getattr(config, 'STORAGE_PARTITIONING', None)
+
+# 多主机上报：设置 INGEST_URL（中心服务器的 /api/ingest）后，每次采样除写入本地数据库外，
+# 还在同一事务中放入本地缓冲表 ingest_outbox，再批量发送；服务器不可达时保留在缓冲表中稍后重试
+INGEST_URL = getattr(config, 'INGEST_URL', None)
+INGEST_HOST = getattr(config, 'INGEST_HOST', None) or socket.gethostname()
+INGEST_TOKEN = getattr(config, 'INGEST_TOKEN', None)
+INGEST_BATCH_SIZE = 500  # 每次请求最多发送的采样数
+INGEST_BUFFER_MAX = 100000  # 缓冲上限（采样数），超出时丢弃最旧的采样
+INGEST_TIMEOUT = 10  # 请求超时（秒）
+INGEST_RETRY_MIN = 5  # 守护模式下发送失败后的重试间隔（秒），连续失败时翻倍
+INGEST_RETRY_MAX = 300
+# 这些状态码表示稍后重试可能成功，其余 4xx 表示服务器拒绝该批数据
+INGEST_RETRY_STATUS = (401, 403, 408, 429)
 
 # 确保日志目录存在
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -46,86 +91,109 @@ logger.setLevel(logging.INFO)
 logger.addHandler(monitor_handler)
 logger.addHandler(error_handler)
 
-# 告警配置
+# 告警配置（与 Web 服务相同的 config.py 配置项）
 ALERT_CONFIG = {
-    'enabled': True,
-    'download_threshold_mb': 100,
-    'upload_threshold_mb': 50,
-    'speed_threshold_mbps': 10,
-    'last_alert_file': f'{LOG_DIR}/last_alert.txt'
+    'enabled': getattr(config, 'ALERT_ENABLED', True),
+    'download_threshold_mb': getattr(config, 'ALERT_DOWNLOAD_THRESHOLD_MB', alerts.DOWNLOAD_THRESHOLD_MB),
+    'upload_threshold_mb': getattr(config, 'ALERT_UPLOAD_THRESHOLD_MB', alerts.UPLOAD_THRESHOLD_MB),
+    'speed_threshold_mbps': getattr(config, 'ALERT_SPEED_THRESHOLD_MBPS', alerts.SPEED_THRESHOLD_MBPS),
+    'cooldown': getattr(config, 'ALERT_COOLDOWN', alerts.COOLDOWN_SECONDS),
+    'clear_ratio': getattr(config, 'ALERT_CLEAR_RATIO', alerts.CLEAR_RATIO)
 }
+# 滑动窗口告警规则（见 alerts.parse_rules）
+ALERT_RULES = getattr(config, 'ALERT_RULES', [])
+
+# 告警状态和滑动窗口保存在内存中（启动后第一次采样时从预聚合表补齐窗口），
+# 状态由后台线程（单次运行模式下在退出前）写入 logs/alert_state_collector.json
+alert_engine = alerts.AlertEngine(
+    ALERT_CONFIG,
+    rules=ALERT_RULES,
+    enabled=ALERT_CONFIG['enabled'],
+    cooldown=ALERT_CONFIG['cooldown'],
+    clear_ratio=ALERT_CONFIG['clear_ratio'],
+    state_file=f'{LOG_DIR}/alert_state_collector.json',
+    db_path=DB_PATH,
+    logger=logger
+)
 
-def get_network_stats():
-    """Get network statistics using netstat on macOS (no popup window)"""
-    try:
-        result = subprocess.run(
-            ['/usr/sbin/netstat', '-ib'],
-            capture_output=True, text=True, timeout=10
-        )
-
-        if result.returncode != 0:
-            logger.error(f"Error running netstat: {result.stderr}")
-            return None, None
-
-        total_received = 0
-        total_sent = 0
-
-        for line in result.stdout.strip().split('\n'):
-            parts = line.split()
-            if len(parts) >= 10 and parts[0].startswith('en'):
-                # Ibytes is column 6, Obytes is column 9
-                try:
-                    total_received += int(parts[6])
-                    total_sent += int(parts[9])
-                except ValueError:
-                    continue
+# 计数器数据源（首次使用时创建，之后复用）
+counter_source = None
 
-        return total_received, total_sent
+def get_counter_source():
+    global counter_source
+    if counter_source is None:
+        counter_source = counters.create_source(COUNTER_SOURCE, COUNTER_FIXTURE)
+        logger.info(f"Counter source: {counter_source.name}")
+    return counter_source
 
+def get_interface_stats():
+    """获取各网卡的累计计数 {iface: (bytes_received, bytes_sent)}，失败返回 None"""
+    try:
+        return get_counter_source().read()
     except Exception as e:
         logger.error(f"Error getting network stats: {e}")
+        return None
+
+def sum_interface_stats(interfaces):
+    """汇总所有网卡的计数"""
+    total_received = 0
+    total_sent = 0
+    for received, sent in interfaces.values():
+        total_received += received
+        total_sent += sent
+    return total_received, total_sent
+
+def get_network_stats():
+    """Get summed network statistics from the configured counter source"""
+    interfaces = get_interface_stats()
+    if interfaces is None:
         return None, None
+    return sum_interface_stats(interfaces)
+
+@contextmanager
+def open_connection(conn=None):
+    """复用传入的持久连接；未传入时临时打开一个，用完即关闭"""
+    if conn is not None:
+        yield conn
+        return
+    conn = storage.connect(DB_PATH)
+    try:
+        yield conn
+    finally:
+        conn.close()
 
 def init_database():
-    """Initialize the database if it doesn't exist"""
-    if not os.path.exists(DB_PATH):
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS traffic_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME,
-                bytes_received INTEGER,
-                bytes_sent INTEGER,
-                download_speed REAL,
-                upload_speed REAL
-            )
-        ''')
-        conn.commit()
-        conn.close()
-        logger.info("Database initialized successfully!")
+    """Initialize the database if it doesn't exist, upgrading old schemas in place"""
+    storage.init_database(DB_PATH, STORAGE_PARTITIONING)
 
-def get_previous_data():
+def get_previous_data(conn=None):
     """获取上一次采集的数据用于计算速度"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT timestamp, bytes_received, bytes_sent
-            FROM traffic_data
-            ORDER BY timestamp DESC
-            LIMIT 1
-        ''')
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            return {
-                'timestamp': datetime.strptime(row[0], '%Y-%m-%d %H:%M:%S'),
-                'bytes_received': row[1],
-                'bytes_sent': row[2]
-            }
-        return None
+        with open_connection(conn) as conn:
+            rows = storage.fetch_raw_rows(conn, DB_PATH, '''
+                SELECT timestamp, bytes_received, bytes_sent
+                FROM traffic_data
+                WHERE host = ''
+                ORDER BY timestamp DESC
+                LIMIT 1
+            ''', descending=True, limit=1)
+            if not rows:
+                return None
+            row = rows[0]
+
+            interface_rows = storage.fetch_raw_rows(conn, DB_PATH, '''
+                SELECT iface, bytes_received, bytes_sent
+                FROM interface_traffic
+                WHERE host = '' AND timestamp = ?
+            ''', (row[0],), start_ts=row[0], end_ts=row[0])
+            interfaces = {iface: (rx, tx) for iface, rx, tx in interface_rows}
+
+        return {
+            'timestamp': datetime.fromtimestamp(row[0]),
+            'bytes_received': row[1],
+            'bytes_sent': row[2],
+            'interfaces': interfaces
+        }
     except Exception as e:
         logger.error(f"Error getting previous data: {e}")
         return None
@@ -141,73 +209,36 @@ def calculate_speed(current, previous, interval_seconds):
     
     return diff / interval_seconds
 
-def check_traffic_alert(received, sent, prev_received, prev_sent, interval_seconds=COLLECTION_INTERVAL):
-    """检查流量是否触发告警（使用增量值）"""
-    if not ALERT_CONFIG['enabled']:
-        return None
-
-    # 计算增量流量（当前 - 上次）
-    inc_received = received - prev_received if prev_received is not None else received
-    inc_sent = sent - prev_sent if prev_sent is not None else sent
-    
-    # 处理计数器重置（差值为负）
-    if inc_received < 0:
-        inc_received = received
-    if inc_sent < 0:
-        inc_sent = sent
-
-    # 增量流量 (MB)
-    received_mb = inc_received / (1024 * 1024)
-    sent_mb = inc_sent / (1024 * 1024)
-
-    # 计算速度 (Mbps) - 使用增量值
-    download_speed_mbps = (inc_received * 8) / (interval_seconds * 1000000)
-    upload_speed_mbps = (inc_sent * 8) / (interval_seconds * 1000000)
-
-    alerts = []
-
-    if received_mb > ALERT_CONFIG['download_threshold_mb']:
-        alerts.append(f"下载流量告警：{received_mb:.2f} MB (阈值：{ALERT_CONFIG['download_threshold_mb']} MB)")
-
-    if sent_mb > ALERT_CONFIG['upload_threshold_mb']:
-        alerts.append(f"上传流量告警：{sent_mb:.2f} MB (阈值：{ALERT_CONFIG['upload_threshold_mb']} MB)")
-
-    if download_speed_mbps > ALERT_CONFIG['speed_threshold_mbps']:
-        alerts.append(f"下载速度告警：{download_speed_mbps:.2f} Mbps (阈值：{ALERT_CONFIG['speed_threshold_mbps']} Mbps)")
-
-    if upload_speed_mbps > ALERT_CONFIG['speed_threshold_mbps']:
-        alerts.append(f"上传速度告警：{upload_speed_mbps:.2f} Mbps (阈值：{ALERT_CONFIG['speed_threshold_mbps']} Mbps)")
-
-    if alerts:
-        alert_msg = "\n".join(alerts)
-        last_alert = ""
-        if os.path.exists(ALERT_CONFIG['last_alert_file']):
-            with open(ALERT_CONFIG['last_alert_file'], 'r') as f:
-                last_alert = f.read().strip()
-
-        if alert_msg != last_alert:
-            with open(ALERT_CONFIG['last_alert_file'], 'w') as f:
-                f.write(alert_msg)
-            logger.warning(f"🚨 TRAFFIC ALERT: {alert_msg}")
-            return alert_msg
-
-    return None
-
-def save_traffic_data():
-    """Save current network traffic data to database with speed calculation"""
-    init_database()
-
-    received, sent = get_network_stats()
-    if received is None or sent is None:
+@perf.timed('collector_tick')
+def save_traffic_data(conn=None, prev_data=None, interfaces=None, peak_speeds=None):
+    """Save current network traffic data to database with speed calculation
+
+    守护模式下传入持久连接 conn 和内存中的上一次采样 prev_data，
+    避免每次重新查询数据库。返回本次采样（供下次使用），失败返回 None。
+    高频采样模式下传入刚读取的计数 interfaces，以及间隔内的峰值速度 peak_speeds
+    {iface: (download, upload)}（'' 为合计），用作预聚合表的最大速度。
+    """
+    if conn is None:
+        init_database()
+
+    if interfaces is None:
+        with perf.phase('read'):
+            interfaces = get_interface_stats()
+    if interfaces is None:
         logger.error("Failed to get network statistics")
-        return False
+        return None
+    received, sent = sum_interface_stats(interfaces)
 
     # 获取上一次的数据用于计算速度
-    prev_data = get_previous_data()
+    if prev_data is None:
+        prev_data = get_previous_data(conn)
     current_time = datetime.now()
-    
-    # 计算时间间隔
-    if prev_data:
+    current_monotonic = time.monotonic()
+
+    # 计算时间间隔（守护模式下使用单调时钟，不受系统时间调整影响）
+    if prev_data and prev_data.get('monotonic') is not None:
+        time_diff = current_monotonic - prev_data['monotonic']
+    elif prev_data:
         time_diff = (current_time - prev_data['timestamp']).total_seconds()
     else:
         time_diff = COLLECTION_INTERVAL
@@ -216,15 +247,59 @@ def save_traffic_data():
     download_speed = calculate_speed(received, prev_data['bytes_received'] if prev_data else None, time_diff)
     upload_speed = calculate_speed(sent, prev_data['bytes_sent'] if prev_data else None, time_diff)
     
-    # 保存到数据库
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO traffic_data (timestamp, bytes_received, bytes_sent, download_speed, upload_speed)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (current_time.strftime('%Y-%m-%d %H:%M:%S'), received, sent, download_speed, upload_speed))
-    conn.commit()
-    conn.close()
+    # 计算各网卡速度，并生成预聚合行（'' 表示所有网卡合计）
+    timestamp = int(current_time.timestamp())
+    prev_received = prev_data['bytes_received'] if prev_data else None
+    prev_sent = prev_data['bytes_sent'] if prev_data else None
+    peak_speeds = peak_speeds or {}
+    peak_download, peak_upload = peak_speeds.get('', (0, 0))
+    rollups = storage.rollup_rows('', timestamp, '', received, sent, prev_received, prev_sent,
+                                  max(download_speed, peak_download), max(upload_speed, peak_upload))
+    summaries = [storage.summary_row('', timestamp, '', received, sent, prev_received, prev_sent)]
+
+    prev_interfaces = prev_data.get('interfaces', {}) if prev_data else {}
+    interface_rows = []
+    for iface, (iface_received, iface_sent) in sorted(interfaces.items()):
+        prev_iface_received, prev_iface_sent = prev_interfaces.get(iface, (None, None))
+        iface_download_speed = calculate_speed(iface_received, prev_iface_received, time_diff)
+        iface_upload_speed = calculate_speed(iface_sent, prev_iface_sent, time_diff)
+        interface_rows.append((
+            timestamp, iface, iface_received, iface_sent, iface_download_speed, iface_upload_speed
+        ))
+        peak_download, peak_upload = peak_speeds.get(iface, (0, 0))
+        rollups.extend(storage.rollup_rows(
+            '', timestamp, iface, iface_received, iface_sent, prev_iface_received, prev_iface_sent,
+            max(iface_download_speed, peak_download), max(iface_upload_speed, peak_upload)
+        ))
+        summaries.append(storage.summary_row(
+            '', timestamp, iface, iface_received, iface_sent, prev_iface_received, prev_iface_sent
+        ))
+
+    # 保存到数据库（合计行、所有网卡行、预聚合和汇总表在同一个事务中写入；
+    # 按天分区时原始数据写入 ATTACH 的当天分区）
+    with open_connection(conn) as conn:
+        schema = storage.attach_write_partition(conn, DB_PATH, timestamp)
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            INSERT INTO {schema}.traffic_data (timestamp, bytes_received, bytes_sent, download_speed, upload_speed)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (timestamp, received, sent, download_speed, upload_speed))
+        cursor.executemany(f'''
+            INSERT INTO {schema}.interface_traffic (timestamp, iface, bytes_received, bytes_sent, download_speed, upload_speed)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', interface_rows)
+        cursor.executemany(storage.ROLLUP_UPSERT_SQL, rollups)
+        cursor.executemany(storage.SUMMARY_UPSERT_SQL, summaries)
+        if INGEST_URL:
+            queue_for_ingest(cursor, timestamp, received, sent, download_speed, upload_speed, interface_rows)
+        # 本次采集耗时（读取计数器到提交前）及各阶段耗时（read、sql），供 Web 服务的 /metrics 和 /api/debug/perf 使用
+        timer = perf.current()
+        storage.set_meta(conn, storage.COLLECTOR_TICK_KEY, json.dumps({
+            'timestamp': timestamp,
+            'seconds': round(timer.elapsed(), 6),
+            'phases': {name: round(seconds, 6) for name, seconds in timer.phases.items()}
+        }))
+        conn.commit()
 
     # 转换单位用于显示
     received_mb = received / (1024 * 1024)
@@ -235,42 +310,329 @@ def save_traffic_data():
     logger.info(f"Saved: {received_mb:.2f} MB ↓, {sent_mb:.2f} MB ↑ | Speed: {download_mbps:.2f} Mbps ↓, {upload_mbps:.2f} Mbps ↑")
 
     # 检查告警（传入上次的值用于计算增量）
-    prev_received = prev_data['bytes_received'] if prev_data else None
-    prev_sent = prev_data['bytes_sent'] if prev_data else None
-    check_traffic_alert(received, sent, prev_received, prev_sent, time_diff)
-
-    return True
-
-def cleanup_old_data():
-    """Remove data older than 30 days"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    thirty_days_ago = datetime.now() - timedelta(days=30)
-    cursor.execute('''
-        DELETE FROM traffic_data
-        WHERE timestamp < ?
-    ''', (thirty_days_ago.strftime('%Y-%m-%d %H:%M:%S'),))
-    deleted_count = cursor.rowcount
-    conn.commit()
-    conn.close()
-    if deleted_count > 0:
-        logger.info(f"Cleaned up {deleted_count} old records")
+    with perf.phase('alerts'):
+        alert_msg = alert_engine.evaluate('', timestamp, received, sent, prev_received, prev_sent, time_diff,
+                                          interfaces, prev_interfaces)
+    if alert_msg:
+        logger.warning(f"🚨 TRAFFIC ALERT: {alert_msg}")
+    timer = perf.current()
+    logger.debug(f"Tick timing: {timer.server_timing(timer.elapsed())}")
+
+    return {
+        'timestamp': current_time.replace(microsecond=0),
+        'monotonic': current_monotonic,
+        'bytes_received': received,
+        'bytes_sent': sent,
+        'interfaces': interfaces
+    }
+
+def collect_tick(conn, prev_data, interfaces=None, peak_speeds=None):
+    """守护模式的一次采集：写入失败（数据库被锁、磁盘已满、分区 ATTACH 失败等）时回滚、记录日志并返回 None，
+    调用方保留上一次采样，下一个节拍继续采集（下次的增量和速度覆盖两个间隔），常驻进程不会因此退出"""
+    try:
+        return save_traffic_data(conn, prev_data, interfaces, peak_speeds)
+    except Exception as e:
+        logger.error(f"Error saving traffic data: {e}")
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            pass
+        return None
+
+def queue_for_ingest(cursor, timestamp, received, sent, download_speed, upload_speed, interface_rows):
+    """把一次采样放入上报缓冲表（在调用方的事务中），超出 INGEST_BUFFER_MAX 时丢弃最旧的"""
+    payload = json.dumps({
+        'timestamp': timestamp,
+        'bytes_received': received,
+        'bytes_sent': sent,
+        'download_speed': download_speed,
+        'upload_speed': upload_speed,
+        'interfaces': {row[1]: list(row[2:]) for row in interface_rows}
+    })
+    cursor.execute('INSERT INTO ingest_outbox (payload) VALUES (?)', (payload,))
+    cursor.execute('DELETE FROM ingest_outbox WHERE id <= ?', (cursor.lastrowid - INGEST_BUFFER_MAX,))
+
+def push_outbox(conn):
+    """把缓冲表中的采样按 INGEST_BATCH_SIZE 分批 POST 到 INGEST_URL，返回发送成功的采样数
+
+    网络错误、服务器错误（5xx）和 INGEST_RETRY_STATUS 时抛出 OSError，未发送的采样留在缓冲表中；
+    服务器拒绝的批次（其余 4xx）记录错误后丢弃，避免阻塞后面的数据。
+    """
+    sent = 0
+    headers = {'Content-Type': 'application/json'}
+    if INGEST_TOKEN:
+        headers['Authorization'] = f'Bearer {INGEST_TOKEN}'
+    while True:
+        rows = conn.execute(
+            'SELECT id, payload FROM ingest_outbox ORDER BY id LIMIT ?', (INGEST_BATCH_SIZE,)
+        ).fetchall()
+        if not rows:
+            return sent
+        # 缓冲表中已是 JSON 文本，直接拼接，不再解析
+        body = '{"host": %s, "samples": [%s]}' % (json.dumps(INGEST_HOST), ','.join(row[1] for row in rows))
+        request = urllib.request.Request(INGEST_URL, data=body.encode(), headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=INGEST_TIMEOUT) as response:
+                try:
+                    result = json.loads(response.read())
+                except ValueError:
+                    result = {}
+            sent += len(rows)
+            # 目标分区已封存的采样服务端无法写入，重发也不会成功
+            if result.get('rejected'):
+                logger.warning(f"Ingest server rejected {len(result['rejected'])} samples for sealed partitions")
+        except urllib.error.HTTPError as e:
+            if e.code >= 500 or e.code in INGEST_RETRY_STATUS:
+                raise
+            logger.error(f"Ingest server rejected {len(rows)} samples: HTTP {e.code} {e.read()[:200]!r}")
+        conn.execute('DELETE FROM ingest_outbox WHERE id <= ?', (rows[-1][0],))
+        conn.commit()
+
+def run_ingest_worker(stop_event, wakeup):
+    """守护模式下的上报线程：每次采样后被唤醒发送缓冲的采样，失败时按指数退避重试"""
+    conn = storage.connect(DB_PATH)
+    delay = INGEST_RETRY_MIN
+    try:
+        while not stop_event.is_set():
+            timeout = None
+            try:
+                sent = push_outbox(conn)
+                if sent:
+                    logger.info(f"Pushed {sent} samples to {INGEST_URL}")
+                delay = INGEST_RETRY_MIN
+            except OSError as e:
+                logger.warning(f"Ingest server unreachable ({e}), retrying in {delay}s")
+                timeout = delay
+                delay = min(delay * 2, INGEST_RETRY_MAX)
+            wakeup.wait(timeout)
+            wakeup.clear()
+    finally:
+        conn.close()
+
+def cleanup_old_data(conn=None, force=False):
+    """Remove expired data according to the retention policy
+
+    按 CLEANUP_INTERVAL 调度（上次完成时间记录在数据库中，单次采集模式也不会每次都清理），
+    分批删除，每批一个短事务并同步更新汇总表；单次运行有时间上限，未完成的部分下次继续。
+    """
+    with open_connection(conn) as conn:
+        if not force and not retention.is_due(conn, CLEANUP_INTERVAL):
+            return None
+        result = retention.run_retention(conn, RAW_RETENTION_DAYS, ROLLUP_RETENTION_DAYS)
+
+    deleted = result['traffic_data'] + result['interface_traffic'] + result['traffic_rollup'] + result['partitions']
+    if deleted or result['vacuum_pages']:
+        logger.info(
+            f"Cleaned up {result['traffic_data']} samples, {result['interface_traffic']} interface rows, "
+            f"{result['traffic_rollup']} rollup rows ({result['partitions']} partitions dropped), "
+            f"reclaimed {result['vacuum_pages']} pages"
+            + ("" if result['complete'] else " (time budget reached, continuing next run)")
+        )
+    return result
 
 def main():
     """Main function to collect and save data"""
     logger.info("Collecting network traffic data...")
-    if save_traffic_data():
-        cleanup_old_data()
-        return True
+    init_database()
+    # 一次采集只打开一个连接
+    with open_connection() as conn:
+        if save_traffic_data(conn):
+            if INGEST_URL:
+                try:
+                    push_outbox(conn)
+                except OSError as e:
+                    logger.warning(f"Ingest server unreachable ({e}), samples kept for the next run")
+            cleanup_old_data(conn)
+            # 单次运行模式下进程即将退出，在这里保存告警状态
+            alert_engine.stop()
+            return True
     return False
 
+def run_cleanup_worker(stop_event):
+    """守护模式下的清理线程：独立于采集节拍运行，使用自己的数据库连接（WAL 模式下不阻塞读取）"""
+    conn = storage.connect(DB_PATH)
+    try:
+        while not stop_event.is_set():
+            try:
+                result = cleanup_old_data(conn)
+            except Exception as e:
+                logger.error(f"Error cleaning up old data: {e}")
+                result = None
+            # 上次未在时间上限内完成时立即继续，否则等待下次检查
+            if result and not result['complete']:
+                continue
+            stop_event.wait(CLEANUP_CHECK_INTERVAL)
+    finally:
+        conn.close()
+
+def update_peak_speeds(peaks, previous, current, elapsed):
+    """用相邻两次高频采样的速度更新峰值 {iface: [download, upload]}（'' 为合计）"""
+    prev_received, prev_sent = sum_interface_stats(previous)
+    received, sent = sum_interface_stats(current)
+    speeds = [('', received, sent, prev_received, prev_sent)]
+    for iface, (iface_received, iface_sent) in current.items():
+        if iface in previous:
+            speeds.append((iface, iface_received, iface_sent) + tuple(previous[iface]))
+    for iface, rx, tx, prev_rx, prev_tx in speeds:
+        download = calculate_speed(rx, prev_rx, elapsed)
+        upload = calculate_speed(tx, prev_tx, elapsed)
+        peak = peaks.get(iface)
+        if peak is None:
+            peaks[iface] = [download, upload]
+        else:
+            peak[0] = max(peak[0], download)
+            peak[1] = max(peak[1], upload)
+
+def run_high_resolution(conn, prev_data, interval, sample_interval, stop_event, wakeup):
+    """高频采样：每 sample_interval 秒读取一次计数器写入环形缓冲区，每 interval 秒把这段时间合并为一次采样、
+    在一个事务中写入数据库（预聚合表的最大速度取这段时间内的峰值）"""
+    capacity = max(2, int(HIRES_BUFFER_SECONDS / sample_interval))
+    ring = hires.RingBuffer.create(hires.buffer_path(DB_PATH), capacity, sample_interval)
+    logger.info(f"High-resolution sampling every {sample_interval}s ({capacity} samples in {ring.path})")
+
+    peaks = {}
+    previous = None  # (monotonic, interfaces)
+    next_tick = next_flush = time.monotonic()
+    try:
+        while not stop_event.is_set():
+            now = time.monotonic()
+            interfaces = get_interface_stats()
+            if interfaces is not None:
+                received, sent = sum_interface_stats(interfaces)
+                ring.append(time.time(), received, sent)
+                if previous is not None:
+                    update_peak_speeds(peaks, previous[1], interfaces, now - previous[0])
+                previous = (now, interfaces)
+
+                if now >= next_flush:
+                    sample = collect_tick(conn, prev_data, interfaces, peaks)
+                    # 写入失败时保留峰值，计入下一次写入
+                    if sample:
+                        prev_data = sample
+                        peaks = {}
+                        wakeup.set()
+                    next_flush += interval
+                    if next_flush <= now:
+                        next_flush += (int((now - next_flush) // interval) + 1) * interval
+
+            # 高频节拍落后时直接跳过，不记录日志（每秒一次的警告没有意义）
+            next_tick += sample_interval
+            now = time.monotonic()
+            if next_tick <= now:
+                next_tick += (int((now - next_tick) // sample_interval) + 1) * sample_interval
+            stop_event.wait(next_tick - now)
+    finally:
+        ring.close()
+
+def run_daemon(interval=COLLECTION_INTERVAL, stop_event=None, sample_interval=None):
+    """常驻模式：按单调时钟定时采集，复用同一个数据库连接，上一次采样保存在内存中
+
+    指定 sample_interval 时为高频采样模式（见 run_high_resolution）。
+    """
+    if stop_event is None:
+        stop_event = threading.Event()
+
+    init_database()
+    cleanup_thread = threading.Thread(
+        target=run_cleanup_worker, args=(stop_event,), name='retention', daemon=True
+    )
+    cleanup_thread.start()
+    alert_engine.start()
+
+    ingest_wakeup = threading.Event()
+    ingest_thread = None
+    if INGEST_URL:
+        ingest_thread = threading.Thread(
+            target=run_ingest_worker, args=(stop_event, ingest_wakeup), name='ingest', daemon=True
+        )
+        ingest_thread.start()
+
+    conn = storage.connect(DB_PATH)
+    try:
+        # 仅在启动时从数据库读取一次上一次采样
+        prev_data = get_previous_data(conn)
+        if sample_interval:
+            run_high_resolution(conn, prev_data, interval, sample_interval, stop_event, ingest_wakeup)
+            return
+
+        next_tick = time.monotonic()
+        while not stop_event.is_set():
+            sample = collect_tick(conn, prev_data)
+            if sample:
+                prev_data = sample
+                ingest_wakeup.set()
+
+            # 按固定节拍调度；处理过慢时跳过错过的节拍，避免连续补采
+            next_tick += interval
+            now = time.monotonic()
+            if next_tick <= now:
+                missed = int((now - next_tick) // interval) + 1
+                logger.warning(f"Collector fell behind, skipping {missed} tick(s)")
+                next_tick += missed * interval
+            stop_event.wait(next_tick - now)
+    finally:
+        conn.close()
+        stop_event.set()
+        ingest_wakeup.set()
+        cleanup_thread.join()
+        if ingest_thread is not None:
+            ingest_thread.join()
+        alert_engine.stop()
+        logger.info("Network Traffic Monitor stopped")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Network Traffic Monitor collector')
+    parser.add_argument('--daemon', action='store_true',
+                        help='常驻运行，按 --interval 定时采集（默认只采集一次后退出）')
+    parser.add_argument('--interval', type=float, default=COLLECTION_INTERVAL,
+                        help=f'守护模式下的采集间隔（秒），默认 {COLLECTION_INTERVAL}')
+    parser.add_argument('--sample-interval', type=float, default=HIRES_SAMPLE_INTERVAL,
+                        help='守护模式下的高频采样间隔（秒，如 1），写入环形缓冲区供实时图表使用；数据库仍按 --interval 写入')
+    parser.add_argument('--source', choices=['auto', 'proc', 'netstat', 'fixture'], default=COUNTER_SOURCE,
+                        help='网卡计数器数据源（auto: Linux 读取 /proc/net/dev，否则使用 netstat）')
+    parser.add_argument('--fixture', default=COUNTER_FIXTURE,
+                        help='从抓取的 /proc/net/dev 或 netstat -ib 输出文件读取计数（测试用）')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='守护模式下运行采样分析器，退出时把折叠格式的调用栈写入 FILE（可用 flamegraph.pl / speedscope 查看）')
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.interval <= 0:
+        sys.exit("--interval must be positive")
+    if args.sample_interval is not None and not 0 < args.sample_interval < args.interval:
+        sys.exit("--sample-interval must be positive and shorter than --interval")
+    COUNTER_SOURCE = args.source
+    COUNTER_FIXTURE = args.fixture
+
     logger.info("=" * 50)
     logger.info("Network Traffic Monitor Started")
-    logger.info(f"Collection interval: {COLLECTION_INTERVAL} seconds")
+    logger.info(f"Mode: {'daemon' if args.daemon else 'one-shot'}")
+    logger.info(f"Collection interval: {args.interval if args.daemon else COLLECTION_INTERVAL} seconds")
     logger.info(f"Database: {DB_PATH}")
+    logger.info(f"Counter source: {COUNTER_SOURCE}" + (f" ({COUNTER_FIXTURE})" if COUNTER_FIXTURE else ""))
+    if INGEST_URL:
+        logger.info(f"Pushing samples to {INGEST_URL} as host {INGEST_HOST}")
     logger.info(f"Alert config: {ALERT_CONFIG}")
     logger.info("=" * 50)
-    
+
+    if args.daemon:
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+        profiler = None
+        if args.profile:
+            profiler = perf.SamplingProfiler()
+            profiler.start()
+        try:
+            run_daemon(args.interval, stop_event, args.sample_interval)
+        finally:
+            if profiler:
+                profiler.stop()
+                with open(args.profile, 'w') as f:
+                    f.write(profiler.folded())
+                logger.info(f"Wrote {profiler.samples} profile samples to {args.profile}")
+        sys.exit(0)
+
     success = main()
     sys.exit(0 if success else 1)
@@ -1,12 +1,43 @@
-from flask import Flask, render_template, jsonify, request, send_file
+from flask import Flask, render_template, jsonify, request, Response, stream_with_context, make_response, g
+from flask.json.provider import DefaultJSONProvider
+from flask.logging import default_handler
 import sqlite3
 import json
 import os
 import csv
 import io
 import logging
-from logging.handlers import RotatingFileHandler
-from datetime import datetime, timedelta
+import queue
+import hmac
+import atexit
+import hashlib
+import threading
+import functools
+import zlib
+import time
+import bisect
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from datetime import datetime, timedelta, timezone
+
+import alerts
+import anomaly
+import downsample
+import hires
+import ingest
+import live
+import metrics
+import perf
+import retention
+import storage
+
+# Arrow / Parquet 导出为可选功能（pip3 install pyarrow）
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 app = Flask(__name__)
 
@@ -23,6 +54,23 @@ try:
     ALERT_DOWNLOAD_THRESHOLD_MB = config.ALERT_DOWNLOAD_THRESHOLD_MB
     ALERT_UPLOAD_THRESHOLD_MB = config.ALERT_UPLOAD_THRESHOLD_MB
     ALERT_SPEED_THRESHOLD_MBPS = config.ALERT_SPEED_THRESHOLD_MBPS
+    ALERT_COOLDOWN = getattr(config, 'ALERT_COOLDOWN', alerts.COOLDOWN_SECONDS)
+    ALERT_CLEAR_RATIO = getattr(config, 'ALERT_CLEAR_RATIO', alerts.CLEAR_RATIO)
+    ALERT_RULES = getattr(config, 'ALERT_RULES', [])
+    ANOMALY_ENABLED = getattr(config, 'ANOMALY_ENABLED', False)
+    ANOMALY_SIGMA = getattr(config, 'ANOMALY_SIGMA', anomaly.SIGMA)
+    ANOMALY_MIN_SAMPLES = getattr(config, 'ANOMALY_MIN_SAMPLES', anomaly.MIN_SAMPLES)
+    ANOMALY_ALPHA = getattr(config, 'ANOMALY_ALPHA', None)
+    ANOMALY_MIN_DEVIATION_MBPS = getattr(config, 'ANOMALY_MIN_DEVIATION_MBPS', anomaly.MIN_DEVIATION_MBPS)
+    RAW_RETENTION_DAYS = getattr(config, 'RAW_RETENTION_DAYS', retention.RAW_RETENTION_DAYS)
+    ROLLUP_RETENTION_DAYS = getattr(config, 'ROLLUP_RETENTION_DAYS', retention.ROLLUP_RETENTION_DAYS)
+    INGEST_TOKEN = getattr(config, 'INGEST_TOKEN', None)
+    INGEST_ENABLED = getattr(config, 'INGEST_ENABLED', False)
+    PERF_ENABLED = getattr(config, 'PERF_ENABLED', True)
+    PERF_PROFILER_ENABLED = getattr(config, 'PERF_PROFILER_ENABLED', False)
+    WEB_THREADS = getattr(config, 'WEB_THREADS', 32)
+    WEB_CONNECTION_LIMIT = getattr(config, 'WEB_CONNECTION_LIMIT', 1000)
+    STREAM_MAX_CLIENTS = getattr(config, 'STREAM_MAX_CLIENTS', None)
 except ImportError:
     # 默认配置（如果 config.py 不存在）
     WEB_HOST = '0.0.0.0'
@@ -35,6 +83,23 @@ except ImportError:
     ALERT_DOWNLOAD_THRESHOLD_MB = 100
     ALERT_UPLOAD_THRESHOLD_MB = 50
     ALERT_SPEED_THRESHOLD_MBPS = 10
+    ALERT_COOLDOWN = alerts.COOLDOWN_SECONDS
+    ALERT_CLEAR_RATIO = alerts.CLEAR_RATIO
+    ALERT_RULES = []
+    ANOMALY_ENABLED = False
+    ANOMALY_SIGMA = anomaly.SIGMA
+    ANOMALY_MIN_SAMPLES = anomaly.MIN_SAMPLES
+    ANOMALY_ALPHA = None
+    ANOMALY_MIN_DEVIATION_MBPS = anomaly.MIN_DEVIATION_MBPS
+    RAW_RETENTION_DAYS = retention.RAW_RETENTION_DAYS
+    ROLLUP_RETENTION_DAYS = retention.ROLLUP_RETENTION_DAYS
+    INGEST_TOKEN = None
+    INGEST_ENABLED = False
+    PERF_ENABLED = True
+    PERF_PROFILER_ENABLED = False
+    WEB_THREADS = 32
+    WEB_CONNECTION_LIMIT = 1000
+    STREAM_MAX_CLIENTS = None
 
 # 配置日志轮转
 if not os.path.exists(LOG_DIR):
@@ -49,7 +114,6 @@ web_handler = RotatingFileHandler(
 web_handler.setLevel(logging.INFO)
 web_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 web_handler.setFormatter(web_formatter)
-app.logger.addHandler(web_handler)
 app.logger.setLevel(logging.INFO)
 
 # 错误日志轮转配置
@@ -61,7 +125,15 @@ error_handler = RotatingFileHandler(
 error_handler.setLevel(logging.ERROR)
 error_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 error_handler.setFormatter(error_formatter)
-app.logger.addHandler(error_handler)
+
+# 请求线程只把日志记录放入队列，由后台线程写入文件和控制台（QueueHandler / QueueListener），
+# 磁盘写入不再阻塞请求。退出时（atexit 后进先出，最后执行）写完队列中剩余的记录
+log_queue = queue.SimpleQueue()
+app.logger.removeHandler(default_handler)
+app.logger.addHandler(QueueHandler(log_queue))
+log_listener = QueueListener(log_queue, web_handler, error_handler, default_handler, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
 
 # 告警配置
 ALERT_CONFIG = {
@@ -69,13 +141,128 @@ ALERT_CONFIG = {
     'download_threshold_mb': ALERT_DOWNLOAD_THRESHOLD_MB,
     'upload_threshold_mb': ALERT_UPLOAD_THRESHOLD_MB,
     'speed_threshold_mbps': ALERT_SPEED_THRESHOLD_MBPS,
-    'last_alert_file': f'{LOG_DIR}/last_alert.txt'
+    'cooldown': ALERT_COOLDOWN,
+    'clear_ratio': ALERT_CLEAR_RATIO
 }
 
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# 预聚合粒度（与 storage.ROLLUP_RESOLUTIONS 一致）
+RESOLUTIONS = {'1m': 60, '5m': 300, '1h': 3600, '1d': 86400}
+RESOLUTION_LABELS = {seconds: name for name, seconds in RESOLUTIONS.items()}
+# 自动选择粒度时，图表至少需要的数据点数
+CHART_MIN_POINTS = 150
+# points 参数允许的最大值
+MAX_POINTS_LIMIT = 10000
+
+# 推送流：检查新数据的间隔、无数据时发送心跳注释的间隔（秒）
+STREAM_POLL_INTERVAL = 0.5
+STREAM_KEEPALIVE = 15
+# 只读接口响应缓存的最大条目数
+RESPONSE_CACHE_SIZE = 256
+# 导出时每次从游标读取的行数（Arrow / Parquet 每批即一个 record batch / row group，取更大的值）
+EXPORT_FETCH_SIZE = 1000
+EXPORT_BATCH_ROWS = 65536
+EXPORT_FORMATS = ('csv', 'ndjson', 'arrow', 'parquet')
+# 多主机上报：每个请求最多的采样数、写入队列可容纳的请求数、请求体大小上限
+INGEST_MAX_SAMPLES = 5000
+INGEST_QUEUE_SIZE = 1000
+# /api/live 默认返回最近多少秒的高频采样
+LIVE_DEFAULT_SECONDS = 300
+# /metrics 指标名前缀
+METRICS_PREFIX = 'network_traffic'
+# /api/debug/perf/profile 单次采样的最长时间（秒）
+PERF_PROFILE_MAX_SECONDS = 60
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+
+# 数据时间范围取自汇总表（合计行 iface = ''），按天分区时原始数据不在主库中
+TIME_RANGE_SQL = '''
+    SELECT min_time, max_time FROM traffic_summary WHERE host = ? AND iface = ''
+'''
+
+# 数据库连接池：每个请求借出一个连接，请求结束时归还
+db_pool = storage.get_pool(DB_PATH)
+
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """当前请求使用的数据库连接（同一请求内多次调用返回同一个连接）"""
+    if 'db' not in g:
+        with perf.phase('pool'):
+            g.db = db_pool.acquire()
+        g.db.row_factory = sqlite3.Row
+    return g.db
+
+@app.teardown_appcontext
+def release_db_connection(exception=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+# 请求耗时：每个请求一个 perf.Timer，各阶段（sql、series、downsample、json 等）的耗时
+# 通过 Server-Timing 响应头返回，并按路由累计到直方图（/api/debug/perf）。
+# 流式响应（导出、/api/stream）只统计到返回响应头为止
+perf_registry = perf.Registry()
+# 采集脚本每次采集的耗时（由 sample_hub 从 meta 表读取）
+collector_perf = perf.Registry()
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """jsonify() 的序列化耗时计入 json 阶段"""
+
+    def dumps(self, obj, **kwargs):
+        with perf.phase('json'):
+            return super().dumps(obj, **kwargs)
+
+app.json = TimedJSONProvider(app)
+
+@app.before_request
+def start_request_timer():
+    if PERF_ENABLED:
+        g.perf = perf.start(request.url_rule.rule if request.url_rule else '<unmatched>')
+
+@app.after_request
+def add_server_timing(response):
+    timing = g.pop('perf', None)
+    if timing is not None:
+        timer, token = timing
+        total = perf.finish(timer, token)
+        response.headers['Server-Timing'] = timer.server_timing(total)
+        perf_registry.record(timer.name, total, timer.phases)
+    return response
+
+@app.teardown_request
+def discard_request_timer(exception=None):
+    # 未处理的异常会跳过 after_request
+    timing = g.pop('perf', None)
+    if timing is not None:
+        perf.finish(*timing)
+
+def record_collector_tick(timestamp, seconds, phases):
+    collector_perf.record('collector_tick', seconds, phases)
+
+def traffic_scope(iface=None, host=''):
+    """根据 iface / host 参数选择查询的表和过滤条件
+
+    不指定网卡时查询汇总表 traffic_data；指定网卡时查询 interface_traffic，
+    过滤条件走 (host, timestamp) / (host, iface, timestamp) 复合索引。
+    返回 (表名, 条件列表, 参数列表)。
+    """
+    if iface:
+        return 'interface_traffic', ['host = ?', 'iface = ?'], [host, iface]
+    return 'traffic_data', ['host = ?'], [host]
+
+def request_host():
+    """host 参数：'' （默认）为本机采集的数据，其他为通过 /api/ingest 上报的主机"""
+    return request.args.get('host', '')
+
+def where_clause(conditions):
+    return 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+def to_epoch(dt):
+    """本地时间 datetime -> Unix 时间戳（秒），与数据库中 timestamp 列一致"""
+    return int(dt.timestamp())
+
+def format_timestamp(ts):
+    """Unix 时间戳 -> 本地时间字符串"""
+    return datetime.fromtimestamp(ts).strftime(TIME_FORMAT) if ts is not None else None
 
 def validate_datetime(dt_string):
     """验证日期时间格式"""
@@ -92,57 +279,124 @@ def validate_datetime(dt_string):
             continue
     return None
 
-def check_traffic_alert(received, sent, prev_received=None, prev_sent=None, interval_seconds=300):
-    """检查流量是否触发告警（使用增量值）"""
-    if not ALERT_CONFIG['enabled']:
-        return None
+# 告警状态保存在内存中，由新采样（本机轮询和远程上报）驱动，后台线程写入 logs/alert_state_web.json；
+# 请求处理只读取内存中的状态
+alert_engine = alerts.AlertEngine(
+    ALERT_CONFIG,
+    rules=ALERT_RULES,
+    enabled=ALERT_CONFIG['enabled'],
+    cooldown=ALERT_CONFIG['cooldown'],
+    clear_ratio=ALERT_CONFIG['clear_ratio'],
+    state_file=f'{LOG_DIR}/alert_state_web.json',
+    db_path=DB_PATH,
+    logger=app.logger
+)
+alert_engine.start()
+atexit.register(alert_engine.stop)
 
-    # 计算增量流量（当前 - 上次）
-    inc_received = received - prev_received if prev_received is not None else received
-    inc_sent = sent - prev_sent if prev_sent is not None else sent
-    
-    # 处理计数器重置（差值为负）
-    if inc_received < 0:
-        inc_received = received
-    if inc_sent < 0:
-        inc_sent = sent
+def log_stream_alert(host, timestamp, received, sent, prev_received, prev_sent, interval_seconds,
+                     interfaces, prev_interfaces):
+    """推送流使用的告警检查，每个新采样只检查一次（与连接数无关），返回该主机当前的告警"""
+    alert_msg = alert_engine.evaluate(host, timestamp, received, sent, prev_received, prev_sent, interval_seconds,
+                                      interfaces, prev_interfaces)
+    if alert_msg:
+        app.logger.warning(f'Traffic alert{f" ({host})" if host else ""}: {alert_msg}')
+    return alert_engine.active_message(host)
 
-    # 增量流量 (MB)
-    received_mb = inc_received / (1024 * 1024)
-    sent_mb = inc_sent / (1024 * 1024)
+# 可选的速度异常检测：按网卡和一周中的小时学习基线，基线定期写入数据库
+anomaly_detector = None
+if ANOMALY_ENABLED:
+    anomaly_detector = anomaly.AnomalyDetector(
+        DB_PATH,
+        sigma=ANOMALY_SIGMA,
+        min_samples=ANOMALY_MIN_SAMPLES,
+        alpha=ANOMALY_ALPHA,
+        min_deviation_mbps=ANOMALY_MIN_DEVIATION_MBPS,
+        logger=app.logger
+    )
+    anomaly_detector.start()
+    atexit.register(anomaly_detector.stop)
 
-    # 计算速度 (Mbps) - 使用增量值
-    download_speed_mbps = (inc_received * 8) / (interval_seconds * 1000000)
-    upload_speed_mbps = (inc_sent * 8) / (interval_seconds * 1000000)
+def log_anomalies(host, timestamp, speeds):
+    """推送流使用的异常检测，每个新采样只检测一次"""
+    flags = anomaly_detector.observe(host, timestamp, speeds)
+    for flag in flags:
+        app.logger.warning(
+            f'Speed anomaly{f" ({host})" if host else ""}: {flag["iface"] or "total"} {flag["direction"]} '
+            f'{flag["speed_mbps"]} Mbps, baseline {flag["mean_mbps"]} ± {flag["stddev_mbps"]} Mbps'
+        )
+    return flags
 
-    alerts = []
+# 新采样广播中心：所有 /api/stream 连接共享一个后台线程和一个数据库连接
+sample_hub = live.SampleHub(
+    DB_PATH,
+    poll_interval=STREAM_POLL_INTERVAL,
+    alert_checker=log_stream_alert,
+    anomaly_checker=log_anomalies if anomaly_detector else None,
+    tick_observer=record_collector_tick if PERF_ENABLED else None,
+    logger=app.logger
+)
+# 异常检测需要持续学习，不等第一个请求就开始监听新采样
+if anomaly_detector:
+    sample_hub.start()
 
-    if received_mb > ALERT_CONFIG['download_threshold_mb']:
-        alerts.append(f"下载流量告警：{received_mb:.2f} MB (阈值：{ALERT_CONFIG['download_threshold_mb']} MB)")
+# 远程主机上报的写入队列：一个后台线程合并请求后批量写入，退出时写完队列中剩余的数据
+ingest_writer = ingest.IngestWriter(
+    DB_PATH,
+    queue_size=INGEST_QUEUE_SIZE,
+    on_commit=sample_hub.publish_samples,
+    logger=app.logger
+)
+atexit.register(ingest_writer.stop)
 
-    if sent_mb > ALERT_CONFIG['upload_threshold_mb']:
-        alerts.append(f"上传流量告警：{sent_mb:.2f} MB (阈值：{ALERT_CONFIG['upload_threshold_mb']} MB)")
+# 响应缓存：(路径, 规范化后的参数) -> (generation, body, etag, last_modified)
+# 数据库有新数据时 sample_hub.generation 变化，旧条目随之失效
+response_cache = OrderedDict()
+response_cache_lock = threading.Lock()
 
-    if download_speed_mbps > ALERT_CONFIG['speed_threshold_mbps']:
-        alerts.append(f"下载速度告警：{download_speed_mbps:.2f} Mbps (阈值：{ALERT_CONFIG['speed_threshold_mbps']} Mbps)")
+def cache_key():
+    """忽略空参数并排序，使参数顺序不同的相同请求共用一个缓存条目"""
+    args = sorted((key, value) for key, value in request.args.items(multi=True) if value != '')
+    return (request.path, tuple(args))
 
-    if upload_speed_mbps > ALERT_CONFIG['speed_threshold_mbps']:
-        alerts.append(f"上传速度告警：{upload_speed_mbps:.2f} Mbps (阈值：{ALERT_CONFIG['speed_threshold_mbps']} Mbps)")
+def cached_response(view):
+    """缓存 JSON 响应，并支持 ETag / Last-Modified 条件请求（304 Not Modified）"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        sample_hub.start()
+        key = cache_key()
+        generation = sample_hub.generation
 
-    if alerts:
-        alert_msg = "\n".join(alerts)
-        # 检查是否已经发送过相同告警（避免重复）
-        last_alert = ""
-        if os.path.exists(ALERT_CONFIG['last_alert_file']):
-            with open(ALERT_CONFIG['last_alert_file'], 'r') as f:
-                last_alert = f.read().strip()
+        with response_cache_lock:
+            entry = response_cache.get(key)
+            if entry and entry[0] == generation:
+                response_cache.move_to_end(key)
+            else:
+                entry = None
 
-        if alert_msg != last_alert:
-            with open(ALERT_CONFIG['last_alert_file'], 'w') as f:
-                f.write(alert_msg)
-            return alert_msg
+        if entry is None:
+            response = make_response(view(*args, **kwargs))
+            # 错误响应不缓存
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            last_modified = datetime.fromtimestamp(int(sample_hub.last_modified or datetime.now().timestamp()), timezone.utc)
+            with perf.phase('etag'):
+                entry = (generation, body, hashlib.sha1(body).hexdigest(), last_modified)
+            with response_cache_lock:
+                response_cache[key] = entry
+                response_cache.move_to_end(key)
+                while len(response_cache) > RESPONSE_CACHE_SIZE:
+                    response_cache.popitem(last=False)
 
-    return None
+        _, body, etag, last_modified = entry
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # 允许缓存，但每次使用前都要向服务端确认
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    return wrapper
 
 @app.route('/')
 def index():
@@ -150,12 +404,12 @@ def index():
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    cursor.execute('SELECT MIN(timestamp) as min_time, MAX(timestamp) as max_time FROM traffic_data')
+    cursor.execute(TIME_RANGE_SQL, ('',))
     range_row = cursor.fetchone()
 
     if range_row and range_row['min_time'] and range_row['max_time']:
-        min_time = datetime.strptime(range_row['min_time'], '%Y-%m-%d %H:%M:%S')
-        max_time = datetime.strptime(range_row['max_time'], '%Y-%m-%d %H:%M:%S')
+        min_time = datetime.fromtimestamp(range_row['min_time'])
+        max_time = datetime.fromtimestamp(range_row['max_time'])
 
         now = datetime.now()
         default_end = max_time.strftime('%Y-%m-%dT%H:%M')
@@ -169,15 +423,136 @@ def index():
         default_end = now.strftime('%Y-%m-%dT%H:%M')
         default_start = (now - timedelta(hours=24)).strftime('%Y-%m-%dT%H:%M')
 
-    conn.close()
     return render_template('index.html', default_start_time=default_start, default_end_time=default_end)
 
+def is_retained(resolution, timestamp):
+    """该粒度（None 为原始数据）在 timestamp 处的数据是否还在保留期内"""
+    days = RAW_RETENTION_DAYS if resolution is None else ROLLUP_RETENTION_DAYS.get(resolution)
+    cutoff = retention.retention_cutoff(days)
+    return cutoff is None or timestamp >= cutoff
+
+def choose_resolution(requested, start_ts, end_ts):
+    """选择查询粒度，返回预聚合粒度（秒），None 表示使用原始数据
+
+    requested 为 auto 时选择仍能填满图表（至少 CHART_MIN_POINTS 个点）的最粗粒度；
+    该粒度在起始时间处已被清理时，改用仍有数据的更粗粒度。
+    """
+    if requested == 'raw':
+        return None
+    if requested in RESOLUTIONS:
+        return RESOLUTIONS[requested]
+    if requested != 'auto':
+        raise ValueError(f'无效的粒度：{requested}。可选值：auto, raw, ' + ', '.join(RESOLUTIONS))
+    span_seconds = end_ts - start_ts
+    chosen = None
+    for resolution in sorted(RESOLUTIONS.values(), reverse=True):
+        if span_seconds / resolution >= CHART_MIN_POINTS:
+            chosen = resolution
+            break
+    fine_to_coarse = [None] + sorted(RESOLUTIONS.values())
+    for resolution in fine_to_coarse[fine_to_coarse.index(chosen):]:
+        if is_retained(resolution, start_ts):
+            return resolution
+    return chosen
+
+def query_raw_series(conn, table, conditions, params, start_ts=None, end_ts=None):
+    """查询原始采样，按列取出后计算增量
+
+    一次取出全部元组并转置为列，增量用列表推导在相邻两列之间计算，
+    计数器重置时按 storage.calculate_increment 处理（与预聚合相同）；速度直接使用采集时保存的 download_speed / upload_speed。
+    timestamps 为 Unix 时间戳，返回前再格式化。按天分区时只查询与 [start_ts, end_ts] 重叠的分区。
+    """
+    rows = storage.fetch_raw_rows(conn, DB_PATH, f'''
+        SELECT timestamp, bytes_received, bytes_sent,
+               COALESCE(download_speed, 0), COALESCE(upload_speed, 0)
+        FROM {table}
+        {where_clause(conditions)}
+        ORDER BY timestamp
+    ''', params, start_ts, end_ts)
+
+    if rows:
+        timestamps, received, sent, download_speeds, upload_speeds = (list(column) for column in zip(*rows))
+    else:
+        timestamps, received, sent, download_speeds, upload_speeds = [], [], [], [], []
+
+    return {
+        'timestamps': timestamps,
+        'received': received,
+        'sent': sent,
+        'incremental_received': column_increments(received),
+        'incremental_sent': column_increments(sent),
+        'download_speeds': download_speeds,
+        'upload_speeds': upload_speeds,
+        'total_received': received[-1] if rows else 0,
+        'total_sent': sent[-1] if rows else 0
+    }
+
+def column_increments(values):
+    """相邻两点的增量，第一个点为 0，计数器重置按 storage.calculate_increment 处理"""
+    if not values:
+        return []
+    return [0] + list(map(storage.calculate_increment, values[1:], values))
+
+def build_rollup_series(rows):
+    """预聚合数据：增量为桶内总量，速度为桶内峰值，累计值为桶内最后一次采样"""
+    return {
+        'timestamps': [row['bucket'] for row in rows],
+        'received': [row['last_received'] for row in rows],
+        'sent': [row['last_sent'] for row in rows],
+        'incremental_received': [row['bytes_received'] for row in rows],
+        'incremental_sent': [row['bytes_sent'] for row in rows],
+        'download_speeds': [row['max_download_speed'] for row in rows],
+        'upload_speeds': [row['max_upload_speed'] for row in rows],
+        'total_received': rows[-1]['last_received'] if rows else 0,
+        'total_sent': rows[-1]['last_sent'] if rows else 0
+    }
+
+def parse_downsample_args(args):
+    """解析 points / max_points 和 downsample 参数，未指定 points 时返回 (None, method)"""
+    value = args.get('points') or args.get('max_points')
+    method = args.get('downsample', 'minmax')
+    if method not in downsample.METHODS:
+        raise ValueError(f'无效的降采样方法：{method}。可选值：' + ', '.join(downsample.METHODS))
+    if not value:
+        return None, method
+    try:
+        max_points = int(value)
+    except ValueError:
+        raise ValueError(f'无效的点数：{value}')
+    if not 3 <= max_points <= MAX_POINTS_LIMIT:
+        raise ValueError(f'点数必须在 3 到 {MAX_POINTS_LIMIT} 之间')
+    return max_points, method
+
+def parse_since(value):
+    """since 参数：上次返回的 cursor（Unix 时间戳）或日期时间字符串"""
+    if value.isdigit():
+        return int(value)
+    dt = validate_datetime(value)
+    if not dt:
+        raise ValueError(f'无效的 since 参数：{value}。请使用上次返回的 cursor 或格式：YYYY-MM-DDTHH:MM')
+    return to_epoch(dt)
+
+def drop_leading_points(series, timestamp):
+    """去掉开头时间戳等于 timestamp 的数据点"""
+    count = 0
+    for ts in series['timestamps']:
+        if ts != timestamp:
+            break
+        count += 1
+    if not count:
+        return series
+    return {key: values[count:] if isinstance(values, list) else values for key, values in series.items()}
+
 @app.route('/api/traffic')
+@cached_response
 def get_traffic_data():
     """获取流量数据，支持时间范围查询"""
     try:
         start_time = request.args.get('start', None)
         end_time = request.args.get('end', None)
+        iface = request.args.get('iface', None)
+        host = request_host()
+        since = request.args.get('since', None)
         
         # 参数验证
         if start_time or end_time:
@@ -208,133 +583,141 @@ def get_traffic_data():
                         'error': '查询范围不能超过 31 天'
                     }), 400
 
+        if since:
+            # 增量同步：只返回 cursor 之后的新数据
+            try:
+                start_ts = parse_since(since)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            end_ts = to_epoch(validate_datetime(end_time)) if end_time else to_epoch(datetime.now())
+            # 与 start/end 相同，最多返回 31 天（过旧的 cursor 如 since=0 不会读出整张原始表）
+            start_ts = max(start_ts, end_ts - 31 * 24 * 3600)
+            range_desc = f'since {since}'
+        elif start_time and end_time:
+            start_ts = to_epoch(validate_datetime(start_time))
+            end_ts = to_epoch(validate_datetime(end_time))
+            range_desc = f'from {start_time} to {end_time}'
+        else:
+            end_ts = to_epoch(datetime.now())
+            start_ts = end_ts - 24 * 3600
+            range_desc = 'last 24 hours'
+
+        try:
+            resolution = choose_resolution(request.args.get('resolution', 'auto'), start_ts, end_ts)
+            max_points, method = parse_downsample_args(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        if start_time and end_time:
-            start_db = start_time.replace('T', ' ') + ':00'
-            end_db = end_time.replace('T', ' ') + ':00'
-
+        if resolution:
+            # 从预聚合表读取（主键 (resolution, iface, bucket) 范围扫描）
             cursor.execute('''
-                SELECT timestamp, bytes_received, bytes_sent
-                FROM traffic_data
-                WHERE timestamp BETWEEN ? AND ?
-                ORDER BY timestamp
-            ''', (start_db, end_db))
-            app.logger.info(f'Query traffic data from {start_db} to {end_db}')
+                SELECT bucket, bytes_received, bytes_sent, max_download_speed, max_upload_speed,
+                       last_received, last_sent
+                FROM traffic_rollup
+                WHERE resolution = ? AND host = ? AND iface = ? AND bucket > ? AND bucket <= ?
+                ORDER BY bucket
+            ''', (resolution, host, iface or '', start_ts - resolution, end_ts))
+            rows = cursor.fetchall()
+            with perf.phase('series'):
+                series = build_rollup_series(rows)
         else:
-            twenty_four_hours_ago = (datetime.now() - timedelta(hours=24)).strftime('%Y-%m-%d %H:%M:%S')
-            cursor.execute('''
-                SELECT timestamp, bytes_received, bytes_sent
-                FROM traffic_data
-                WHERE timestamp >= ?
-                ORDER BY timestamp
-            ''', (twenty_four_hours_ago,))
-            app.logger.info('Query last 24 hours traffic data')
-
-        rows = cursor.fetchall()
-        conn.close()
-
-        timestamps = []
-        received = []  # 累计值
-        sent = []      # 累计值
-        incremental_received = []  # 增量值（每 5 分钟）
-        incremental_sent = []      # 增量值（每 5 分钟）
-        download_speeds = []
-        upload_speeds = []
-        total_received = 0
-        total_sent = 0
-        
-        prev_received = None
-        prev_sent = None
-        prev_timestamp = None
-
-        for row in rows:
-            timestamps.append(row['timestamp'])
-            received.append(row['bytes_received'])
-            sent.append(row['bytes_sent'])
-            total_received = row['bytes_received']
-            total_sent = row['bytes_sent']
-            
-            # 计算增量流量（bytes）
-            if prev_received is not None:
-                inc_received = row['bytes_received'] - prev_received
-                inc_sent = row['bytes_sent'] - prev_sent
-                # 如果差值为负，说明计数器重置了，使用当前值作为增量
-                incremental_received.append(max(0, inc_received))
-                incremental_sent.append(max(0, inc_sent))
-            else:
-                incremental_received.append(0)
-                incremental_sent.append(0)
-            
-            # 计算速度 (bytes/s)
-            if prev_received is not None and prev_timestamp:
-                current_ts = datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M:%S')
-                time_diff = (current_ts - prev_timestamp).total_seconds()
-                if time_diff > 0:
-                    download_speed = (row['bytes_received'] - prev_received) / time_diff
-                    upload_speed = (row['bytes_sent'] - prev_sent) / time_diff
-                    download_speeds.append(max(0, download_speed))
-                    upload_speeds.append(max(0, upload_speed))
-                else:
-                    download_speeds.append(0)
-                    upload_speeds.append(0)
-            else:
-                download_speeds.append(0)
-                upload_speeds.append(0)
-            
-            prev_received = row['bytes_received']
-            prev_sent = row['bytes_sent']
-            prev_timestamp = datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M:%S')
-
-        # 检查告警
-        alerts = None
-        if rows:
-            latest_row = rows[-1]
-            # 获取前一条数据用于计算增量
-            prev_received = rows[-2]['bytes_received'] if len(rows) > 1 else None
-            prev_sent = rows[-2]['bytes_sent'] if len(rows) > 1 else None
-            alert_msg = check_traffic_alert(
-                latest_row['bytes_received'],
-                latest_row['bytes_sent'],
-                prev_received,
-                prev_sent
+            table, conditions, params = traffic_scope(iface, host)
+            # 查询本身计入 sql 阶段，series 只包含转置和增量计算
+            with perf.phase('series'):
+                series = query_raw_series(conn, table, conditions + ['timestamp BETWEEN ? AND ?'],
+                                          params + [start_ts, end_ts], start_ts, end_ts)
+                # 增量同步时 cursor 对应的行只用于计算第一条新数据的增量，不再返回
+                if since:
+                    series = drop_leading_points(series, start_ts)
+
+        with perf.phase('log'):
+            app.logger.info(
+                f'Query traffic data {range_desc} (resolution={RESOLUTION_LABELS.get(resolution, "raw")}'
+                + (f', iface={iface}' if iface else '') + (f', host={host})' if host else ')')
             )
-            if alert_msg:
-                alerts = alert_msg
-                app.logger.warning(f'Traffic alert: {alert_msg}')
+
+        # 服务端降采样
+        total_points = len(series['timestamps'])
+        if max_points:
+            with perf.phase('downsample'):
+                series = downsample.downsample_series(series, max_points, method)
+        # 下次增量同步的起点：最后一个数据点（预聚合模式下最后一个桶可能还会更新，会被再次返回）
+        next_cursor = series['timestamps'][-1] if series['timestamps'] else (start_ts if since else None)
+        with perf.phase('format'):
+            series['timestamps'] = [format_timestamp(ts) for ts in series['timestamps']]
+
+        # 当前告警（针对所有网卡的合计流量，按网卡查询时不返回），只读取内存中的告警状态
+        alerts_msg = None if iface else alert_engine.active_message(host)
 
         return jsonify({
-            'timestamps': timestamps,
-            'received': received,
-            'sent': sent,
-            'incremental_received': incremental_received,
-            'incremental_sent': incremental_sent,
-            'download_speeds': download_speeds,
-            'upload_speeds': upload_speeds,
-            'total_received': total_received,
-            'total_sent': total_sent,
-            'alerts': alerts
+            **series,
+            'resolution': RESOLUTION_LABELS.get(resolution, 'raw'),
+            'total_points': total_points,
+            'cursor': next_cursor,
+            'iface': iface,
+            'host': host,
+            'alerts': alerts_msg
         })
 
     except Exception as e:
         app.logger.error(f'Error in get_traffic_data: {e}')
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/stream')
+def stream_samples():
+    """Server-Sent Events：每个新采样（含速度、增量、各网卡数据和告警）推送给所有客户端
+
+    指定 host 参数时只推送该主机的采样，否则推送所有主机（事件中的 host 字段区分）。
+    """
+    host = request.args.get('host')
+    subscriber = sample_hub.subscribe()
+    # 每个推送连接在线程池服务器（serve.py）中占用一个工作线程，超出上限时拒绝，前端改为定时增量同步
+    if STREAM_MAX_CLIENTS is not None and sample_hub.subscriber_count > STREAM_MAX_CLIENTS:
+        sample_hub.unsubscribe(subscriber)
+        response = jsonify({'error': '推送连接数已达上限，请改用 /api/traffic?since= 增量同步'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '60'
+        return response
+
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event = subscriber.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    # 心跳注释，保持连接并及时发现已断开的客户端
+                    yield ': keepalive\n\n'
+                    continue
+                if host is not None and event['host'] != host:
+                    continue
+                yield f"id: {event['cursor']}\nevent: sample\ndata: {json.dumps(event)}\n\n"
+        finally:
+            sample_hub.unsubscribe(subscriber)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/data-range')
+@cached_response
 def get_data_range():
     """获取数据时间范围"""
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT MIN(timestamp) as min_time, MAX(timestamp) as max_time FROM traffic_data')
+        cursor.execute(TIME_RANGE_SQL, (request_host(),))
         row = cursor.fetchone()
-        conn.close()
 
         if row and row['min_time'] and row['max_time']:
             return jsonify({
-                'min_time': row['min_time'],
-                'max_time': row['max_time']
+                'min_time': format_timestamp(row['min_time']),
+                'max_time': format_timestamp(row['max_time'])
             })
         else:
             return jsonify({'error': '暂无数据'}), 404
@@ -343,6 +726,318 @@ def get_data_range():
         app.logger.error(f'Error in get_data_range: {e}')
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/interfaces')
+def get_interfaces():
+    """获取已采集的网卡列表"""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT iface FROM traffic_summary
+            WHERE host = ? AND iface != '' AND record_count > 0
+            ORDER BY iface
+        ''', (request_host(),))
+        interfaces = [row['iface'] for row in cursor.fetchall()]
+        return jsonify({'interfaces': interfaces})
+    except Exception as e:
+        app.logger.error(f'Error in get_interfaces: {e}')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/hosts')
+@cached_response
+def get_hosts():
+    """获取有数据的主机列表（'' 为本机采集）及各自最后一次采样时间"""
+    try:
+        conn = get_db_connection()
+        rows = conn.execute('''
+            SELECT host, record_count, max_time FROM traffic_summary
+            WHERE iface = '' AND record_count > 0
+            ORDER BY host
+        ''').fetchall()
+        return jsonify({'hosts': [{
+            'host': row['host'],
+            'records': row['record_count'],
+            'last_seen': format_timestamp(row['max_time'])
+        } for row in rows]})
+    except Exception as e:
+        app.logger.error(f'Error in get_hosts: {e}')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/ingest', methods=['POST'])
+def ingest_samples():
+    """接收远程采集脚本上报的采样：{"host": "...", "samples": [...]}
+
+    校验后放入写入队列立即返回 202，由后台线程合并批量写入；队列已满时返回 503，客户端稍后重试。
+    按天分区时目标分区已封存（只读）的采样无法写入，在 rejected 中返回其时间戳，不放入队列。
+    默认关闭（返回 403）：配置了 INGEST_TOKEN 时需要 Authorization: Bearer <token>，
+    不使用令牌时需要显式设置 INGEST_ENABLED = True（任何能访问服务的客户端都可以写入）。
+    """
+    if not (INGEST_TOKEN or INGEST_ENABLED):
+        # 403 而不是 404：采集脚本遇到 401/403 时保留数据等待重试，中心服务开启上报后补齐
+        return jsonify({'error': '未启用上报：请在 config.py 中设置 INGEST_TOKEN（或 INGEST_ENABLED = True）'}), 403
+    if INGEST_TOKEN and not hmac.compare_digest(
+        request.headers.get('Authorization', ''), f'Bearer {INGEST_TOKEN}'
+    ):
+        return jsonify({'error': '未授权'}), 401
+    try:
+        host, samples = ingest.parse_samples(request.get_json(silent=True), INGEST_MAX_SAMPLES)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    rejected = []
+    if storage.is_partitioned(get_db_connection()):
+        samples, rejected = ingest.split_sealed(DB_PATH, samples)
+        if rejected:
+            ingest_writer.reject(host, len(rejected), 'partitions are sealed')
+    if samples and not ingest_writer.submit(host, samples):
+        app.logger.warning(f'Ingest queue full, rejected {len(samples)} samples from {host}')
+        response = jsonify({'error': '写入队列已满，请稍后重试'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    return jsonify({
+        'host': host,
+        'accepted': len(samples),
+        'rejected': [sample[0] for sample in rejected]
+    }), 202
+
+def describe_anomalies():
+    """异常检测的配置和最近的异常标记（指定 host 参数时只返回该主机）"""
+    if anomaly_detector is None:
+        return {'enabled': False}
+    return {
+        'enabled': True,
+        'method': anomaly_detector.method,
+        'sigma': anomaly_detector.sigma,
+        'min_samples': anomaly_detector.min_samples,
+        'flagged': anomaly_detector.flagged,
+        'recent': [
+            {**flag, 'time': format_timestamp(flag['timestamp'])}
+            for flag in anomaly_detector.recent_flags(request.args.get('host'))
+        ]
+    }
+
+# 采集脚本高频采样写入的环形缓冲区（只读内存映射），第一次请求时打开，采集脚本重建文件后重新打开
+hires_buffer = None
+hires_buffer_lock = threading.Lock()
+
+def get_hires_buffer():
+    """高频采样缓冲区，采集脚本未启用高频采样时抛出 FileNotFoundError"""
+    global hires_buffer
+    with hires_buffer_lock:
+        if hires_buffer is None or hires_buffer.is_stale():
+            # 旧的映射可能仍被其他请求使用，不主动关闭，由垃圾回收释放
+            hires_buffer = hires.RingBuffer.open(hires.buffer_path(DB_PATH))
+        return hires_buffer
+
+@app.route('/api/live')
+def get_live_samples():
+    """本机最近的高频采样（采集脚本以 --sample-interval 运行时），直接读取内存映射的环形缓冲区，不查询数据库
+
+    参数 seconds 为返回最近多少秒（默认 300），或 since 为上次返回的 cursor（增量获取）。
+    """
+    try:
+        try:
+            buffer = get_hires_buffer()
+        except (FileNotFoundError, ValueError):
+            return jsonify({'error': '高频采样未启用（采集脚本需以 --daemon --sample-interval 运行）'}), 404
+
+        since = request.args.get('since', type=float)
+        if since is None:
+            since = time.time() - request.args.get('seconds', LIVE_DEFAULT_SECONDS, type=float)
+        times, received, sent = buffer.snapshot()
+        start = bisect.bisect_right(times, since)
+
+        download_speeds = []
+        upload_speeds = []
+        for i in range(start, len(times)):
+            elapsed = times[i] - times[i - 1] if i > 0 else 0
+            if elapsed > 0:
+                download_speeds.append(max(0, received[i] - received[i - 1]) / elapsed)
+                upload_speeds.append(max(0, sent[i] - sent[i - 1]) / elapsed)
+            else:
+                download_speeds.append(0)
+                upload_speeds.append(0)
+
+        return jsonify({
+            'interval': buffer.interval,
+            'timestamps': times[start:],
+            'received': received[start:],
+            'sent': sent[start:],
+            'download_speeds': download_speeds,
+            'upload_speeds': upload_speeds,
+            'cursor': times[-1] if len(times) > start else since
+        })
+    except Exception as e:
+        app.logger.error(f'Error in get_live_samples: {e}')
+        return jsonify({'error': str(e)}), 500
+
+# /metrics 只读取内存中的状态：最新计数和速度（sample_hub）、告警状态、写入队列计数器；
+# 数据库文件大小在有新数据时重新统计。渲染结果按这些状态的版本缓存，多个抓取方共用
+metrics_cache = {}
+metrics_cache_lock = threading.Lock()
+database_size_cache = (None, [])
+
+def database_size():
+    """数据库文件大小 [(file, bytes)]，sample_hub.generation 变化时重新统计"""
+    global database_size_cache
+    generation = sample_hub.generation
+    if database_size_cache[0] == generation:
+        return database_size_cache[1]
+    sizes = []
+    for name, path in (('main', DB_PATH), ('wal', f'{DB_PATH}-wal')):
+        try:
+            sizes.append((name, os.path.getsize(path)))
+        except OSError:
+            pass
+    try:
+        with os.scandir(storage.partitions_dir(DB_PATH)) as entries:
+            partitions = sum(entry.stat().st_size for entry in entries if entry.is_file())
+        sizes.append(('partitions', partitions))
+    except OSError:
+        pass
+    database_size_cache = (generation, sizes)
+    return sizes
+
+def collect_metrics():
+    """从内存状态生成指标（host 为 '' 表示本机采集）
+
+    所有网卡的合计放在单独的 *_all_interfaces_* 指标中，按网卡的指标只有各网卡，
+    sum(...) / sum by (host) (...) 不会重复计算合计。
+    """
+    counters = sorted(sample_hub.counters_snapshot().items())
+    # 'iface' -> 按网卡的 [received, sent, download, upload]，'total' -> 合计
+    series = {kind: ([], [], [], []) for kind in ('iface', 'total')}
+    last_sample = []
+    for (host, iface), (ts, rx, tx, down, up) in counters:
+        if iface == '':
+            labels = {'host': host}
+            received, sent, download, upload = series['total']
+            last_sample.append((labels, ts))
+        else:
+            labels = {'host': host, 'iface': iface}
+            received, sent, download, upload = series['iface']
+        received.append((labels, rx))
+        sent.append((labels, tx))
+        if down is not None:
+            download.append((labels, down))
+            upload.append((labels, up))
+
+    families = []
+    for kind, prefix, scope in (('iface', METRICS_PREFIX, 'per interface'),
+                                ('total', f'{METRICS_PREFIX}_all_interfaces', 'all interfaces combined')):
+        received, sent, download, upload = series[kind]
+        families += [
+            metrics.Family(f'{prefix}_received_bytes', 'counter',
+                           f'Cumulative bytes received, {scope} (interface counter at the latest sample)', received),
+            metrics.Family(f'{prefix}_sent_bytes', 'counter',
+                           f'Cumulative bytes sent, {scope} (interface counter at the latest sample)', sent),
+            metrics.Family(f'{prefix}_download_speed_bytes_per_second', 'gauge',
+                           f'Download speed of the latest sample, {scope}', download),
+            metrics.Family(f'{prefix}_upload_speed_bytes_per_second', 'gauge',
+                           f'Upload speed of the latest sample, {scope}', upload),
+        ]
+    families += [
+        metrics.Family(f'{METRICS_PREFIX}_last_sample_timestamp_seconds', 'gauge',
+                       'Unix time of the latest sample', last_sample),
+        metrics.Family(f'{METRICS_PREFIX}_alert_active', 'gauge',
+                       'Alert rules currently firing (1 while active)',
+                       [({'host': alert['host'], 'rule': alert['rule']}, 1) for alert in alert_engine.active()]),
+        metrics.Family(f'{METRICS_PREFIX}_collector_tick_seconds', 'gauge',
+                       'Duration of the local collector\'s latest collection (read to commit)',
+                       [({}, sample_hub.collector_tick[1])] if sample_hub.collector_tick else []),
+        metrics.Family(f'{METRICS_PREFIX}_database_size_bytes', 'gauge',
+                       'Size of the SQLite database files',
+                       [({'file': name}, size) for name, size in database_size()]),
+        metrics.Family(f'{METRICS_PREFIX}_ingest_samples', 'counter',
+                       'Samples written by the ingest queue', [({}, ingest_writer.written)]),
+        metrics.Family(f'{METRICS_PREFIX}_ingest_duplicate_samples', 'counter',
+                       'Ingested samples skipped as duplicates', [({}, ingest_writer.duplicates)]),
+        metrics.Family(f'{METRICS_PREFIX}_ingest_rejected_samples', 'counter',
+                       'Ingested samples rejected because their day partition is sealed',
+                       [({}, ingest_writer.rejected)]),
+        metrics.Family(f'{METRICS_PREFIX}_ingest_failed_samples', 'counter',
+                       'Ingested samples dropped after repeated write failures', [({}, ingest_writer.failed)]),
+        metrics.Family(f'{METRICS_PREFIX}_ingest_queue_depth', 'gauge',
+                       'Ingest requests waiting to be written', [({}, ingest_writer.pending)]),
+        metrics.Family(f'{METRICS_PREFIX}_stream_subscribers', 'gauge',
+                       'Connected /api/stream clients', [({}, sample_hub.subscriber_count)])
+    ]
+    if anomaly_detector:
+        families.append(metrics.Family(f'{METRICS_PREFIX}_anomalies', 'counter',
+                                       'Speed anomalies flagged', [({}, anomaly_detector.flagged)]))
+    return families
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus / OpenMetrics 指标，不查询数据库"""
+    try:
+        sample_hub.start()
+        openmetrics = metrics.wants_openmetrics(request.headers.get('Accept'))
+        # 告警状态只在新采样到达时变化（sample_hub.published），其余为写入队列和订阅者计数
+        version = (
+            sample_hub.generation, sample_hub.published, sample_hub.collector_tick,
+            ingest_writer.written, ingest_writer.duplicates, ingest_writer.rejected, ingest_writer.failed,
+            ingest_writer.pending,
+            sample_hub.subscriber_count
+        )
+        with metrics_cache_lock:
+            cached = metrics_cache.get(openmetrics)
+            if cached and cached[0] == version:
+                body = cached[1]
+            else:
+                body = metrics.render(collect_metrics(), openmetrics)
+                metrics_cache[openmetrics] = (version, body)
+        content_type = metrics.CONTENT_TYPE_OPENMETRICS if openmetrics else metrics.CONTENT_TYPE_TEXT
+        return Response(body, content_type=content_type)
+    except Exception as e:
+        app.logger.error(f'Error in get_metrics: {e}')
+        return Response(f'# error: {e}\n', status=500, content_type='text/plain; charset=utf-8')
+
+@app.route('/api/debug/perf')
+def get_perf_stats():
+    """各路由和采集脚本分阶段耗时的直方图（毫秒）；buckets=1 时返回各桶计数，reset=1 时返回后清零"""
+    try:
+        sample_hub.start()
+        show_buckets = request.args.get('buckets', '').lower() in ('1', 'true', 'yes')
+        result = {
+            'enabled': PERF_ENABLED,
+            'profiler_enabled': PERF_PROFILER_ENABLED,
+            'since': format_timestamp(int(perf_registry.since)),
+            'buckets_ms': list(perf.BUCKETS_MS),
+            'routes': perf_registry.describe(show_buckets),
+            'collector': collector_perf.describe(show_buckets).get('collector_tick')
+        }
+        if request.args.get('reset', '').lower() in ('1', 'true', 'yes'):
+            perf_registry.reset()
+            collector_perf.reset()
+        return jsonify(result)
+    except Exception as e:
+        app.logger.error(f'Error in get_perf_stats: {e}')
+        return jsonify({'error': str(e)}), 500
+
+perf_profile_lock = threading.Lock()
+
+@app.route('/api/debug/perf/profile')
+def get_perf_profile():
+    """对 Web 服务的所有线程采样 seconds 秒，返回折叠格式的调用栈（flamegraph.pl / speedscope）"""
+    if not PERF_PROFILER_ENABLED:
+        return jsonify({'error': '采样分析器未启用（配置 PERF_PROFILER_ENABLED = True）'}), 404
+    try:
+        seconds = float(request.args.get('seconds', 10))
+    except ValueError:
+        return jsonify({'error': f'无效的 seconds 参数：{request.args.get("seconds")}'}), 400
+    if not 0 < seconds <= PERF_PROFILE_MAX_SECONDS:
+        return jsonify({'error': f'seconds 必须在 0 到 {PERF_PROFILE_MAX_SECONDS} 之间'}), 400
+    # 同一时间只运行一个分析器
+    if not perf_profile_lock.acquire(blocking=False):
+        return jsonify({'error': '已有采样正在进行'}), 409
+    try:
+        profiler = perf.SamplingProfiler()
+        folded = profiler.run_for(seconds)
+    finally:
+        perf_profile_lock.release()
+    app.logger.info(f'Profiled for {seconds}s ({profiler.samples} samples)')
+    return Response(folded, content_type='text/plain; charset=utf-8')
+
 @app.route('/api/alerts')
 def get_alerts():
     """获取告警配置和状态"""
@@ -351,112 +1046,273 @@ def get_alerts():
             'enabled': ALERT_CONFIG['enabled'],
             'download_threshold_mb': ALERT_CONFIG['download_threshold_mb'],
             'upload_threshold_mb': ALERT_CONFIG['upload_threshold_mb'],
-            'speed_threshold_mbps': ALERT_CONFIG['speed_threshold_mbps']
+            'speed_threshold_mbps': ALERT_CONFIG['speed_threshold_mbps'],
+            'cooldown': ALERT_CONFIG['cooldown'],
+            'clear_ratio': ALERT_CONFIG['clear_ratio'],
+            'rules': alert_engine.describe_rules(),
+            'active': alert_engine.active(),
+            'anomaly': describe_anomalies()
         })
     except Exception as e:
         app.logger.error(f'Error in get_alerts: {e}')
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/export/csv')
-def export_csv():
-    """导出流量数据为 CSV 文件"""
-    try:
-        start_time = request.args.get('start', None)
-        end_time = request.args.get('end', None)
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
+def iter_export_batches(table, conditions, params, fetch_size=EXPORT_FETCH_SIZE, start_ts=None, end_ts=None):
+    """按 fetch_size 分批读取导出数据并按列返回（含增量列），内存占用与总行数无关"""
+    # 连接在请求结束（流式输出完成）时归还连接池
+    batches = storage.iter_raw_batches(get_db_connection(), DB_PATH, f'''
+        SELECT timestamp, bytes_received, bytes_sent, download_speed, upload_speed
+        FROM {table}
+        {where_clause(conditions)}
+        ORDER BY timestamp
+    ''', params, start_ts, end_ts, batch_size=fetch_size)
+    prev_received = prev_sent = None
+    for rows in batches:
+        timestamps, received, sent, download, upload = (list(column) for column in zip(*rows))
+        # 增量跨批次计算：每批的第一个点与上一批的最后一个点相减
+        incremental_received = column_increments(([prev_received] if prev_received is not None else []) + received)
+        incremental_sent = column_increments(([prev_sent] if prev_sent is not None else []) + sent)
+        if prev_received is not None:
+            incremental_received, incremental_sent = incremental_received[1:], incremental_sent[1:]
+        prev_received, prev_sent = received[-1], sent[-1]
+        yield {
+            'timestamp': timestamps,
+            'bytes_received': received,
+            'bytes_sent': sent,
+            'incremental_received': incremental_received,
+            'incremental_sent': incremental_sent,
+            'download_speed': [speed or 0.0 for speed in download],
+            'upload_speed': [speed or 0.0 for speed in upload]
+        }
 
-        if start_time and end_time:
-            start_db = start_time.replace('T', ' ') + ':00'
-            end_db = end_time.replace('T', ' ') + ':00'
-            cursor.execute('''
-                SELECT timestamp, bytes_received, bytes_sent
-                FROM traffic_data
-                WHERE timestamp BETWEEN ? AND ?
-                ORDER BY timestamp
-            ''', (start_db, end_db))
-        else:
-            cursor.execute('''
-                SELECT timestamp, bytes_received, bytes_sent
-                FROM traffic_data
-                ORDER BY timestamp
-            ''')
-
-        rows = cursor.fetchall()
-        conn.close()
-
-        # 创建 CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['时间戳', '接收流量 (Bytes)', '发送流量 (Bytes)', '接收流量 (MB)', '发送流量 (MB)'])
-        
-        for row in rows:
+def iter_csv_chunks(batches):
+    """把每批数据写成一段 CSV 文本（UTF-8 编码）"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['时间戳', '接收流量 (Bytes)', '发送流量 (Bytes)', '接收流量 (MB)', '发送流量 (MB)',
+                     '接收增量 (Bytes)', '发送增量 (Bytes)', '下载速度 (Bytes/s)', '上传速度 (Bytes/s)'])
+    for batch in batches:
+        for i, timestamp in enumerate(batch['timestamp']):
+            received = batch['bytes_received'][i]
+            sent = batch['bytes_sent'][i]
             writer.writerow([
-                row['timestamp'],
-                row['bytes_received'],
-                row['bytes_sent'],
-                round(row['bytes_received'] / (1024 * 1024), 2),
-                round(row['bytes_sent'] / (1024 * 1024), 2)
+                format_timestamp(timestamp),
+                received,
+                sent,
+                round(received / (1024 * 1024), 2),
+                round(sent / (1024 * 1024), 2),
+                batch['incremental_received'][i],
+                batch['incremental_sent'][i],
+                round(batch['download_speed'][i], 2),
+                round(batch['upload_speed'][i], 2)
             ])
-
+        yield output.getvalue().encode('utf-8')
         output.seek(0)
-        
-        filename = f'traffic_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-        
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8')),
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=filename
+        output.truncate(0)
+    # 没有数据时也输出表头
+    if output.tell():
+        yield output.getvalue().encode('utf-8')
+
+def iter_ndjson_chunks(batches):
+    """每行一个 JSON 对象，timestamp 为 Unix 时间戳，time 为本地时间字符串"""
+    for batch in batches:
+        keys = list(batch)
+        lines = []
+        for values in zip(*(batch[key] for key in keys)):
+            record = dict(zip(keys, values))
+            record['time'] = format_timestamp(record['timestamp'])
+            lines.append(json.dumps(record, ensure_ascii=False))
+        lines.append('')
+        yield '\n'.join(lines).encode('utf-8')
+
+class ExportSink(io.RawIOBase):
+    """pyarrow 写入目标：缓存写入的数据供流式输出，并记录总偏移量（Parquet 页脚需要）"""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def arrow_schema():
+    return pyarrow.schema([
+        ('timestamp', pyarrow.timestamp('s', tz='UTC')),
+        ('bytes_received', pyarrow.int64()),
+        ('bytes_sent', pyarrow.int64()),
+        ('incremental_received', pyarrow.int64()),
+        ('incremental_sent', pyarrow.int64()),
+        ('download_speed', pyarrow.float64()),
+        ('upload_speed', pyarrow.float64())
+    ])
+
+def iter_arrow_chunks(batches, file_format):
+    """把每批数据转换为一个 Arrow record batch，写成 Arrow IPC 流或 Parquet row group"""
+    schema = arrow_schema()
+    sink = ExportSink()
+    if file_format == 'parquet':
+        writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd')
+    else:
+        writer = pyarrow.ipc.new_stream(sink, schema)
+    for batch in batches:
+        record_batch = pyarrow.record_batch(
+            [pyarrow.array(batch[field.name], type=field.type) for field in schema],
+            schema=schema
         )
+        if file_format == 'parquet':
+            writer.write_batch(record_batch, row_group_size=EXPORT_BATCH_ROWS)
+        else:
+            writer.write_batch(record_batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
 
+def iter_gzip_chunks(chunks):
+    """流式 gzip 压缩"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def logged_stream(chunks, name):
+    """响应已开始发送后无法再返回错误状态，只能记录日志并结束输出
+
+    请求的 Timer 在返回响应头时已结束，流式输出的耗时（含 sql 阶段）以 name 单独计入 perf_registry。
+    """
+    timing = perf.start(name) if PERF_ENABLED else None
+    try:
+        yield from chunks
+    except Exception as e:
+        app.logger.error(f'Error in {name}: {e}')
+    finally:
+        if timing is not None:
+            timer, token = timing
+            perf_registry.record(name, perf.finish(timer, token), timer.phases)
+
+# 格式 -> (文件扩展名, MIME 类型)
+EXPORT_CONTENT_TYPES = {
+    'csv': ('csv', 'text/csv'),
+    'ndjson': ('ndjson', 'application/x-ndjson'),
+    'arrow': ('arrows', 'application/vnd.apache.arrow.stream'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet')
+}
+
+def export_response(file_format):
+    """按指定格式流式导出流量数据"""
+    start_time = request.args.get('start', None)
+    end_time = request.args.get('end', None)
+    iface = request.args.get('iface', None)
+    host = request_host()
+    use_gzip = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+    if file_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'不支持的导出格式：{file_format}，可选：{", ".join(EXPORT_FORMATS)}'}), 400
+    if file_format in ('arrow', 'parquet') and pyarrow is None:
+        return jsonify({'error': f'{file_format} 导出需要安装 pyarrow：pip3 install pyarrow'}), 501
+
+    table, conditions, params = traffic_scope(iface, host)
+    start_ts = end_ts = None
+
+    if start_time and end_time:
+        start_dt = validate_datetime(start_time)
+        end_dt = validate_datetime(end_time)
+        if not start_dt or not end_dt:
+            return jsonify({'error': '无效的时间格式，请使用格式：YYYY-MM-DDTHH:MM'}), 400
+        start_ts, end_ts = to_epoch(start_dt), to_epoch(end_dt)
+        conditions = conditions + ['timestamp BETWEEN ? AND ?']
+        params = params + [start_ts, end_ts]
+
+    if file_format in ('arrow', 'parquet'):
+        batches = iter_export_batches(table, conditions, params, EXPORT_BATCH_ROWS, start_ts, end_ts)
+        chunks = iter_arrow_chunks(batches, file_format)
+    elif file_format == 'ndjson':
+        chunks = iter_ndjson_chunks(iter_export_batches(table, conditions, params, start_ts=start_ts, end_ts=end_ts))
+    else:
+        chunks = iter_csv_chunks(iter_export_batches(table, conditions, params, start_ts=start_ts, end_ts=end_ts))
+
+    extension, mimetype = EXPORT_CONTENT_TYPES[file_format]
+    filename = f'traffic_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extension}'
+    # Parquet 自带压缩，不再 gzip
+    if use_gzip and file_format != 'parquet':
+        chunks = iter_gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    return Response(
+        stream_with_context(logged_stream(chunks, f'export ({file_format})')),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@app.route('/api/export')
+def export_data():
+    """导出流量数据，format=csv（默认）/ ndjson / arrow / parquet"""
+    try:
+        return export_response(request.args.get('format', 'csv').lower())
+    except Exception as e:
+        app.logger.error(f'Error in export_data: {e}')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/export/csv')
+def export_csv():
+    """导出流量数据为 CSV 文件（流式输出，gzip=1 时压缩为 .csv.gz）"""
+    try:
+        return export_response('csv')
     except Exception as e:
         app.logger.error(f'Error in export_csv: {e}')
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/stats')
+@cached_response
 def get_stats():
-    """获取统计数据"""
+    """获取统计数据（读取采集脚本维护的汇总表，一次主键查询）"""
     try:
+        iface = request.args.get('iface', None)
+        host = request_host()
+
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # 总记录数
-        cursor.execute('SELECT COUNT(*) as count FROM traffic_data')
-        total_records = cursor.fetchone()['count']
-        
-        # 数据范围
-        cursor.execute('SELECT MIN(timestamp) as min_time, MAX(timestamp) as max_time FROM traffic_data')
-        range_row = cursor.fetchone()
-        
-        # 最新数据
-        cursor.execute('''
-            SELECT bytes_received, bytes_sent, timestamp 
-            FROM traffic_data 
-            ORDER BY timestamp DESC LIMIT 1
-        ''')
-        latest = cursor.fetchone()
-        
-        # 计算总流量
-        cursor.execute('SELECT SUM(bytes_received) as total_in, SUM(bytes_sent) as total_out FROM traffic_data')
-        sum_row = cursor.fetchone()
-        
-        conn.close()
-        
+        summary = conn.execute('''
+            SELECT record_count, min_time, max_time, first_time,
+                   latest_received, latest_sent, total_received, total_sent
+            FROM traffic_summary
+            WHERE host = ? AND iface = ?
+        ''', (host, iface or '')).fetchone()
+
+        has_data = summary is not None and summary['record_count'] > 0
         stats = {
-            'total_records': total_records,
-            'min_time': range_row['min_time'] if range_row else None,
-            'max_time': range_row['max_time'] if range_row else None,
-            'latest_received': latest['bytes_received'] if latest else 0,
-            'latest_sent': latest['bytes_sent'] if latest else 0,
-            'latest_timestamp': latest['timestamp'] if latest else None,
-            'total_received_sum': sum_row['total_in'] if sum_row and sum_row['total_in'] else 0,
-            'total_sent_sum': sum_row['total_out'] if sum_row and sum_row['total_out'] else 0
+            'iface': iface,
+            'host': host,
+            'total_records': summary['record_count'] if summary else 0,
+            'min_time': format_timestamp(summary['min_time']) if has_data else None,
+            'max_time': format_timestamp(summary['max_time']) if has_data else None,
+            'latest_received': summary['latest_received'] if has_data else 0,
+            'latest_sent': summary['latest_sent'] if has_data else 0,
+            'latest_timestamp': format_timestamp(summary['max_time']) if has_data else None,
+            # 自 total_since 起实际传输的字节数（按相邻采样增量累加，计数器重置已处理）
+            'total_received_sum': summary['total_received'] if summary else 0,
+            'total_sent_sum': summary['total_sent'] if summary else 0,
+            'total_since': format_timestamp(summary['first_time']) if summary and summary['first_time'] else None
         }
-        
+
         return jsonify(stats)
-        
+
     except Exception as e:
         app.logger.error(f'Error in get_stats: {e}')
         return jsonify({'error': str(e)}), 500
@@ -465,4 +1321,5 @@ if __name__ == '__main__':
     app.logger.info('Starting Network Traffic Web Server...')
     app.logger.info(f'Host: {WEB_HOST}, Port: {WEB_PORT}')
     app.logger.info(f'Alert config: {ALERT_CONFIG}')
+    app.logger.info('Using the Flask development server; run serve.py (waitress) in production')
     app.run(host=WEB_HOST, port=WEB_PORT, debug=False)